@@ -0,0 +1,357 @@
+import asyncio
+import json
+import os
+from typing import Optional, Union
+from concurrency import provider_semaphore
+from image_preprocessing import PreprocessedImage, get_image_preprocessor, image_size
+from instrumentation import BYTES_OUT, stage
+from pdf_engine import get_pdf_engine
+from purchase_orders import validate_purchase_order
+from token_budget import ResolutionStep, get_price, get_token_budget
+from transport import ProviderTransport, get_transport
+
+PDF_MIME_TYPE = "application/pdf"
+IMAGE_MIME_TYPES = ["image/jpeg", "image/png"]
+
+_EXTENSION_MIME_TYPES = {
+    ".pdf": PDF_MIME_TYPE,
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+}
+
+ExtractorInput = Union[bytes, memoryview, str, os.PathLike]
+
+# Tokens reserved against a provider's tokens/minute quota for one image request
+DEFAULT_ESTIMATED_TOKENS = 2000
+# Output tokens budgeted per page when several pages share one call
+PAGE_OUTPUT_TOKENS = 512
+# A reply this many characters per max_tokens long may have been cut off at the limit
+MIN_CHARS_PER_TOKEN = 2
+
+PAGES_PROMPT = (
+    "The attached images are {count} pages of packing slips, each preceded by its page number. "
+    "Extract the purchase order shown on every page and return one entry per page, with page set "
+    "to that page number and the fields read from that page only."
+)
+
+# (contents, MIME type) of one page image
+PageImage = tuple[Union[bytes, memoryview], str]
+
+
+def normalize_mime_type(mime_type: str) -> str:
+    """Map MIME type aliases such as image/jpg onto the canonical type."""
+    mime_type = mime_type.lower()
+    return "image/jpeg" if mime_type == "image/jpg" else mime_type
+
+
+def mime_type_for_path(file_path: Union[str, os.PathLike]) -> str:
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension not in _EXTENSION_MIME_TYPES:
+        raise ValueError(f"Unsupported file type: {file_extension}")
+    return _EXTENSION_MIME_TYPES[file_extension]
+
+
+def read_input(data: ExtractorInput, mime_type: Optional[str] = None) -> tuple[Union[bytes, memoryview], str]:
+    """
+    Resolve extractor input into raw bytes and a MIME type.
+    Paths are read from disk and their MIME type inferred from the extension;
+    bytes and memoryviews are used as-is and require mime_type.
+    """
+    if isinstance(data, (str, os.PathLike)):
+        with open(data, "rb") as f:
+            return f.read(), normalize_mime_type(mime_type or mime_type_for_path(data))
+    if not mime_type:
+        raise ValueError("mime_type is required when passing file contents directly.")
+    return data, normalize_mime_type(mime_type)
+
+
+async def read_input_async(data: ExtractorInput, mime_type: Optional[str] = None) -> tuple[Union[bytes, memoryview], str]:
+    """Like read_input, but reads paths in a worker thread."""
+    if isinstance(data, (str, os.PathLike)):
+        return await asyncio.to_thread(read_input, data, mime_type)
+    return read_input(data, mime_type)
+
+
+class BaseTextExtractor:
+    provider: str
+    model: str
+    prompt: str
+    # Limits for packing several pages into one call; 1 page per call disables packing
+    max_pages_per_call: int = 1
+    max_output_tokens: int = 4096
+    max_input_tokens: int = 100_000
+    max_request_bytes: int = 20 * 2**20
+
+    def __init__(self, max_concurrency: Optional[int] = None):
+        self.max_concurrency = max_concurrency
+        # Images are shrunk before upload; replace to change settings for one extractor
+        self.preprocessor = get_image_preprocessor()
+        # Picks the resolution and max_tokens of each image and counts spend
+        self.budget = get_token_budget()
+
+    @property
+    def transport(self) -> ProviderTransport:
+        """Rate limiter and retry policy shared by every extractor of this provider."""
+        return get_transport(self.provider)
+
+    @property
+    def pages_per_call(self) -> int:
+        """Most pages sent in one call: <PROVIDER>_PAGES_PER_CALL, else max_pages_per_call."""
+        value = os.getenv(f"{self.provider.upper()}_PAGES_PER_CALL")
+        return max(int(value), 1) if value else self.max_pages_per_call
+
+    def image_tokens(self, width: int, height: int) -> int:
+        """Input tokens the provider bills for an image of this size; about one per 750 pixels by default."""
+        return max(width * height // 750, 1)
+
+    def _estimated_input_tokens(self, data: Union[bytes, memoryview]) -> Optional[int]:
+        size = image_size(data)
+        if size is None:
+            return None
+        # Roughly four characters of prompt per token
+        return self.image_tokens(*size) + len(self.prompt) // 4
+
+    def _estimated_tokens(self, data: Union[bytes, memoryview], mime_type: str) -> int:
+        """Tokens one image will use, input and a typical purchase order's output, from its pixel size."""
+        input_tokens = self._estimated_input_tokens(data)
+        if input_tokens is None:
+            return DEFAULT_ESTIMATED_TOKENS
+        return input_tokens + PAGE_OUTPUT_TOKENS
+
+    def estimate_cost(self, data: Union[bytes, memoryview], mime_type: str) -> Optional[float]:
+        """
+        Estimate the USD cost of extracting one image from its pixel size and the provider's prices.
+        Returns None when the image cannot be read or the model has no price.
+        """
+        price = get_price(self.provider, self.model)
+        input_tokens = self._estimated_input_tokens(data)
+        if price is None or input_tokens is None:
+            return None
+        return price.cost(input_tokens, PAGE_OUTPUT_TOKENS)
+
+    def _token_usage(self, response) -> Optional[tuple[int, int]]:
+        """Read (input tokens, output tokens) from a provider response."""
+        return None
+
+    def _usage(self, response) -> Optional[int]:
+        """Record the spend of a provider response and return its total token count."""
+        usage = self._token_usage(response)
+        if usage is None:
+            return None
+        self.budget.record_usage(self.provider, self.model, *usage)
+        return sum(usage)
+
+    def _extract_image_text(self, data: Union[bytes, memoryview], mime_type: str, max_tokens: Optional[int] = None) -> str:
+        """Send one image; max_tokens overrides the provider's default output limit."""
+        raise NotImplementedError
+
+    async def _extract_image_text_async(self, data: Union[bytes, memoryview], mime_type: str, max_tokens: Optional[int] = None) -> str:
+        raise NotImplementedError
+
+    def _resolution_steps(self) -> list[ResolutionStep]:
+        return self.budget.steps(self.preprocessor.max_long_edge if self.preprocessor.enabled else None)
+
+    @staticmethod
+    def _should_escalate(text: str, image: PreprocessedImage, step: ResolutionStep) -> bool:
+        """
+        Whether an image should be re-sent at the next step: only when the reply is not a
+        valid purchase order, and either the image was downscaled to fit this step, so the
+        next one sends more pixels, or the reply may have been cut off at max_tokens.
+        A missing reply counts as an unparseable one.
+        """
+        text = text or ""
+        if validate_purchase_order(text) is not None:
+            return False
+        downscaled = step.max_long_edge is not None and image.width is not None and max(image.width, image.height) >= step.max_long_edge
+        cut_off = step.max_tokens is not None and len(text) >= step.max_tokens * MIN_CHARS_PER_TOKEN
+        return downscaled or cut_off
+
+    def _extract_image(self, data: Union[bytes, memoryview], mime_type: str) -> str:
+        """Extract one image at the cheapest resolution step that yields a purchase order."""
+        steps = self._resolution_steps()
+        for index, step in enumerate(steps):
+            with stage("preprocess", self.provider):
+                image = self.preprocessor.process(data, mime_type, step.max_long_edge)
+            BYTES_OUT.labels(self.provider).inc(len(image.data))
+            self.budget.record_attempt(self.provider, self.estimate_cost(image.data, image.mime_type), escalation=index > 0)
+            with stage("provider_call", self.provider, model=self.model):
+                text = self._extract_image_text(image.data, image.mime_type, step.max_tokens)
+            if index == len(steps) - 1 or not self._should_escalate(text, image, step):
+                break
+        self.budget.record_result(self.provider, step)
+        return text
+
+    async def _extract_image_async(self, data: Union[bytes, memoryview], mime_type: str) -> str:
+        steps = self._resolution_steps()
+        for index, step in enumerate(steps):
+            with stage("preprocess", self.provider):
+                image = await self.preprocessor.process_async(data, mime_type, step.max_long_edge)
+            BYTES_OUT.labels(self.provider).inc(len(image.data))
+            self.budget.record_attempt(self.provider, self.estimate_cost(image.data, image.mime_type), escalation=index > 0)
+            async with provider_semaphore(self.provider, self.max_concurrency):
+                with stage("provider_call", self.provider, model=self.model):
+                    text = await self._extract_image_text_async(image.data, image.mime_type, step.max_tokens)
+            if index == len(steps) - 1 or not self._should_escalate(text, image, step):
+                break
+        self.budget.record_result(self.provider, step)
+        return text
+
+    def _extract_pages_text(self, pages: list[PreprocessedImage]) -> str:
+        """Send several pages in one call; returns JSON with one entry per page under "pages"."""
+        raise NotImplementedError
+
+    async def _extract_pages_text_async(self, pages: list[PreprocessedImage]) -> str:
+        raise NotImplementedError
+
+    def _pack_pages(self, pages: list[PreprocessedImage]) -> list[list[int]]:
+        """
+        Group page indexes into calls, keeping each call within the provider's page,
+        input token, output token and request size limits.
+        """
+        limit = min(self.pages_per_call, max(self.max_output_tokens // PAGE_OUTPUT_TOKENS, 1))
+        groups: list[list[int]] = []
+        current: list[int] = []
+        tokens = size = 0
+        for index, page in enumerate(pages):
+            page_tokens = self._estimated_tokens(page.data, page.mime_type)
+            # Images travel base64 encoded
+            page_size = len(page.data) * 4 // 3
+            if current and (
+                len(current) == limit
+                or tokens + page_tokens > self.max_input_tokens
+                or size + page_size > self.max_request_bytes
+            ):
+                groups.append(current)
+                current, tokens, size = [], 0, 0
+            current.append(index)
+            tokens += page_tokens
+            size += page_size
+        if current:
+            groups.append(current)
+        return groups
+
+    @staticmethod
+    def _split_pages(text: str, count: int) -> list[Optional[str]]:
+        """
+        Split a multi-page response into per-page JSON; pages missing from it are None.
+        A response that is not an object with a list of page objects under "pages", e.g.
+        a blocked or truncated reply, leaves every page missing, like one naming no pages.
+        """
+        results: list[Optional[str]] = [None] * count
+        try:
+            entries = json.loads(text)["pages"]
+        except (ValueError, TypeError, KeyError):
+            return results
+        if not isinstance(entries, list):
+            return results
+        for position, entry in enumerate(entries):
+            if not isinstance(entry, dict):
+                continue
+            page = entry.pop("page", position + 1)
+            # bool is an int subclass, but true is not a page number
+            if isinstance(page, int) and not isinstance(page, bool) and 1 <= page <= count and results[page - 1] is None:
+                results[page - 1] = json.dumps(entry)
+        return results
+
+    def _extract_group(self, pages: list[PreprocessedImage]) -> list[str]:
+        if len(pages) == 1:
+            with stage("provider_call", self.provider, model=self.model):
+                return [self._extract_image_text(pages[0].data, pages[0].mime_type)]
+        with stage("provider_call", self.provider, model=self.model, pages=len(pages)):
+            results = self._split_pages(self._extract_pages_text(pages), len(pages))
+        # Pages the response left out are retried on their own
+        return [
+            text if text is not None else self._extract_group([page])[0]
+            for page, text in zip(pages, results)
+        ]
+
+    async def _extract_group_async(self, pages: list[PreprocessedImage]) -> list[str]:
+        if len(pages) == 1:
+            async with provider_semaphore(self.provider, self.max_concurrency):
+                with stage("provider_call", self.provider, model=self.model):
+                    return [await self._extract_image_text_async(pages[0].data, pages[0].mime_type)]
+        async with provider_semaphore(self.provider, self.max_concurrency):
+            with stage("provider_call", self.provider, model=self.model, pages=len(pages)):
+                results = self._split_pages(await self._extract_pages_text_async(pages), len(pages))
+        missing = [index for index, text in enumerate(results) if text is None]
+        retried = await asyncio.gather(*(self._extract_group_async([pages[index]]) for index in missing))
+        for index, (text,) in zip(missing, retried):
+            results[index] = text
+        return results
+
+    def extract_text(self, data: ExtractorInput, mime_type: Optional[str] = None) -> str:
+        """
+        Extract text from an image or PDF.
+
+        Args:
+            data (bytes | memoryview | str): File contents, or a path to the file
+            mime_type (Optional[str]): MIME type of the contents; inferred from the extension for paths
+
+        Returns:
+            str: Extracted text from the file
+        """
+        data, mime_type = read_input(data, mime_type)
+
+        if mime_type == PDF_MIME_TYPE:
+            # For PDFs, extract text directly using PyMuPDF
+            with stage("pdf_extract"):
+                return get_pdf_engine().extract_text(data)
+        elif mime_type in IMAGE_MIME_TYPES:
+            return self._extract_image(data, mime_type)
+        else:
+            raise ValueError(f"Unsupported file type: {mime_type}")
+
+    async def extract_text_async(self, data: ExtractorInput, mime_type: Optional[str] = None) -> str:
+        """
+        Extract text from an image or PDF without blocking the event loop.
+        Vision API calls are bounded by the provider semaphore.
+
+        Args:
+            data (bytes | memoryview | str): File contents, or a path to the file
+            mime_type (Optional[str]): MIME type of the contents; inferred from the extension for paths
+
+        Returns:
+            str: Extracted text from the file
+        """
+        data, mime_type = await read_input_async(data, mime_type)
+
+        if mime_type == PDF_MIME_TYPE:
+            with stage("pdf_extract"):
+                return await get_pdf_engine().extract_text_async(data)
+        elif mime_type in IMAGE_MIME_TYPES:
+            return await self._extract_image_async(data, mime_type)
+        else:
+            raise ValueError(f"Unsupported file type: {mime_type}")
+
+    def extract_pages(self, pages: list[PageImage]) -> list[str]:
+        """
+        Extract text from the page images of one document.
+        Pages are packed into as few provider calls as the provider's limits allow, and
+        the response is split back into one result per page.
+
+        Args:
+            pages (list[tuple[bytes, str]]): (contents, MIME type) of each page, in order
+
+        Returns:
+            list[str]: Extracted text of each page, in the same order
+        """
+        with stage("preprocess", self.provider, pages=len(pages)):
+            images = [self.preprocessor.process(data, normalize_mime_type(mime_type)) for data, mime_type in pages]
+        BYTES_OUT.labels(self.provider).inc(sum(len(image.data) for image in images))
+        return [
+            text
+            for group in self._pack_pages(images)
+            for text in self._extract_group([images[index] for index in group])
+        ]
+
+    async def extract_pages_async(self, pages: list[PageImage]) -> list[str]:
+        """Async variant of extract_pages; the calls for each group of pages run concurrently."""
+        with stage("preprocess", self.provider, pages=len(pages)):
+            images = await asyncio.gather(*(
+                self.preprocessor.process_async(data, normalize_mime_type(mime_type)) for data, mime_type in pages
+            ))
+        BYTES_OUT.labels(self.provider).inc(sum(len(image.data) for image in images))
+        groups = self._pack_pages(images)
+        results = await asyncio.gather(*(self._extract_group_async([images[index] for index in group]) for group in groups))
+        return [text for group in results for text in group]
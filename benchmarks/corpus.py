@@ -0,0 +1,109 @@
+import io
+import random
+from typing import Optional
+import fitz
+from PIL import Image, ImageDraw, ImageFont
+
+# Page sizes in pixels: a shipping label, a letter page at 150 dpi and a 12 MP phone photo
+IMAGE_SIZES = {
+    "small": (800, 600),
+    "medium": (1275, 1650),
+    "large": (3024, 4032),
+}
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow built without FreeType
+        return ImageFont.load_default()
+
+
+def slip_lines(rng: random.Random) -> list[str]:
+    """Text of a random packing slip."""
+    lines = [
+        "PACKING SLIP",
+        f"Purchase Order: #ORDER_{rng.randint(100, 99999)}",
+        f"Tracking Number: LZ{rng.randint(10**7, 10**8 - 1)}",
+        f"Date: March {rng.randint(1, 28)}th, 2025",
+        f"Ship To: Customer {rng.randint(1, 5000)}",
+        f"{rng.randint(1, 9999)} Main St, Anytown, USA",
+        "",
+        "Item                      Qty      Price",
+    ]
+    for index in range(rng.randint(1, 12)):
+        lines.append(f"Item {index + 1:<20} {rng.randint(1, 50):>4} {rng.uniform(1, 500):>10.2f}")
+    return lines
+
+
+def slip_image(size: str = "medium", seed: Optional[int] = None, image_format: str = "JPEG", noise: bool = True) -> bytes:
+    """
+    Render a synthetic packing slip as an image.
+    With noise, sensor-like grain is blended in so the file compresses like a photo
+    rather than a clean render.
+
+    Args:
+        size (str): small, medium or large; see IMAGE_SIZES
+        seed (Optional[int]): Makes the slip contents and noise reproducible
+        image_format (str): JPEG or PNG
+        noise (bool): Blend in photo grain
+
+    Returns:
+        bytes: The encoded image
+    """
+    rng = random.Random(seed)
+    width, height = IMAGE_SIZES[size]
+    image = Image.new("RGB", (width, height), (250, 248, 240))
+    draw = ImageDraw.Draw(image)
+    font_size = max(height // 60, 10)
+    font = _font(font_size)
+    y = height // 20
+    for line in slip_lines(rng):
+        draw.text((width // 15, y), line, fill=(20, 20, 20), font=font)
+        y += int(font_size * 1.6)
+    if noise:
+        grain = Image.effect_noise((width, height), 12 + rng.random() * 4).convert("RGB")
+        image = Image.blend(image, grain, 0.08)
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=90)
+    return buffer.getvalue()
+
+
+def slip_pdf(pages: int = 10, scanned: bool = False, seed: Optional[int] = None) -> bytes:
+    """
+    Build a multi-page packing slip PDF.
+
+    Args:
+        pages (int): Number of pages
+        scanned (bool): Pages are embedded images with no text layer, like a scanner's output
+        seed (Optional[int]): Makes the contents reproducible
+
+    Returns:
+        bytes: The PDF document
+    """
+    rng = random.Random(seed)
+    document = fitz.open()
+    try:
+        for page_index in range(pages):
+            page = document.new_page(width=612, height=792)
+            if scanned:
+                page.insert_image(page.rect, stream=slip_image("medium", seed=rng.randint(0, 2**31)))
+            else:
+                page.insert_text((54, 72), "\n".join(slip_lines(rng)), fontsize=11)
+        return document.tobytes(deflate=True)
+    finally:
+        document.close()
+
+
+def image_corpus(count: int, size: str = "medium", seed: int = 0) -> list[bytes]:
+    """count distinct slip images, so none of them hit the extraction cache."""
+    return [slip_image(size, seed=seed + index) for index in range(count)]
+
+
+def pdf_corpus(count: int, pages: int = 10, scanned_fraction: float = 0.5, seed: int = 0) -> list[tuple[bytes, bool]]:
+    """count distinct PDFs as (data, scanned) pairs; roughly scanned_fraction of them are scanned."""
+    rng = random.Random(seed)
+    return [
+        (slip_pdf(pages, scanned=scanned, seed=seed + index), scanned)
+        for index, scanned in ((index, rng.random() < scanned_fraction) for index in range(count))
+    ]
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+import httpx
+import transport
+from purchase_orders import default_purchase_orders
+
+
+@dataclass
+class ProviderProfile:
+    """
+    Latency and error distribution of a fake provider.
+    Latencies are log-normal around median seconds with shape sigma (0 for a fixed
+    latency). A fraction error_rate of calls fails with error_status after the same delay.
+    """
+    median: float = 0.5
+    sigma: float = 0.3
+    error_rate: float = 0.0
+    error_status: int = 503
+
+    def delay(self, rng: random.Random) -> float:
+        return self.median * rng.lognormvariate(0.0, self.sigma) if self.sigma else self.median
+
+
+def _count_images(provider: str, body: dict) -> int:
+    if provider == "google":
+        return sum(
+            1 for content in body.get("contents", []) for part in content.get("parts", [])
+            if "inlineData" in part or "inline_data" in part
+        )
+    image_type = "image" if provider == "claude" else "image_url"
+    return sum(
+        1 for message in body.get("messages", []) for block in message.get("content", [])
+        if isinstance(block, dict) and block.get("type") == image_type
+    )
+
+
+def _provider_for(request: httpx.Request) -> str:
+    path = request.url.path
+    if "generateContent" in path:
+        return "google"
+    if path.endswith("/messages"):
+        return "claude"
+    if path.endswith("/chat/completions"):
+        return "openai"
+    raise ValueError(f"No fake provider for {request.url}")
+
+
+class FakeProviderTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    def __init__(self, profiles: Optional[dict[str, ProviderProfile]] = None, seed: Optional[int] = None):
+        """
+        An httpx transport that answers Gemini, Anthropic and OpenAI API calls locally.
+        Installed as the shared HTTP client, it lets the real SDKs, retry policy and rate
+        limiters run without network access or spend. Responses carry a purchase order from
+        the demo data in each provider's structured-output format, with token usage.
+        """
+        self.profiles = profiles or {}
+        self.calls: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self._rng = random.Random(seed)
+        self._orders = default_purchase_orders()
+        self._lock = threading.Lock()
+
+    def _plan(self, request: httpx.Request) -> tuple[str, float, bool, Optional[int]]:
+        provider = _provider_for(request)
+        body = json.loads(request.content)
+        # Multi-page requests ask for a "pages" array and get one entry per image
+        pages = _count_images(provider, body) if b'"pages"' in request.content else None
+        profile = self.profiles.get(provider, ProviderProfile())
+        with self._lock:
+            self.calls[provider] = self.calls.get(provider, 0) + 1
+            delay = profile.delay(self._rng)
+            failed = self._rng.random() < profile.error_rate
+            if failed:
+                self.errors[provider] = self.errors.get(provider, 0) + 1
+        return provider, delay, failed, pages
+
+    def _response(self, provider: str, failed: bool, pages: Optional[int] = None) -> httpx.Response:
+        if failed:
+            status = self.profiles.get(provider, ProviderProfile()).error_status
+            return httpx.Response(status, json={"error": {"code": status, "message": "Simulated failure", "status": "UNAVAILABLE"}})
+        with self._lock:
+            order = self._rng.choice(self._orders).model_dump(exclude_none=True)
+        if pages is not None:
+            order = {"pages": [{"page": number, **order} for number in range(1, pages + 1)]}
+        text = json.dumps(order)
+        if provider == "google":
+            body = {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                "usageMetadata": {"promptTokenCount": 1100, "candidatesTokenCount": 150, "totalTokenCount": 1250},
+            }
+        elif provider == "claude":
+            body = {
+                "id": "msg_fake", "type": "message", "role": "assistant", "model": "fake",
+                "content": [{"type": "tool_use", "id": "toolu_fake", "name": "record_purchase_order", "input": order}],
+                "stop_reason": "tool_use", "usage": {"input_tokens": 1600, "output_tokens": 150},
+            }
+        else:
+            body = {
+                "id": "chatcmpl_fake", "object": "chat.completion", "created": int(time.time()), "model": "fake",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": 1100, "completion_tokens": 150, "total_tokens": 1250},
+            }
+        return httpx.Response(200, json=body)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        provider, delay, failed, pages = self._plan(request)
+        time.sleep(delay)
+        return self._response(provider, failed, pages)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        provider, delay, failed, pages = self._plan(request)
+        await asyncio.sleep(delay)
+        return self._response(provider, failed, pages)
+
+
+def install_fake_providers(fake: FakeProviderTransport):
+    """
+    Route the shared provider HTTP clients to fake. Must run before any extractor is
+    constructed, i.e. before main is imported.
+    """
+    transport._http_client = httpx.Client(transport=fake)
+    transport._async_http_client = httpx.AsyncClient(transport=fake)
@@ -0,0 +1,317 @@
+"""
+Load-test the FastAPI app in-process against fake vision providers.
+
+    python -m benchmarks.run --scenario all --requests 200 --concurrency 16 --output results.json
+
+Run from the repository root. Provider SDK calls are answered by FakeProviderTransport,
+so the SDKs, retry policy, rate limiters, pre-processing, parsing and order lookup all run
+for real without network access or API spend. The report also records the cold import time
+of main and how long the app takes to warm its first provider.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+import httpx
+from benchmarks.corpus import image_corpus, pdf_corpus
+from benchmarks.fake_providers import FakeProviderTransport, ProviderProfile, install_fake_providers
+
+SCENARIOS = ["single", "batch", "pdf", "cache-hot"]
+
+# Seed offsets keep each scenario's images distinct, so one scenario cannot warm another's cache
+SEED_OFFSETS = {"single": 0, "batch": 1_000_000, "pdf": 2_000_000, "cache-hot": 3_000_000}
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def _current_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class RssSampler:
+    def __init__(self, interval: float = 0.01):
+        """Track the peak resident set size of this process while a scenario runs."""
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = _current_rss()
+            if rss is None:
+                return
+            self.peak = max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        if self.peak == 0:
+            # No /proc: fall back to the lifetime peak (kilobytes on Linux)
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    @property
+    def peak_mb(self) -> float:
+        return round(self.peak / 2**20, 1)
+
+
+def _stage_totals() -> dict[tuple[str, str], tuple[float, float]]:
+    """Current (sum, count) of every stage histogram series."""
+    from instrumentation import STAGE_SECONDS
+
+    totals: dict[tuple[str, str], list[float]] = {}
+    for metric in STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            key = (sample.labels["provider"], sample.labels.get("stage"))
+            if sample.name.endswith("_sum"):
+                totals.setdefault(key, [0.0, 0.0])[0] = sample.value
+            elif sample.name.endswith("_count"):
+                totals.setdefault(key, [0.0, 0.0])[1] = sample.value
+    return {key: (value[0], value[1]) for key, value in totals.items()}
+
+
+def _stage_means(before: dict, after: dict) -> dict[str, dict]:
+    stages = {}
+    for (provider, stage), (total, count) in after.items():
+        previous_total, previous_count = before.get((provider, stage), (0.0, 0.0))
+        calls = count - previous_count
+        if calls:
+            stages[f"{stage}:{provider}"] = {
+                "count": int(calls),
+                "mean_ms": round((total - previous_total) / calls * 1000, 3),
+            }
+    return stages
+
+
+async def drive(request: Callable[[int], Awaitable[httpx.Response]], total: int, concurrency: int) -> tuple[list[float], int, float]:
+    """
+    Send total requests from concurrency closed-loop workers.
+
+    Returns:
+        tuple: Per-request latencies in seconds, the number of failed requests, and wall time
+    """
+    latencies: list[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal errors, next_index
+        while next_index < total:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                response = await request(index)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+    return latencies, errors, time.perf_counter() - started
+
+
+def build_scenario(name: str, client: httpx.AsyncClient, args) -> tuple[Callable[[int], Awaitable[httpx.Response]], int, int, list]:
+    """
+    Build the corpus and request function of a scenario.
+
+    Returns:
+        tuple: (request function, number of requests, items per request, warm-up indexes)
+    """
+    seed = args.seed + SEED_OFFSETS[name]
+    if name == "single":
+        images = image_corpus(args.requests, args.image_size, seed=seed)
+
+        def request(index: int):
+            files = {"file": (f"slip-{index}.jpg", images[index], "image/jpeg")}
+            return client.post(f"/upload/image/{args.provider}", files=files)
+        return request, args.requests, 1, []
+
+    if name == "cache-hot":
+        images = image_corpus(args.hot_set, args.image_size, seed=seed)
+
+        def request(index: int):
+            files = {"file": (f"slip-{index}.jpg", images[index % len(images)], "image/jpeg")}
+            return client.post(f"/upload/image/{args.provider}", files=files)
+        # Every distinct image is requested once before timing so the timed run is all hits
+        return request, args.requests, 1, list(range(len(images)))
+
+    if name == "batch":
+        batches = max(args.requests // args.batch_size, 1)
+        images = image_corpus(batches * args.batch_size, args.image_size, seed=seed)
+
+        def request(index: int):
+            chunk = images[index * args.batch_size:(index + 1) * args.batch_size]
+            files = [("files", (f"slip-{index}-{i}.jpg", data, "image/jpeg")) for i, data in enumerate(chunk)]
+            return client.post("/upload/batch", params={"provider": args.provider}, files=files)
+        return request, batches, args.batch_size, []
+
+    if name == "pdf":
+        documents = pdf_corpus(args.pdf_requests, pages=args.pdf_pages, scanned_fraction=args.scanned_fraction, seed=seed)
+
+        def request(index: int):
+            data, scanned = documents[index]
+            params = {"provider": args.provider} if scanned else {}
+            return client.post("/upload/pdf", params=params, files={"file": (f"order-{index}.pdf", data, "application/pdf")})
+        return request, len(documents), 1, []
+
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+def measure_import_seconds() -> Optional[float]:
+    """Time a cold import of main in a fresh interpreter, i.e. the start-up cost before serving."""
+    code = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+    try:
+        completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        return round(float(completed.stdout.strip().splitlines()[-1]), 3)
+    except (OSError, ValueError, IndexError, subprocess.CalledProcessError):
+        return None
+
+
+async def wait_until_ready(registry, timeout: float = 60.0) -> Optional[float]:
+    """Seconds from app start-up until the first provider is warmed, or None on timeout."""
+    started = time.perf_counter()
+    while not registry.ready:
+        if time.perf_counter() - started > timeout:
+            return None
+        await asyncio.sleep(0.005)
+    return round(time.perf_counter() - started, 3)
+
+
+async def run_scenarios(args, fake: FakeProviderTransport) -> tuple[list[dict], dict]:
+    module = importlib.import_module("main")
+    app = module.app
+    results = []
+    await app.router.startup()
+    startup = {"ready_seconds": await wait_until_ready(module.provider_registry)}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None) as client:
+            for name in (SCENARIOS if args.scenario == "all" else [args.scenario]):
+                request, total, items_per_request, warm_up = build_scenario(name, client, args)
+                for index in warm_up:
+                    await request(index)
+
+                calls_before = dict(fake.calls)
+                stages_before = _stage_totals()
+                with RssSampler() as rss:
+                    latencies, errors, duration = await drive(request, total, args.concurrency)
+                latencies.sort()
+
+                results.append({
+                    "scenario": name,
+                    "requests": total,
+                    "items": total * items_per_request,
+                    "concurrency": args.concurrency,
+                    "errors": errors,
+                    "duration_seconds": round(duration, 3),
+                    "requests_per_second": round(total / duration, 2),
+                    "items_per_second": round(total * items_per_request / duration, 2),
+                    "latency_seconds": {
+                        "p50": _percentile(latencies, 0.50),
+                        "p95": _percentile(latencies, 0.95),
+                        "p99": _percentile(latencies, 0.99),
+                        "max": latencies[-1] if latencies else None,
+                    },
+                    "peak_rss_mb": rss.peak_mb,
+                    "provider_calls": {
+                        provider: count - calls_before.get(provider, 0) for provider, count in fake.calls.items()
+                    },
+                    "stages": _stage_means(stages_before, _stage_totals()),
+                })
+                print(
+                    f"{name:<10} {results[-1]['requests_per_second']:>8} req/s  "
+                    f"p50 {results[-1]['latency_seconds']['p50'] or 0:.3f}s  p95 {results[-1]['latency_seconds']['p95'] or 0:.3f}s  "
+                    f"p99 {results[-1]['latency_seconds']['p99'] or 0:.3f}s  errors {errors}  rss {rss.peak_mb} MB",
+                    file=sys.stderr,
+                )
+    finally:
+        await app.router.shutdown()
+    startup["providers"] = module.provider_registry.status()
+    return results, startup
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the OCR API against fake vision providers.")
+    parser.add_argument("--scenario", choices=SCENARIOS + ["all"], default="all")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per image scenario; items for batch")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--provider", default="google", help="Provider used by the image, batch and scanned PDF requests")
+    parser.add_argument("--image-size", choices=["small", "medium", "large"], default="medium")
+    parser.add_argument("--batch-size", type=int, default=10, help="Images per batch request")
+    parser.add_argument("--hot-set", type=int, default=5, help="Distinct images repeated in the cache-hot scenario")
+    parser.add_argument("--pdf-requests", type=int, default=20)
+    parser.add_argument("--pdf-pages", type=int, default=10)
+    parser.add_argument("--scanned-fraction", type=float, default=0.5, help="Share of PDFs without a text layer")
+    parser.add_argument("--latency", type=float, default=0.5, help="Median fake provider latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="Log-normal shape of provider latency; 0 for fixed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of provider calls that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None):
+    args = parse_args(argv)
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ.setdefault("LOG_LEVEL", "warning")
+    # Keep archived orders out of the working tree
+    os.environ.setdefault("ORDER_ARCHIVE_DIR", tempfile.mkdtemp(prefix="ocr-archive-"))
+
+    profile = ProviderProfile(args.latency, args.latency_sigma, args.error_rate, args.error_status)
+    fake = FakeProviderTransport({provider: profile for provider in ("google", "claude", "openai")}, seed=args.seed)
+    install_fake_providers(fake)
+
+    import_seconds = measure_import_seconds()
+    results, startup = asyncio.run(run_scenarios(args, fake))
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "startup": {"import_seconds": import_seconds, **startup},
+        "scenarios": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
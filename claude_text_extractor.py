@@ -1,81 +1,159 @@
+import json
+import math
 import os
-from anthropic import Anthropic
-from typing import Optional
+from anthropic import Anthropic, AsyncAnthropic
+from typing import Optional, Union
 import base64
-import io
-import fitz  # PyMuPDF for PDF processing
+from base_text_extractor import PAGES_PROMPT, BaseTextExtractor
+from image_preprocessing import PreprocessedImage
+from purchase_orders import purchase_order_pages_schema, purchase_order_schema
+from transport import get_async_http_client, get_http_client
 
+PROMPT = "Extract the packing slip in this image as a purchase order: tracking number, date, customer name and address, purchase order number, and every item with its quantity and price."
+TOOL_NAME = "record_purchase_order"
+PAGES_TOOL_NAME = "record_purchase_order_pages"
 
-class TextExtractor:
-    def __init__(self, api_key: Optional[str] = None):
+
+class TextExtractor(BaseTextExtractor):
+    provider = "claude"
+    model = "claude-3-sonnet-20240229"
+    prompt = PROMPT
+    max_pages_per_call = 8
+    max_output_tokens = 4096
+    max_input_tokens = 200_000
+    max_request_bytes = 32 * 2**20
+
+    def __init__(self, api_key: Optional[str] = None, max_concurrency: Optional[int] = None):
         """
         Initialize the TextExtractor with Claude API key.
         If api_key is not provided, it will look for ANTHROPIC_API_KEY environment variable.
+        max_concurrency bounds in-flight async calls; defaults to CLAUDE_MAX_CONCURRENCY.
         """
+        super().__init__(max_concurrency)
         self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
         if not self.api_key:
             raise ValueError("API key is required. Either pass it to the constructor or set ANTHROPIC_API_KEY environment variable.")
-        
-        self.client = 5#Anthropic(api_key=self.api_key)
-    
-    def _encode_image(self, image_path: str) -> str:
-        """Convert image to base64 string."""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    
-    def _extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extract text from PDF using PyMuPDF."""
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        return text
-    
-    def extract_text(self, file_path: str) -> str:
-        """
-        Extract text from an image or PDF file using Claude's Vision API.
-        
-        Args:
-            file_path (str): Path to the image or PDF file
-            
-        Returns:
-            str: Extracted text from the file
-        """
-        file_extension = os.path.splitext(file_path)[1].lower()
-        
-        if file_extension in ['.pdf']:
-            # For PDFs, extract text directly using PyMuPDF
-            return self._extract_text_from_pdf(file_path)
-        elif file_extension in ['.jpg', '.jpeg', '.png']:
-            # For images, use Claude's Vision API
-            base64_image = self._encode_image(file_path)
-            
-            message = self.client.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=4096,
-                messages=[
+
+        # Retries are handled by the shared transport, not the SDK
+        self.client = Anthropic(api_key=self.api_key, http_client=get_http_client(), max_retries=0)
+        self.async_client = AsyncAnthropic(api_key=self.api_key, http_client=get_async_http_client(), max_retries=0)
+        # Claude returns structured output through a forced tool call whose input follows the PurchaseOrder schema
+        self.tools = [{
+            "name": TOOL_NAME,
+            "description": "Record the purchase order read from a packing slip.",
+            "input_schema": purchase_order_schema()
+        }]
+        self.tool_choice = {"type": "tool", "name": TOOL_NAME}
+        self.pages_tools = [{
+            "name": PAGES_TOOL_NAME,
+            "description": "Record the purchase order read from each page of a packing slip.",
+            "input_schema": purchase_order_pages_schema()
+        }]
+        self.pages_tool_choice = {"type": "tool", "name": PAGES_TOOL_NAME}
+
+    def _build_messages(self, image_data: Union[bytes, memoryview], mime_type: str) -> list:
+        """Build the messages payload for a Claude Vision request."""
+        return [
+            {
+                "role": "user",
+                "content": [
                     {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Please extract all the text content from this image. Format it in a clean, readable way."
-                            },
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/jpeg",
-                                    "data": base64_image
-                                }
-                            }
-                        ]
-                    }
+                        "type": "text",
+                        "text": PROMPT
+                    },
+                    self._image_block(image_data, mime_type)
                 ]
-            )
-            
-            return message.content[0].text
-        else:
-            raise ValueError(f"Unsupported file type: {file_extension}")
+            }
+        ]
+
+    @staticmethod
+    def _image_block(image_data: Union[bytes, memoryview], mime_type: str) -> dict:
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": mime_type,
+                "data": base64.b64encode(image_data).decode('utf-8')
+            }
+        }
+
+    def _build_pages_messages(self, pages: list[PreprocessedImage]) -> list:
+        """Build a Claude request for several pages, each image preceded by its page number."""
+        content = [{"type": "text", "text": PAGES_PROMPT.format(count=len(pages))}]
+        for number, page in enumerate(pages, start=1):
+            content.append({"type": "text", "text": f"Page {number}:"})
+            content.append(self._image_block(page.data, page.mime_type))
+        return [{"role": "user", "content": content}]
+
+    @staticmethod
+    def _response_text(message) -> str:
+        """Return the tool input as JSON, or the text if Claude answered without the tool."""
+        for block in message.content:
+            if block.type == "tool_use":
+                return json.dumps(block.input)
+        return "".join(block.text for block in message.content if block.type == "text")
+
+    def image_tokens(self, width: int, height: int) -> int:
+        # Claude scales images to at most 1568 pixels a side and about 1.15 megapixels, then bills a token per 750 pixels
+        scale = min(1.0, 1568 / max(width, height), math.sqrt(1_150_000 / (width * height)))
+        return max(int(width * scale) * int(height * scale) // 750, 1)
+
+    @staticmethod
+    def _token_usage(message) -> tuple[int, int]:
+        return message.usage.input_tokens, message.usage.output_tokens
+
+    def _extract_image_text(self, data: Union[bytes, memoryview], mime_type: str, max_tokens: Optional[int] = None) -> str:
+        message = self.transport.call(
+            lambda: self.client.messages.create(
+                model=self.model,
+                max_tokens=max_tokens or 4096,
+                messages=self._build_messages(data, mime_type),
+                tools=self.tools,
+                tool_choice=self.tool_choice
+            ),
+            estimated_tokens=self._estimated_tokens(data, mime_type),
+            usage=self._usage
+        )
+        return self._response_text(message)
+
+    async def _extract_image_text_async(self, data: Union[bytes, memoryview], mime_type: str, max_tokens: Optional[int] = None) -> str:
+        message = await self.transport.call_async(
+            lambda: self.async_client.messages.create(
+                model=self.model,
+                max_tokens=max_tokens or 4096,
+                messages=self._build_messages(data, mime_type),
+                tools=self.tools,
+                tool_choice=self.tool_choice
+            ),
+            estimated_tokens=self._estimated_tokens(data, mime_type),
+            usage=self._usage
+        )
+        return self._response_text(message)
+
+    def _extract_pages_text(self, pages: list[PreprocessedImage]) -> str:
+        message = self.transport.call(
+            lambda: self.client.messages.create(
+                model=self.model,
+                max_tokens=self.max_output_tokens,
+                messages=self._build_pages_messages(pages),
+                tools=self.pages_tools,
+                tool_choice=self.pages_tool_choice
+            ),
+            estimated_tokens=sum(self._estimated_tokens(page.data, page.mime_type) for page in pages),
+            usage=self._usage
+        )
+        return self._response_text(message)
 
+    async def _extract_pages_text_async(self, pages: list[PreprocessedImage]) -> str:
+        message = await self.transport.call_async(
+            lambda: self.async_client.messages.create(
+                model=self.model,
+                max_tokens=self.max_output_tokens,
+                messages=self._build_pages_messages(pages),
+                tools=self.pages_tools,
+                tool_choice=self.pages_tool_choice
+            ),
+            estimated_tokens=sum(self._estimated_tokens(page.data, page.mime_type) for page in pages),
+            usage=self._usage
+        )
+        return self._response_text(message)
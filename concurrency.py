@@ -0,0 +1,42 @@
+import asyncio
+import os
+from typing import Optional
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+# One semaphore per provider, shared by every extractor instance of that provider
+_semaphores: dict[str, tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = {}
+
+
+def get_max_concurrency(provider: str) -> int:
+    """
+    Read the concurrency limit for a provider from the environment.
+    Looks for <PROVIDER>_MAX_CONCURRENCY, e.g. GOOGLE_MAX_CONCURRENCY=16.
+    """
+    value = os.getenv(f"{provider.upper()}_MAX_CONCURRENCY")
+    if not value:
+        return DEFAULT_MAX_CONCURRENCY
+    limit = int(value)
+    if limit < 1:
+        raise ValueError(f"{provider.upper()}_MAX_CONCURRENCY must be at least 1, got {limit}")
+    return limit
+
+
+def provider_semaphore(provider: str, limit: Optional[int] = None) -> asyncio.Semaphore:
+    """
+    Return the semaphore bounding in-flight API calls for a provider.
+
+    Args:
+        provider (str): Provider name, e.g. "google", "claude" or "openai"
+        limit (Optional[int]): Concurrency limit; defaults to the environment setting
+
+    Returns:
+        asyncio.Semaphore: Semaphore bound to the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    entry = _semaphores.get(provider)
+    if entry is None or entry[0] is not loop:
+        semaphore = asyncio.Semaphore(limit or get_max_concurrency(provider))
+        _semaphores[provider] = (loop, semaphore)
+        return semaphore
+    return entry[1]
@@ -0,0 +1,380 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Optional, Union
+from base_text_extractor import PDF_MIME_TYPE, ExtractorInput, PageImage, read_input, read_input_async
+from instrumentation import NEAR_DUPLICATES, stage
+from perceptual_hash import ImageHash, NearDuplicate, PerceptualHashIndex, image_hash, set_last_near_duplicate
+
+DEFAULT_MEMORY_ENTRIES = 1024
+DEFAULT_DISK_ENTRIES = 100_000
+# Share of max_disk_entries the disk tier may grow past before it is trimmed back
+DISK_EVICTION_SLACK = 0.1
+# Seconds to wait for another process's write lock on the SQLite tier
+DB_BUSY_TIMEOUT = 10.0
+
+_last_served_from_cache: ContextVar[bool] = ContextVar("last_served_from_cache", default=False)
+
+
+def get_last_served_from_cache() -> bool:
+    """Return whether the last extraction in this context was answered without calling the provider."""
+    return _last_served_from_cache.get()
+
+
+def set_last_served_from_cache(served: bool):
+    _last_served_from_cache.set(served)
+
+
+class ExtractionCache:
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MEMORY_ENTRIES,
+        db_path: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        max_disk_entries: int = DEFAULT_DISK_ENTRIES,
+    ):
+        """
+        Initialize a two-tier extraction result cache.
+        The memory tier is an LRU of at most max_entries results. When db_path is set,
+        results are also written to a SQLite file that survives restarts, can be shared
+        by several worker processes, and is trimmed to max_disk_entries by least-recent
+        access. Entries older than ttl_seconds are treated as misses in both tiers.
+        The disk tier's size is tallied approximately as results are written, and it is
+        only counted and trimmed once the tally exceeds max_disk_entries by
+        DISK_EVICTION_SLACK, so writes do not pay for a table count.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.db_path = db_path
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        # _lock guards the memory tier and counters, _db_lock the SQLite connection
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_entries = 0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=DB_BUSY_TIMEOUT)
+            # WAL lets worker processes sharing the file read while another one writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS extraction_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS extraction_cache_accessed_at "
+                "ON extraction_cache (accessed_at)"
+            )
+            self._db.commit()
+            self._disk_entries = self._db.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "ExtractionCache":
+        """
+        Build a cache from EXTRACTION_CACHE_SIZE, EXTRACTION_CACHE_DB,
+        EXTRACTION_CACHE_TTL and EXTRACTION_CACHE_MAX_DISK_ENTRIES.
+        """
+        ttl = os.getenv("EXTRACTION_CACHE_TTL")
+        return cls(
+            max_entries=int(os.getenv("EXTRACTION_CACHE_SIZE", DEFAULT_MEMORY_ENTRIES)),
+            db_path=os.getenv("EXTRACTION_CACHE_DB") or None,
+            ttl_seconds=float(ttl) if ttl else None,
+            max_disk_entries=int(os.getenv("EXTRACTION_CACHE_MAX_DISK_ENTRIES", DEFAULT_DISK_ENTRIES)),
+        )
+
+    @staticmethod
+    def make_key(data: bytes, provider: str, model: str, prompt: str) -> str:
+        """
+        Build a content-addressed cache key.
+
+        Args:
+            data (bytes): Raw file bytes
+            provider (str): Provider name
+            model (str): Model name
+            prompt (str): Prompt text sent with the file
+
+        Returns:
+            str: Hex SHA-256 of the file combined with the request parameters
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{digest}:{ExtractionCache.request_params(provider, model, prompt)}"
+
+    @staticmethod
+    def request_params(provider: str, model: str, prompt: str) -> str:
+        """Hex SHA-256 of the request parameters; the part after the colon of every key made with them."""
+        return hashlib.sha256(f"{provider}\0{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached result for key, or None on a miss."""
+        value, tier = self._lookup(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if tier == "memory":
+                    self.memory_hits += 1
+                else:
+                    self.disk_hits += 1
+        return value
+
+    def peek(self, key: str) -> Optional[str]:
+        """Like get, but not counted as a hit or miss, e.g. when reusing a near duplicate's result."""
+        return self._lookup(key)[0]
+
+    def _lookup(self, key: str) -> tuple[Optional[str], Optional[str]]:
+        """Return the result for key and the tier it was found in, or (None, None)."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[1]):
+                    self._memory.move_to_end(key)
+                    return entry[0], "memory"
+                del self._memory[key]
+
+        row = self._get_disk(key) if self._db is not None else None
+        if row is None:
+            return None, None
+        with self._lock:
+            self._remember(key, row[0], row[1])
+        return row[0], "disk"
+
+    def _get_disk(self, key: str) -> Optional[tuple[str, float]]:
+        """Return the (value, created_at) stored on disk for key, deleting it if expired."""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, created_at FROM extraction_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self._expired(row[1]):
+                self._db.execute("DELETE FROM extraction_cache WHERE key = ?", (key,))
+                self._db.commit()
+                self._disk_entries -= 1
+                return None
+            self._db.execute("UPDATE extraction_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return row
+
+    def set(self, key: str, value: str):
+        """Store a result in every configured tier."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO extraction_cache (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._db.commit()
+            # Replacing an existing key or other workers' writes make this approximate; _evict_disk recounts
+            self._disk_entries += 1
+            if self._disk_entries > self.max_disk_entries * (1 + DISK_EVICTION_SLACK):
+                self._evict_disk()
+
+    def _remember(self, key: str, value: str, created_at: float):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        """Delete expired entries, then the least recently used beyond max_disk_entries. Called with _db_lock held."""
+        if self.ttl_seconds is not None:
+            self._db.execute(
+                "DELETE FROM extraction_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+        count = self._db.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+        if count > self.max_disk_entries:
+            self._db.execute(
+                "DELETE FROM extraction_cache WHERE key IN ("
+                "SELECT key FROM extraction_cache ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_disk_entries,),
+            )
+            count = self.max_disk_entries
+        self._db.commit()
+        self._disk_entries = count
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and tier sizes; the disk tier's size is this process's approximate tally."""
+        with self._lock:
+            disk_entries = self._disk_entries if self._db is not None else None
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+            }
+
+
+class CachedTextExtractor:
+    def __init__(self, extractor, cache: ExtractionCache, near_duplicates: Optional[PerceptualHashIndex] = None):
+        """
+        Wrap a text extractor so repeated images are answered from the cache.
+        The wrapped extractor must expose provider, model and prompt attributes.
+        When near_duplicates is given, images that miss the cache are also looked up by
+        perceptual hash, so a re-photographed slip is flagged as a near duplicate of an
+        earlier upload, or answered from that upload's cached result if the index reuses.
+        The index may be shared by several wrappers; a result is only reused from an
+        upload extracted with the same provider, model and prompt.
+        """
+        self.extractor = extractor
+        self.cache = cache
+        self.near_duplicates = near_duplicates
+
+    @property
+    def provider(self) -> str:
+        return self.extractor.provider
+
+    @property
+    def model(self) -> str:
+        return self.extractor.model
+
+    @property
+    def prompt(self) -> str:
+        return self.extractor.prompt
+
+    def _key(self, data: Union[bytes, memoryview]) -> str:
+        return self.cache.make_key(data, self.provider, self.model, self.prompt)
+
+    def _is_own_key(self, key: str) -> bool:
+        return key.endswith(":" + self.cache.request_params(self.provider, self.model, self.prompt))
+
+    def _find_near_duplicate(self, data: Union[bytes, memoryview]) -> tuple[Optional[ImageHash], Optional[NearDuplicate], Optional[str]]:
+        """Return the image's perceptual hash, its closest near duplicate and, when reusing, that duplicate's cached text."""
+        if self.near_duplicates is None:
+            return None, None, None
+        with stage("near_duplicate_lookup", self.provider):
+            try:
+                imageHash = image_hash(data)
+            except OSError:
+                # Not decodable here; the extractor reports the error if it matters
+                return None, None, None
+            # Only this wrapper's own results may be reused; any earlier upload may be flagged
+            match = self.near_duplicates.find(imageHash, self._is_own_key if self.near_duplicates.reuse else None)
+        if match is None:
+            return imageHash, None, None
+        text = self.cache.peek(match.key) if self.near_duplicates.reuse else None
+        match.reused = text is not None
+        NEAR_DUPLICATES.labels(self.provider, "reused" if match.reused else "flagged").inc()
+        return imageHash, match, text
+
+    def _store(self, key: str, text: str, imageHash: Optional[ImageHash]):
+        # An empty reply (blocked or refused) is not a result worth serving again
+        if not text:
+            return
+        self.cache.set(key, text)
+        if imageHash is not None:
+            self.near_duplicates.add(imageHash, key)
+
+    def extract_text(self, data: ExtractorInput, mime_type: Optional[str] = None) -> str:
+        """
+        Extract text from a file, returning a cached result when the same bytes
+        were already processed with the same provider, model and prompt.
+        On a miss, near duplicates are looked up before the provider is called; see
+        get_last_near_duplicate. PDFs are parsed locally and bypass the cache.
+
+        Args:
+            data (bytes | memoryview | str): File contents, or a path to the file
+            mime_type (Optional[str]): MIME type of the contents; inferred from the extension for paths
+
+        Returns:
+            str: Extracted text from the file
+        """
+        data, mime_type = read_input(data, mime_type)
+        set_last_served_from_cache(False)
+        if mime_type == PDF_MIME_TYPE:
+            return self.extractor.extract_text(data, mime_type=mime_type)
+
+        set_last_near_duplicate(None)
+        key = self._key(data)
+        cached = self.cache.get(key)
+        if cached is not None:
+            set_last_served_from_cache(True)
+            return cached
+
+        value, match, reused = self._find_near_duplicate(data)
+        set_last_near_duplicate(match)
+        if reused is not None:
+            set_last_served_from_cache(True)
+            return reused
+
+        text = self.extractor.extract_text(data, mime_type=mime_type)
+        self._store(key, text, value)
+        return text
+
+    async def extract_text_async(self, data: ExtractorInput, mime_type: Optional[str] = None) -> str:
+        """
+        Async variant of extract_text. Hashing and disk-tier lookups run in a worker thread.
+
+        Args:
+            data (bytes | memoryview | str): File contents, or a path to the file
+            mime_type (Optional[str]): MIME type of the contents; inferred from the extension for paths
+
+        Returns:
+            str: Extracted text from the file
+        """
+        data, mime_type = await read_input_async(data, mime_type)
+        set_last_served_from_cache(False)
+        if mime_type == PDF_MIME_TYPE:
+            return await self.extractor.extract_text_async(data, mime_type=mime_type)
+
+        set_last_near_duplicate(None)
+        key = await asyncio.to_thread(self._key, data)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            set_last_served_from_cache(True)
+            return cached
+
+        value, match, reused = await asyncio.to_thread(self._find_near_duplicate, data)
+        set_last_near_duplicate(match)
+        if reused is not None:
+            set_last_served_from_cache(True)
+            return reused
+
+        text = await self.extractor.extract_text_async(data, mime_type=mime_type)
+        await asyncio.to_thread(self._store, key, text, value)
+        return text
+
+    async def extract_pages_async(self, pages: list[PageImage]) -> list[str]:
+        """
+        Extract text from the page images of one document. Each page is cached on its
+        own; only the pages that miss are sent on, together, to the wrapped extractor.
+
+        Args:
+            pages (list[tuple[bytes, str]]): (contents, MIME type) of each page, in order
+
+        Returns:
+            list[str]: Extracted text of each page, in the same order
+        """
+        keys = await asyncio.to_thread(lambda: [self._key(data) for data, _ in pages])
+        results = await asyncio.to_thread(lambda: [self.cache.get(key) for key in keys])
+        missing = [index for index, text in enumerate(results) if text is None]
+        set_last_served_from_cache(not missing)
+        if missing:
+            texts = await self.extractor.extract_pages_async([pages[index] for index in missing])
+            for index, text in zip(missing, texts):
+                results[index] = text
+            await asyncio.to_thread(lambda: [self.cache.set(keys[index], results[index]) for index in missing if results[index]])
+        return results
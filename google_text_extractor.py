@@ -1,68 +1,140 @@
+import math
 import os
-from typing import Optional
-import base64
-import io
-import fitz  # PyMuPDF for PDF processing
+from typing import Optional, Union
 from google import genai
 from google.genai import types
-import requests
+from base_text_extractor import PAGES_PROMPT, BaseTextExtractor
+from image_preprocessing import PreprocessedImage
+from purchase_orders import purchase_order_pages_schema, purchase_order_schema
+from transport import get_async_http_client, get_http_client
 
+PROMPT = """Extract all the text content from the attached image of a packing slip. Return the result in a strict JSON format:
+                    
+                    Use this JSON schema:
+                    Item = {'itemName': str, 'itemQuantity': int, 'itemPrice': float}
+                    PackingSlip = {'trackingNumber': str, 'date': str, 'customerName': str, 'customerAddress': str, 'purchaseOrderNumber': str, 'items': list[Item]}
+                    Return: PackingSlip
+                    """
+
+
+class GoogleVisionTextExtractor(BaseTextExtractor):
+    provider = "google"
+    model = "gemini-2.0-flash-exp"
+    prompt = PROMPT
+    max_pages_per_call = 16
+    max_output_tokens = 8192
+    max_input_tokens = 1_048_576
+    # Inline image data is limited to 20 MB per request
+    max_request_bytes = 20 * 2**20
 
-class GoogleVisionTextExtractor:
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, max_concurrency: Optional[int] = None):
         """
         Initialize the GoogleVisionTextExtractor with Gemini API key.
         If api_key is not provided, it will look for GOOGLE_API_KEY environment variable.
+        max_concurrency bounds in-flight async calls; defaults to GOOGLE_MAX_CONCURRENCY.
         """
+        super().__init__(max_concurrency)
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("API key is required. Either pass it to the constructor or set GOOGLE_API_KEY environment variable.")
-        
+
         self.client = genai.Client(api_key=self.api_key)
-    
-    def _extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extract text from PDF using PyMuPDF."""
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        return text
-    
-    def extract_text(self, file_path: str) -> str:
-        """
-        Extract text from an image or PDF file using Google's Gemini API.
-        
-        Args:
-            file_path (str): Path to the image or PDF file
-            
-        Returns:
-            str: Extracted text from the file
-        """
-        file_extension = os.path.splitext(file_path)[1].lower()
-        
-        if file_extension in ['.pdf']:
-            # For PDFs, extract text directly using PyMuPDF
-            return self._extract_text_from_pdf(file_path)
-        elif file_extension in ['.jpg', '.jpeg', '.png']:
-            # For images, use Gemini API
-            with open(file_path, "rb") as image_file:
-                image_data = image_file.read()
-            
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash-exp",
-                contents=[
-                    """Extract all the text content from the attached image of a packing slip. Return the result in a strict JSON format:
-                    
-                    Use this JSON schema:
-                    Item = {'itemName': str, 'itemQuantity': int, 'itemPrice': float}
-                    PackingSlip = {'trackingNumber': str, 'date': str, 'customerName': str, 'customerAddress': str, 'purchaseOrderNumber': str, 'items': list[Item]}
-                    Return: PackingSlip
-                    """,
-                    types.Part.from_bytes(data=image_data, mime_type=f"image/{file_extension[1:]}")
-                ]
-            )
-            
-            return response.text
-        else:
-            raise ValueError(f"Unsupported file type: {file_extension}")
\ No newline at end of file
+        # google-genai has no option for a custom HTTP client, so swap in the shared pooled ones
+        self.client._api_client._httpx_client = get_http_client()
+        self.client._api_client._async_httpx_client = get_async_http_client()
+        # Constrain the response to the PurchaseOrder schema so it parses in one pass
+        self.config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=purchase_order_schema(openapi=True)
+        )
+        self.pages_config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=purchase_order_pages_schema(openapi=True),
+            max_output_tokens=self.max_output_tokens
+        )
+
+    def _build_contents(self, image_data: Union[bytes, memoryview], mime_type: str) -> list:
+        """Build the prompt and image parts for a generate_content call."""
+        return [
+            PROMPT,
+            types.Part.from_bytes(data=bytes(image_data), mime_type=mime_type)
+        ]
+
+    def _build_pages_contents(self, pages: list[PreprocessedImage]) -> list:
+        """Build a generate_content call for several pages, each image preceded by its page number."""
+        contents = [PAGES_PROMPT.format(count=len(pages))]
+        for number, page in enumerate(pages, start=1):
+            contents.append(f"Page {number}:")
+            contents.append(types.Part.from_bytes(data=bytes(page.data), mime_type=page.mime_type))
+        return contents
+
+    def image_tokens(self, width: int, height: int) -> int:
+        # Images up to 384 pixels a side are 258 tokens; larger ones are tiled into 768x768 tiles of 258 tokens
+        if width <= 384 and height <= 384:
+            return 258
+        return math.ceil(width / 768) * math.ceil(height / 768) * 258
+
+    @staticmethod
+    def _token_usage(response) -> Optional[tuple[int, int]]:
+        usage = response.usage_metadata
+        if usage is None:
+            return None
+        return usage.prompt_token_count or 0, usage.candidates_token_count or 0
+
+    @staticmethod
+    def _response_text(response) -> str:
+        # response.text is None when the reply has no text part, e.g. a blocked prompt; that is an unparseable reply
+        return response.text or ""
+
+    def _image_config(self, max_tokens: Optional[int]) -> types.GenerateContentConfig:
+        if max_tokens is None:
+            return self.config
+        return self.config.model_copy(update={"max_output_tokens": max_tokens})
+
+    def _extract_image_text(self, data: Union[bytes, memoryview], mime_type: str, max_tokens: Optional[int] = None) -> str:
+        response = self.transport.call(
+            lambda: self.client.models.generate_content(
+                model=self.model,
+                contents=self._build_contents(data, mime_type),
+                config=self._image_config(max_tokens)
+            ),
+            estimated_tokens=self._estimated_tokens(data, mime_type),
+            usage=self._usage
+        )
+        return self._response_text(response)
+
+    async def _extract_image_text_async(self, data: Union[bytes, memoryview], mime_type: str, max_tokens: Optional[int] = None) -> str:
+        response = await self.transport.call_async(
+            lambda: self.client.aio.models.generate_content(
+                model=self.model,
+                contents=self._build_contents(data, mime_type),
+                config=self._image_config(max_tokens)
+            ),
+            estimated_tokens=self._estimated_tokens(data, mime_type),
+            usage=self._usage
+        )
+        return self._response_text(response)
+
+    def _extract_pages_text(self, pages: list[PreprocessedImage]) -> str:
+        response = self.transport.call(
+            lambda: self.client.models.generate_content(
+                model=self.model,
+                contents=self._build_pages_contents(pages),
+                config=self.pages_config
+            ),
+            estimated_tokens=sum(self._estimated_tokens(page.data, page.mime_type) for page in pages),
+            usage=self._usage
+        )
+        return self._response_text(response)
+
+    async def _extract_pages_text_async(self, pages: list[PreprocessedImage]) -> str:
+        response = await self.transport.call_async(
+            lambda: self.client.aio.models.generate_content(
+                model=self.model,
+                contents=self._build_pages_contents(pages),
+                config=self.pages_config
+            ),
+            estimated_tokens=sum(self._estimated_tokens(page.data, page.mime_type) for page in pages),
+            usage=self._usage
+        )
+        return self._response_text(response)
@@ -0,0 +1,175 @@
+import asyncio
+import io
+import os
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional, Union
+from PIL import Image, ImageChops, ImageOps
+
+DEFAULT_MAX_LONG_EDGE = 2048
+DEFAULT_QUALITY = 85
+# Minimum difference from the background colour that counts as content when cropping
+CROP_THRESHOLD = 32
+CROP_MARGIN = 0.02
+
+
+@dataclass
+class PreprocessedImage:
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    processed_bytes: int
+    # Pixel size of the image sent, when known
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.processed_bytes
+
+    def to_dict(self) -> dict:
+        return {
+            "original_bytes": self.original_bytes,
+            "processed_bytes": self.processed_bytes,
+            "bytes_saved": self.bytes_saved,
+            "width": self.width,
+            "height": self.height,
+        }
+
+
+# Result of the most recent pre-processing in the current request context
+_last_preprocessed: ContextVar[Optional[PreprocessedImage]] = ContextVar("last_preprocessed", default=None)
+
+
+def get_last_preprocessed() -> Optional[PreprocessedImage]:
+    """Return the pre-processing result of the last image extracted in this context, if any."""
+    return _last_preprocessed.get()
+
+
+def image_size(data: Union[bytes, memoryview]) -> Optional[tuple[int, int]]:
+    """Return the (width, height) of an image from its header, or None if it cannot be read."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except OSError:
+        return None
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes")
+
+
+class ImagePreprocessor:
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_long_edge: int = DEFAULT_MAX_LONG_EDGE,
+        grayscale: bool = True,
+        crop: bool = True,
+        quality: int = DEFAULT_QUALITY,
+    ):
+        """
+        Initialize the image pre-processing stage run before every vision API call.
+        Images are rotated according to their EXIF orientation, optionally converted to
+        grayscale and cropped to the content bounding box, downscaled so the long edge is
+        at most max_long_edge pixels, and re-encoded as JPEG at the given quality. If the
+        result is not smaller than the input, the original bytes are sent unchanged.
+        """
+        self.enabled = enabled
+        self.max_long_edge = max_long_edge
+        self.grayscale = grayscale
+        self.crop = crop
+        self.quality = quality
+
+    @classmethod
+    def from_env(cls) -> "ImagePreprocessor":
+        """
+        Build a pre-processor from IMAGE_PREPROCESS, IMAGE_MAX_LONG_EDGE, IMAGE_GRAYSCALE,
+        IMAGE_CROP and IMAGE_QUALITY.
+        """
+        return cls(
+            enabled=_env_flag("IMAGE_PREPROCESS", True),
+            max_long_edge=int(os.getenv("IMAGE_MAX_LONG_EDGE", DEFAULT_MAX_LONG_EDGE)),
+            grayscale=_env_flag("IMAGE_GRAYSCALE", True),
+            crop=_env_flag("IMAGE_CROP", True),
+            quality=int(os.getenv("IMAGE_QUALITY", DEFAULT_QUALITY)),
+        )
+
+    def _crop_to_content(self, image: Image.Image) -> Image.Image:
+        # Treat the top-left pixel as the background colour and trim everything that matches it
+        gray = image if image.mode == "L" else image.convert("L")
+        background = Image.new("L", gray.size, gray.getpixel((0, 0)))
+        mask = ImageChops.difference(gray, background).point(lambda v: 255 if v > CROP_THRESHOLD else 0)
+        bbox = mask.getbbox()
+        if bbox is None:
+            return image
+        margin_x = int(image.width * CROP_MARGIN)
+        margin_y = int(image.height * CROP_MARGIN)
+        return image.crop((
+            max(bbox[0] - margin_x, 0),
+            max(bbox[1] - margin_y, 0),
+            min(bbox[2] + margin_x, image.width),
+            min(bbox[3] + margin_y, image.height),
+        ))
+
+    def process(self, data: Union[bytes, memoryview], mime_type: str, max_long_edge: Optional[int] = None) -> PreprocessedImage:
+        """
+        Shrink an image before it is sent to a vision provider.
+
+        Args:
+            data (bytes | memoryview): Image file contents
+            mime_type (str): MIME type of the image
+            max_long_edge (Optional[int]): Overrides the pre-processor's limit for this image
+
+        Returns:
+            PreprocessedImage: Bytes and MIME type to send, with before/after sizes
+        """
+        data = bytes(data)
+        original = PreprocessedImage(data, mime_type, len(data), len(data))
+        if not self.enabled:
+            return original
+        max_long_edge = max_long_edge or self.max_long_edge
+
+        try:
+            image = Image.open(io.BytesIO(data))
+            original.width, original.height = image.size
+            # Let the JPEG decoder downscale by a power of two while decoding
+            image.draft("L" if self.grayscale else "RGB", (max_long_edge, max_long_edge))
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("L" if self.grayscale else "RGB")
+            if self.crop:
+                image = self._crop_to_content(image)
+            image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=self.quality, optimize=True)
+        except OSError:
+            # Unreadable images are passed through and left for the provider to reject
+            return original
+
+        processed = output.getvalue()
+        if len(processed) >= len(data):
+            return original
+        return PreprocessedImage(processed, "image/jpeg", len(data), len(processed), image.width, image.height)
+
+    async def process_async(self, data: Union[bytes, memoryview], mime_type: str, max_long_edge: Optional[int] = None) -> PreprocessedImage:
+        """
+        Run process in a worker thread and record the result for the current request.
+        """
+        result = await asyncio.to_thread(self.process, data, mime_type, max_long_edge)
+        _last_preprocessed.set(result)
+        return result
+
+
+_image_preprocessor: Optional[ImagePreprocessor] = None
+
+
+def get_image_preprocessor() -> ImagePreprocessor:
+    """Return the process-wide pre-processor, creating it from the environment on first use."""
+    global _image_preprocessor
+    if _image_preprocessor is None:
+        _image_preprocessor = ImagePreprocessor.from_env()
+    return _image_preprocessor
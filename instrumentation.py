@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+try:
+    from opentelemetry import trace
+except ImportError:  # OpenTelemetry is optional
+    trace = None
+
+# Stage latencies range from sub-millisecond lookups to provider calls of tens of seconds
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "ocr_stage_duration_seconds",
+    "Time spent in each processing stage",
+    ["provider", "stage"],
+    buckets=STAGE_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "ocr_request_duration_seconds",
+    "HTTP request latency by route and status code",
+    ["route", "status"],
+    buckets=STAGE_BUCKETS,
+)
+BYTES_IN = Counter("ocr_bytes_in_total", "Bytes uploaded by clients", ["provider"])
+BYTES_OUT = Counter("ocr_bytes_out_total", "Image bytes sent to providers after pre-processing", ["provider"])
+TOKENS = Counter("ocr_tokens_total", "Tokens reported by providers", ["provider"])
+NEAR_DUPLICATES = Counter("ocr_near_duplicates_total", "Uploads matching an earlier image by perceptual hash", ["provider", "action"])
+COST_USD = Counter("ocr_cost_usd_total", "Provider spend in USD, from reported token usage and list prices", ["provider"])
+ESCALATIONS = Counter("ocr_resolution_escalations_total", "Images re-sent at a higher resolution or output limit after an unparseable reply", ["provider"])
+# The rest of the spend counters behind /budget/spend
+PRICED_CALLS = Counter("ocr_priced_calls_total", "Provider calls that reported token usage", ["provider"])
+PRICED_TOKENS = Counter("ocr_priced_tokens_total", "Tokens of the provider calls that reported usage, by direction", ["provider", "direction"])
+ESTIMATED_COST_USD = Counter("ocr_estimated_cost_usd_total", "Estimated USD cost of the images sent, from their pixel size and list prices", ["provider"])
+IMAGES_SENT = Counter("ocr_images_sent_total", "Images sent to providers, not counting escalations", ["provider"])
+FINAL_STEPS = Counter("ocr_resolution_final_steps_total", "Images by the resolution ladder step they were finally extracted at", ["provider", "step"])
+PROVIDER_CALLS = Counter("ocr_provider_calls_total", "Provider call attempts by outcome", ["provider", "outcome"])
+
+_tracer = trace.get_tracer("llm-ocr-extract") if trace else None
+
+# Per-request stage totals in milliseconds, reported in the Server-Timing header
+_request_timings: ContextVar[Optional[dict[str, float]]] = ContextVar("request_timings", default=None)
+
+logger = logging.getLogger(__name__)
+
+
+class JsonFormatter(logging.Formatter):
+    # Attributes every LogRecord has; anything else was passed through extra=
+    _RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self._RESERVED})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    """
+    Configure the root logger from LOG_LEVEL (default info) and LOG_FORMAT
+    (json, the default, for one JSON object per line; or text).
+    """
+    handler = logging.StreamHandler()
+    if os.getenv("LOG_FORMAT", "json").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "info").upper(), handlers=[handler], force=True)
+
+
+@contextmanager
+def stage(name: str, provider: str = "none", **attributes) -> Iterator[None]:
+    """
+    Time a processing stage.
+    The duration is observed in the stage histogram, added to the current request's
+    Server-Timing totals and logged at debug level. When OpenTelemetry is installed the
+    stage is also recorded as a span with the given attributes.
+
+    Args:
+        name (str): Stage name, e.g. read_upload, preprocess, provider_call, parse
+        provider (str): Provider the stage belongs to, or none for provider-independent stages
+    """
+    span = _tracer.start_as_current_span(f"ocr.{name}", attributes={"provider": provider, **attributes}) if _tracer else None
+    started = time.perf_counter()
+    try:
+        if span is None:
+            yield
+        else:
+            with span:
+                yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(provider, name).observe(elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed * 1000
+        logger.debug("stage finished", extra={"stage": name, "provider": provider, "seconds": round(elapsed, 6)})
+
+
+def start_request_timings() -> dict[str, float]:
+    """Start collecting stage timings for the current request and return the totals."""
+    timings: dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings: dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={duration:.1f}" for name, duration in timings.items())
+
+
+def metrics_payload() -> tuple[bytes, str]:
+    """
+    Return the Prometheus exposition and its content type.
+    When PROMETHEUS_MULTIPROC_DIR is set, as in multi-worker mode, each worker records
+    its metrics in that directory and the exposition sums them over all workers.
+    """
+    return generate_latest(_collecting_registry()), CONTENT_TYPE_LATEST
+
+
+def _collecting_registry() -> CollectorRegistry:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def counter_samples(*counters: Counter) -> list[list[tuple[dict[str, str], float]]]:
+    """
+    Return the (labels, value) samples of each counter, in the order given, summed over
+    all workers when PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    positions = {f"{metric.name}_total": index for index, counter in enumerate(counters) for metric in counter.describe()}
+    samples: list[list[tuple[dict[str, str], float]]] = [[] for _ in counters]
+    for metric in _collecting_registry().collect():
+        for sample in metric.samples:
+            if sample.name in positions:
+                samples[positions[sample.name]].append((sample.labels, sample.value))
+    return samples
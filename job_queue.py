@@ -0,0 +1,438 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlsplit
+import httpx
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+DEFAULT_WORKERS = 4
+DEFAULT_POLL_INTERVAL = 1.0
+CALLBACK_TIMEOUT = 10.0
+# Seconds to wait for another process's write lock on the SQLite backend
+DB_BUSY_TIMEOUT = 10.0
+# Seconds a claimed job stays with its worker without a heartbeat before others may take it over
+DEFAULT_LEASE_SECONDS = 60.0
+# Seconds finished jobs stay available for polling before they are purged
+DEFAULT_RETENTION_SECONDS = 24 * 3600.0
+# Seconds between purges of expired jobs
+PURGE_INTERVAL = 60.0
+
+logger = logging.getLogger(__name__)
+# Number of recent queue wait times kept for metrics
+WAIT_TIME_WINDOW = 1000
+
+
+class CallbackNotAllowedError(ValueError):
+    pass
+
+
+def validate_callback_url(url: str, allowed_hosts: list[str]):
+    """
+    Refuse callback URLs that are not http(s) or whose host is not in allowed_hosts,
+    so jobs cannot be used to make the server call internal addresses.
+    An entry of the form *.example.com allows every subdomain of example.com.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise CallbackNotAllowedError(f"Callback URL must be an http or https URL: {url}")
+    host = parts.hostname.lower()
+    for allowed in allowed_hosts:
+        if host == allowed or (allowed.startswith("*.") and host.endswith(allowed[1:])):
+            return
+    raise CallbackNotAllowedError(f"Callback host not allowed: {host}")
+
+
+@dataclass
+class Job:
+    id: str
+    filename: Optional[str]
+    content_type: Optional[str]
+    provider: str
+    callback_url: Optional[str] = None
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class InMemoryJobBackend:
+    # Jobs live and die with the process that runs them, so claims need no lease
+    lease_seconds = None
+
+    def __init__(self):
+        """Keep jobs and their payloads in process memory; jobs are lost on restart."""
+        self._jobs: dict[str, Job] = {}
+        self._payloads: dict[str, bytes] = {}
+        self._queue: deque[str] = deque()
+        self._lock = threading.Lock()
+
+    def enqueue(self, job: Job, data: bytes):
+        with self._lock:
+            self._jobs[job.id] = job
+            self._payloads[job.id] = data
+            self._queue.append(job.id)
+
+    def dequeue(self) -> Optional[tuple[Job, bytes]]:
+        """Claim the oldest queued job and mark it running."""
+        with self._lock:
+            if not self._queue:
+                return None
+            job = self._jobs[self._queue.popleft()]
+            job.status = RUNNING
+            job.started_at = time.time()
+            return job, self._payloads.pop(job.id)
+
+    def update(self, job: Job):
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def depth(self) -> int:
+        with self._lock:
+            return len(self._queue)
+
+    def oldest_queued_at(self) -> Optional[float]:
+        with self._lock:
+            return self._jobs[self._queue[0]].created_at if self._queue else None
+
+    def purge(self, finished_before: float) -> int:
+        """Delete jobs that finished before finished_before; returns the number deleted."""
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and job.finished_at < finished_before
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+            return len(expired)
+
+
+class SQLiteJobBackend:
+    def __init__(self, db_path: str, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        """
+        Keep jobs in a SQLite file so queued work survives restarts and is shared by
+        every worker process using the same file. A claimed job is leased to this
+        backend for lease_seconds and the lease is renewed by heartbeat while the job
+        runs. A running job whose lease has expired, because its process died or
+        stalled, is put back on the queue; jobs other live processes are running are
+        left alone.
+        """
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        # Identifies this process's claims among all processes sharing the file
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=DB_BUSY_TIMEOUT)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, job TEXT NOT NULL, "
+            "data BLOB, created_at REAL NOT NULL, owner TEXT, lease_until REAL)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        # Files written before leases existed lack the claim columns
+        for column, column_type in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status_created_at ON jobs (status, created_at)")
+        self._db.commit()
+
+    def _requeue_expired(self):
+        # Jobs claimed before leases existed have no lease_until and count as expired
+        self._db.execute(
+            "UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL, job = json_set(job, '$.status', ?) "
+            "WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)",
+            (QUEUED, QUEUED, RUNNING, time.time()),
+        )
+
+    def _save(self, job: Job):
+        self._db.execute(
+            "UPDATE jobs SET status = ?, job = ? WHERE id = ?",
+            (job.status, json.dumps(job.to_dict()), job.id),
+        )
+
+    def enqueue(self, job: Job, data: bytes):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, job, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job.id, job.status, json.dumps(job.to_dict()), data, job.created_at),
+            )
+            self._db.commit()
+
+    def dequeue(self) -> Optional[tuple[Job, bytes]]:
+        """Claim the oldest queued job and mark it running."""
+        with self._lock:
+            self._requeue_expired()
+            # A single UPDATE claims the job, so worker processes sharing the file never claim the same one
+            row = self._db.execute(
+                "UPDATE jobs SET status = ?, owner = ?, lease_until = ? WHERE id = ("
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) "
+                "RETURNING job, data",
+                (RUNNING, self.owner, time.time() + self.lease_seconds, QUEUED),
+            ).fetchone()
+            if row is None:
+                self._db.commit()
+                return None
+            job = Job(**json.loads(row[0]))
+            job.status = RUNNING
+            job.started_at = time.time()
+            self._save(job)
+            self._db.commit()
+            return job, row[1]
+
+    def heartbeat(self, job_id: str) -> bool:
+        """Renew the lease on a job this backend is running; False once the lease was lost."""
+        with self._lock:
+            renewed = self._db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = ?",
+                (time.time() + self.lease_seconds, job_id, self.owner, RUNNING),
+            ).rowcount
+            self._db.commit()
+            return renewed > 0
+
+    def update(self, job: Job):
+        with self._lock:
+            # Only the current claim holder may record the outcome; after a lost lease the job belongs to another worker
+            saved = self._db.execute(
+                "UPDATE jobs SET status = ?, job = ?, owner = NULL, lease_until = NULL WHERE id = ? AND owner = ?",
+                (job.status, json.dumps(job.to_dict()), job.id, self.owner),
+            ).rowcount
+            if saved and job.status in (SUCCEEDED, FAILED):
+                # The payload is only needed until the job has run
+                self._db.execute("UPDATE jobs SET data = NULL WHERE id = ?", (job.id,))
+            self._db.commit()
+        if not saved:
+            logger.warning("Job lease lost before its outcome was saved", extra={"job_id": job.id})
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute("SELECT job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return Job(**json.loads(row[0])) if row else None
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+    def oldest_queued_at(self) -> Optional[float]:
+        with self._lock:
+            return self._db.execute("SELECT MIN(created_at) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+    def purge(self, finished_before: float) -> int:
+        """Delete jobs that finished before finished_before; returns the number deleted."""
+        with self._lock:
+            deleted = self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND json_extract(job, '$.finished_at') < ?",
+                (SUCCEEDED, FAILED, finished_before),
+            ).rowcount
+            self._db.commit()
+            return deleted
+
+
+JobHandler = Callable[[Job, bytes], Awaitable[dict]]
+
+
+class JobQueue:
+    def __init__(
+        self,
+        backend,
+        handler: JobHandler,
+        workers: int = DEFAULT_WORKERS,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        retention_seconds: float = DEFAULT_RETENTION_SECONDS,
+        callback_hosts: Optional[list[str]] = None,
+    ):
+        """
+        Initialize an in-process job queue.
+        workers asyncio tasks claim jobs from the backend and run handler on each; the
+        dict it returns becomes the job result, and an exception marks the job failed.
+        Idle workers wake on submit, or every poll_interval seconds to pick up jobs
+        recovered by a persistent backend. Finished jobs are purged retention_seconds
+        after they finish. Completion callbacks are only sent to http(s) URLs on
+        callback_hosts; without any, callbacks are refused.
+        """
+        self.backend = backend
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.callback_hosts = [host.lower() for host in callback_hosts or []]
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._wait_times: deque[float] = deque(maxlen=WAIT_TIME_WINDOW)
+        self.running = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    @classmethod
+    def from_env(cls, handler: JobHandler) -> "JobQueue":
+        """
+        Build a queue from JOB_QUEUE_BACKEND (memory or sqlite), JOB_QUEUE_DB, JOB_WORKERS,
+        JOB_RETENTION_SECONDS and the comma-separated JOB_CALLBACK_ALLOWED_HOSTS.
+        """
+        backend_name = os.getenv("JOB_QUEUE_BACKEND", "memory").lower()
+        if backend_name == "memory":
+            backend = InMemoryJobBackend()
+        elif backend_name == "sqlite":
+            backend = SQLiteJobBackend(
+                os.getenv("JOB_QUEUE_DB", "jobs.db"),
+                lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", DEFAULT_LEASE_SECONDS)),
+            )
+        else:
+            raise ValueError(f"Unsupported job queue backend: {backend_name}")
+        callback_hosts = os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "")
+        return cls(
+            backend,
+            handler,
+            workers=int(os.getenv("JOB_WORKERS", DEFAULT_WORKERS)),
+            retention_seconds=float(os.getenv("JOB_RETENTION_SECONDS", DEFAULT_RETENTION_SECONDS)),
+            callback_hosts=[host.strip() for host in callback_hosts.split(",") if host.strip()],
+        )
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_periodically()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(
+        self,
+        data: bytes,
+        filename: Optional[str],
+        content_type: Optional[str],
+        provider: str,
+        callback_url: Optional[str] = None,
+    ) -> Job:
+        """
+        Queue a file for extraction and return immediately.
+
+        Returns:
+            Job: The queued job; poll it with get
+
+        Raises:
+            CallbackNotAllowedError: If callback_url is not an allowed http(s) URL
+        """
+        if callback_url:
+            validate_callback_url(callback_url, self.callback_hosts)
+        job = Job(
+            id=uuid.uuid4().hex,
+            filename=filename,
+            content_type=content_type,
+            provider=provider,
+            callback_url=callback_url,
+        )
+        await asyncio.to_thread(self.backend.enqueue, job, data)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self.backend.get, job_id)
+
+    async def _purge_periodically(self):
+        while True:
+            try:
+                purged = await asyncio.to_thread(self.backend.purge, time.time() - self.retention_seconds)
+                if purged:
+                    logger.info("Expired jobs purged", extra={"jobs": purged})
+            except Exception:
+                logger.exception("Job purge failed")
+            await asyncio.sleep(PURGE_INTERVAL)
+
+    async def _worker(self):
+        while True:
+            claimed = await asyncio.to_thread(self.backend.dequeue)
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(*claimed)
+
+    async def _run(self, job: Job, data: bytes):
+        self._wait_times.append(job.started_at - job.created_at)
+        self.running += 1
+        heartbeat = asyncio.create_task(self._heartbeat(job)) if self.backend.lease_seconds else None
+        try:
+            job.result = await self.handler(job, data)
+            job.status = SUCCEEDED
+            self.succeeded += 1
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+            self.failed += 1
+        finally:
+            self.running -= 1
+            job.finished_at = time.time()
+            if heartbeat is not None:
+                heartbeat.cancel()
+        await asyncio.to_thread(self.backend.update, job)
+        if job.callback_url:
+            await self._notify(job)
+
+    async def _heartbeat(self, job: Job):
+        # Renewing well inside the lease leaves room for a slow write lock
+        interval = self.backend.lease_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            if not await asyncio.to_thread(self.backend.heartbeat, job.id):
+                logger.warning("Job lease lost while running", extra={"job_id": job.id})
+                return
+
+    async def _notify(self, job: Job):
+        # Callbacks are best effort; a failing receiver does not change the job outcome
+        try:
+            # Checked again because a persistent backend may hold jobs submitted under an older allowlist
+            validate_callback_url(job.callback_url, self.callback_hosts)
+        except CallbackNotAllowedError as e:
+            logger.warning("Job callback refused", extra={"job_id": job.id, "error": str(e)})
+            return
+        try:
+            # Redirects are not followed, so an allowed host cannot forward the request elsewhere
+            async with httpx.AsyncClient(timeout=CALLBACK_TIMEOUT, follow_redirects=False) as client:
+                await client.post(job.callback_url, json=job.to_dict())
+        except httpx.HTTPError as e:
+            logger.warning("Job callback failed", extra={"job_id": job.id, "error": str(e)})
+
+    async def metrics(self) -> dict:
+        """Return queue depth, worker activity and queue wait times in seconds."""
+        depth = await asyncio.to_thread(self.backend.depth)
+        oldest = await asyncio.to_thread(self.backend.oldest_queued_at)
+        waits = sorted(self._wait_times)
+        return {
+            "depth": depth,
+            "running": self.running,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "workers": self.workers,
+            "oldest_queued_seconds": time.time() - oldest if oldest is not None else 0.0,
+            "wait_seconds_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_seconds_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "wait_seconds_max": waits[-1] if waits else 0.0,
+        }
@@ -1,33 +1,341 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, Response, UploadFile, File, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import hashlib
+import io
+import json
+import logging
 import os
+import time
+import zipfile
+from collections import ChainMap
+from datetime import date
 from typing import List, Optional
-import shutil
-from claude_text_extractor import TextExtractor
-from google_text_extractor import GoogleVisionTextExtractor
-from openai_text_extractor import OpenAIVisionTextExtractor
-from purchase_orders import PurchaseOrder, PurchaseOrderList, parse_purchase_order
+from extraction_cache import ExtractionCache, CachedTextExtractor
+from purchase_orders import PurchaseOrder, PurchaseOrderList, merge_purchase_orders, parse_purchase_order
+from purchase_order_matching import PurchaseOrderMatch, PurchaseOrderMatcher
+from order_index import MappedPurchaseOrderList
+from order_archive import DEFAULT_FLUSH_SECONDS, EXPORT_FORMATS, OrderArchive
+from pdf_engine import get_pdf_engine
+from image_preprocessing import get_last_preprocessed
+from perceptual_hash import PerceptualHashIndex, get_last_near_duplicate
+from base_text_extractor import IMAGE_MIME_TYPES, PDF_MIME_TYPE, mime_type_for_path, normalize_mime_type
+from concurrency import get_max_concurrency
+from job_queue import CallbackNotAllowedError, Job, JobQueue
+from provider_registry import ProviderRegistry
+from token_budget import get_token_budget
+from provider_router import ProviderRouter
+from transport import close_http_clients
+from instrumentation import BYTES_IN, REQUEST_SECONDS, configure_logging, metrics_payload, server_timing_header, stage, start_request_timings
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
-# Create uploads directory if it doesn't exist
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Uploads are processed in memory; set UPLOAD_PERSIST=true to also keep a copy on disk
+UPLOAD_PERSIST = os.getenv("UPLOAD_PERSIST", "").lower() in ("1", "true", "yes")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+if UPLOAD_PERSIST:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# Keep references to in-flight background writes so they are not garbage collected
+_pending_writes: set[asyncio.Task] = set()
 
 # Get API keys from environment variables
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-print(GEMINI_API_KEY)
-# Initialize text extractors with API keys
-#claude_extractor = TextExtractor(api_key=ANTHROPIC_API_KEY)
-google_extractor = GoogleVisionTextExtractor(api_key=GEMINI_API_KEY)
-#penai_extractor = OpenAIVisionTextExtractor(api_key=OPENAI_API_KEY)
+# Repeated uploads of the same image are answered from this cache
+extraction_cache = ExtractionCache.from_env()
+# Re-photographed slips are matched to earlier uploads by perceptual hash
+near_duplicate_index = PerceptualHashIndex.from_env()
+
+# Providers listed in ENABLED_PROVIDERS; each SDK is imported and its client built on first use
+provider_registry = ProviderRegistry.from_env(
+    lambda extractor: CachedTextExtractor(extractor, extraction_cache, near_duplicate_index)
+)
+# Load providers at startup in the background; until one is loaded /ready answers 503
+PROVIDERS_WARMUP = os.getenv("PROVIDERS_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# Picks the fastest healthy provider per request, with hedging and failover
+provider_router = ProviderRouter.from_env(provider_registry)
+# Extractors available for batch, jobs and scanned PDF pages, by provider name
+vision_extractors = ChainMap({"auto": provider_router}, provider_registry)
+
+async def get_vision_extractor(provider: str):
+    """The extractor for provider; a registry provider not loaded yet is loaded off the event loop."""
+    if provider == "auto":
+        return provider_router
+    return await provider_registry.get_async(provider)
+
+# Purchase orders are loaded and indexed once at startup
+PURCHASE_ORDERS_PATH = os.getenv("PURCHASE_ORDERS_PATH")
+# With ORDER_INDEX_PATH set, orders are served from a memory-mapped index file shared by all worker processes
+ORDER_INDEX_PATH = os.getenv("ORDER_INDEX_PATH")
+if ORDER_INDEX_PATH:
+    purchase_order_store = MappedPurchaseOrderList.open_or_build(ORDER_INDEX_PATH, PURCHASE_ORDERS_PATH)
+    # The index also holds the fuzzy-match variants, so it is its own matcher
+    purchase_order_matcher = purchase_order_store
+else:
+    purchase_order_store = PurchaseOrderList.load(PURCHASE_ORDERS_PATH) if PURCHASE_ORDERS_PATH else PurchaseOrderList()
+    # Fallback for OCR slips that miss the exact purchase order number
+    purchase_order_matcher = PurchaseOrderMatcher(purchase_order_store.get_purchase_orders())
+
+# Every extracted purchase order is appended to a columnar archive; None with ORDER_ARCHIVE=false
+order_archive = OrderArchive.from_env()
+# Buffered archive rows are written out at least this often
+ORDER_ARCHIVE_FLUSH_SECONDS = float(os.getenv("ORDER_ARCHIVE_FLUSH_SECONDS", DEFAULT_FLUSH_SECONDS))
 
 # Allowed file types
 ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png", "image/jpg"]
 ALLOWED_PDF_TYPES = ["application/pdf"]
+ALLOWED_ZIP_TYPES = ["application/zip", "application/x-zip-compressed"]
+
+# Maximum number of files in one batch, after zip archives are expanded
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 500))
+# Maximum total size of one batch in bytes, counting zip entries at their uncompressed size
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", 256 * 1024 * 1024))
+
+def _write_upload(path: str, data: bytes):
+    if os.path.exists(path):
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with stage("disk_write"):
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+def persist_upload(data: bytes, filename: Optional[str]) -> Optional[str]:
+    """
+    Write an upload to UPLOAD_DIR in the background under its content hash.
+    Returns the path it will be stored at, or None when persistence is disabled.
+    """
+    if not UPLOAD_PERSIST:
+        return None
+    file_extension = os.path.splitext(filename or "")[1].lower()
+    path = os.path.join(UPLOAD_DIR, hashlib.sha256(data).hexdigest() + file_extension)
+    task = asyncio.create_task(asyncio.to_thread(_write_upload, path, data))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+    return path
+
+def lookup_purchase_order(
+    extracted_purchase_order: Optional[PurchaseOrder]
+) -> tuple[Optional[PurchaseOrder], Optional[PurchaseOrderMatch], list[PurchaseOrderMatch]]:
+    """
+    Look up the stored purchase order for an order parsed from extracted text.
+    Tries the purchase order number, then the tracking number, and falls back to the
+    fuzzy index when neither matches exactly; the match is returned alongside the
+    order in that case. When several orders are equally close, no order is returned
+    and the tied candidates are returned instead, as (None, None, candidates).
+    """
+    if not extracted_purchase_order:
+        return None, None, []
+    purchase_order_number = extracted_purchase_order.purchaseOrderNumber
+    tracking_number = extracted_purchase_order.trackingNumber
+    purchase_order = purchase_order_store.get_purchase_order(purchase_order_number)
+    if purchase_order is None and tracking_number:
+        purchase_order = purchase_order_store.get_purchase_order_by_tracking_number(tracking_number)
+    if purchase_order is not None:
+        return purchase_order, None, []
+    purchase_order_match, candidates = purchase_order_matcher.resolve(purchase_order_number)
+    if purchase_order_match is None and tracking_number:
+        # The tracking number may single out one of the tied orders
+        purchase_order_match, tracking_candidates = purchase_order_matcher.resolve(tracking_number)
+        candidates = candidates or tracking_candidates
+    if purchase_order_match:
+        return purchase_order_match.purchaseOrder, purchase_order_match, []
+    return None, None, candidates
+
+def archive_purchase_order(
+    extracted_purchase_order: Optional[PurchaseOrder],
+    purchase_order: Optional[PurchaseOrder],
+    provider: Optional[str],
+    filename: Optional[str]
+):
+    """Append an extracted order to the archive, flushing it in the background once enough rows are buffered."""
+    if order_archive is None or extracted_purchase_order is None:
+        return
+    matched_number = purchase_order.purchaseOrderNumber if purchase_order else None
+    if order_archive.append(extracted_purchase_order, provider, filename, matched_number):
+        task = asyncio.create_task(asyncio.to_thread(order_archive.flush))
+        _pending_writes.add(task)
+        task.add_done_callback(_pending_writes.discard)
+
+def match_purchase_order(
+    extracted_text: str,
+    provider: Optional[str] = None,
+    filename: Optional[str] = None
+) -> tuple[Optional[PurchaseOrder], Optional[PurchaseOrder], Optional[PurchaseOrderMatch], list[PurchaseOrderMatch]]:
+    """
+    Parse the purchase order from extracted text, look it up and archive it;
+    returns (extracted, stored, match, tied candidates).
+    """
+    with stage("parse"):
+        extracted_purchase_order = parse_purchase_order(extracted_text)
+    with stage("lookup"):
+        purchase_order, purchase_order_match, candidates = lookup_purchase_order(extracted_purchase_order)
+    archive_purchase_order(extracted_purchase_order, purchase_order, provider, filename)
+    return extracted_purchase_order, purchase_order, purchase_order_match, candidates
+
+async def read_upload(file: UploadFile, provider: str) -> bytes:
+    with stage("read_upload", provider):
+        data = await file.read()
+    BYTES_IN.labels(provider).inc(len(data))
+    return data
+
+def _check_batch_limits(files: int, size: int):
+    if files > BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files in batch: {files}. Maximum is {BATCH_MAX_FILES}."
+        )
+    if size > BATCH_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {size} bytes uncompressed. Maximum is {BATCH_MAX_BYTES}."
+        )
+
+def _unpack_zip(data: bytes, files: int = 0, size: int = 0) -> list[tuple[str, bytes]]:
+    """
+    Read the files in a zip archive, given the number of files and bytes the batch
+    already holds. Entry counts and uncompressed sizes come from the archive's
+    directory, so an archive that would take the batch over its limits is refused
+    before any entry is decompressed; zipfile stops reading each entry at its
+    declared size.
+    """
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        entries = [
+            info for info in archive.infolist()
+            if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+        ]
+        _check_batch_limits(files + len(entries), size + sum(info.file_size for info in entries))
+        return [(info.filename, archive.read(info)) for info in entries]
+
+async def _read_batch(files: List[UploadFile], provider: str) -> list[tuple[str, Optional[str], bytes]]:
+    """Read uploaded files into (filename, content_type, data) items, expanding zip archives within the batch limits."""
+    items = []
+    size = 0
+    for file in files:
+        data = await read_upload(file, provider)
+        if file.content_type in ALLOWED_ZIP_TYPES or (file.filename or "").lower().endswith(".zip"):
+            for filename, entry in await asyncio.to_thread(_unpack_zip, data, len(items), size):
+                items.append((filename, None, entry))
+                size += len(entry)
+        else:
+            _check_batch_limits(len(items) + 1, size + len(data))
+            items.append((file.filename, file.content_type, data))
+            size += len(data)
+    return items
+
+async def extract_item(filename: Optional[str], content_type: Optional[str], data: bytes, extractor) -> dict:
+    """Extract one uploaded file and look up its purchase order."""
+    if content_type and content_type != "application/octet-stream":
+        mime_type = normalize_mime_type(content_type)
+    else:
+        mime_type = mime_type_for_path(filename or "")
+    persist_upload(data, filename)
+    near_duplicate = None
+    provider = "pymupdf" if mime_type == PDF_MIME_TYPE else extractor.provider
+    
+    if mime_type == PDF_MIME_TYPE:
+        extracted_text = await get_pdf_engine().extract_text_async(data)
+    elif mime_type in IMAGE_MIME_TYPES:
+        extracted_text = await extractor.extract_text_async(data, mime_type=mime_type)
+        near_duplicate = get_last_near_duplicate()
+    else:
+        raise ValueError(f"Unsupported file type: {mime_type}")
+    extracted_purchase_order, purchase_order, purchase_order_match, candidates = match_purchase_order(extracted_text, provider, filename)
+    
+    return {
+        "content_type": mime_type,
+        "file_size": len(data),
+        "extracted_text": extracted_text,
+        "near_duplicate": near_duplicate.to_dict() if near_duplicate else None,
+        "extracted_purchase_order": extracted_purchase_order.to_dict() if extracted_purchase_order else None,
+        "purchase_order": purchase_order.to_dict() if purchase_order else None,
+        "purchase_order_match": purchase_order_match.to_dict() if purchase_order_match else None,
+        "purchase_order_candidates": [candidate.to_dict() for candidate in candidates]
+    }
+
+async def process_batch_item(index: int, filename: str, content_type: Optional[str], data: bytes, extractor) -> dict:
+    """Run extract_item for one batch item; errors are reported per item."""
+    result = {"index": index, "filename": filename}
+    try:
+        result.update(await extract_item(filename, content_type, data, extractor))
+        result["status"] = "ok"
+    except Exception as e:
+        result.update({"status": "error", "error": str(e)})
+    return result
+
+async def run_extraction_job(job: Job, data: bytes) -> dict:
+    return await extract_item(job.filename, job.content_type, data, await get_vision_extractor(job.provider))
+
+# Long extractions are queued and run by in-process workers
+job_queue = JobQueue.from_env(run_extraction_job)
+
+@app.on_event("startup")
+async def start_job_queue():
+    job_queue.start()
+
+# Keep a reference to the warm-up task so it is not garbage collected
+_warmup_tasks: set[asyncio.Task] = set()
+
+@app.on_event("startup")
+async def warm_providers():
+    if PROVIDERS_WARMUP:
+        task = asyncio.create_task(provider_registry.warm())
+        _warmup_tasks.add(task)
+        task.add_done_callback(_warmup_tasks.discard)
+
+# Periodic flush of the order archive, cancelled at shutdown
+_archive_flush_task: Optional[asyncio.Task] = None
+
+async def flush_order_archive_periodically():
+    while True:
+        await asyncio.sleep(ORDER_ARCHIVE_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(order_archive.flush)
+        except Exception:
+            logger.exception("Order archive flush failed")
+
+@app.on_event("startup")
+async def start_order_archive():
+    global _archive_flush_task
+    if order_archive is not None:
+        _archive_flush_task = asyncio.create_task(flush_order_archive_periodically())
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    await job_queue.stop()
+
+@app.on_event("shutdown")
+async def flush_order_archive():
+    if _archive_flush_task is not None:
+        _archive_flush_task.cancel()
+    if order_archive is not None:
+        await asyncio.to_thread(order_archive.flush)
+
+@app.on_event("shutdown")
+async def shutdown_pdf_engine():
+    get_pdf_engine().shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    await close_http_clients()
+
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    # Stage timings of this request are returned in the Server-Timing header
+    timings = start_request_timings()
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(route.path if route else "unmatched", response.status_code).observe(time.perf_counter() - started)
+    if timings:
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
 
 @app.get("/")
 async def root():
@@ -37,8 +345,84 @@ async def root():
 async def say_hello(name: str):
     return {"message": f"good morning {name}! How are you doing today?"}
 
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    # Ready once at least one enabled provider has its SDK imported and client built
+    return JSONResponse(
+        content={"ready": provider_registry.ready, "providers": provider_registry.status()},
+        status_code=200 if provider_registry.ready else 503
+    )
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        **extraction_cache.stats(),
+        "near_duplicates": near_duplicate_index.stats() if near_duplicate_index else None
+    }
+
+@app.get("/metrics")
+async def metrics():
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
+@app.get("/budget/spend")
+async def budget_spend():
+    return get_token_budget().spend()
+
+def _require_order_archive() -> OrderArchive:
+    if order_archive is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Order archive disabled. Please set ORDER_ARCHIVE=true to record extracted purchase orders."
+        )
+    return order_archive
+
+@app.get("/orders/export")
+async def export_orders(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    customer: Optional[str] = None,
+    format: str = "jsonl"
+):
+    archive = _require_order_archive()
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Export format not supported. Supported formats: {', '.join(EXPORT_FORMATS)}"
+        )
+    # A plain generator, so Starlette reads the Parquet files in a worker thread
+    return StreamingResponse(archive.export(start, end, customer, format), media_type=EXPORT_FORMATS[format])
+
+@app.get("/orders/aggregate")
+async def aggregate_orders(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    customer: Optional[str] = None,
+    group_by: str = "customerName"
+):
+    archive = _require_order_archive()
+    try:
+        groups = await asyncio.to_thread(archive.aggregate, start, end, customer, group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"group_by": group_by, "groups": groups}
+
+@app.get("/providers/stats")
+async def provider_stats():
+    return provider_router.provider_stats()
+
 @app.post("/upload/image/claude")
 async def upload_image_claude(file: UploadFile = File(...)):
+    if "claude" not in provider_registry:
+        raise HTTPException(
+            status_code=500,
+            detail="Claude provider not enabled. Please add claude to the ENABLED_PROVIDERS environment variable."
+        )
+    
     if not ANTHROPIC_API_KEY:
         raise HTTPException(
             status_code=500,
@@ -52,28 +436,38 @@ async def upload_image_claude(file: UploadFile = File(...)):
         )
     
     try:
-        file_location = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(file.file, file_object)
+        data = await read_upload(file, "claude")
+        persist_upload(data, file.filename)
         
-        extracted_text = claude_extractor.extract_text(file_location)
+        extractor = await provider_registry.get_async("claude")
+        extracted_text = await extractor.extract_text_async(data, mime_type=file.content_type)
+        # None when the result came from the cache
+        preprocessing = get_last_preprocessed()
         
         return JSONResponse(
             content={
                 "message": "File uploaded and processed successfully",
                 "filename": file.filename,
                 "content_type": file.content_type,
-                "file_size": os.path.getsize(file_location),
+                "file_size": len(data),
                 "extracted_text": extracted_text,
-                "extractor": "claude"
+                "extractor": "claude",
+                "preprocessing": preprocessing.to_dict() if preprocessing else None
             },
             status_code=200
         )
     except Exception as e:
+        logger.exception("Extraction failed", extra={"upload_filename": file.filename})
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/upload/image/google")
 async def upload_image_google(file: UploadFile = File(...)):
+    if "google" not in provider_registry:
+        raise HTTPException(
+            status_code=500,
+            detail="Google provider not enabled. Please add google to the ENABLED_PROVIDERS environment variable."
+        )
+    
     if file.content_type not in ALLOWED_IMAGE_TYPES:
         raise HTTPException(
             status_code=400,
@@ -81,35 +475,86 @@ async def upload_image_google(file: UploadFile = File(...)):
         )
     
     try:
-        file_location = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(file.file, file_object)
+        data = await read_upload(file, "google")
+        persist_upload(data, file.filename)
         
-        extracted_text = google_extractor.extract_text(file_location)
-        print(extracted_text)
-        purchase_order: Optional[PurchaseOrder] = parse_purchase_order(extracted_text)
-        print(purchase_order)
-        if purchase_order:
-            purchase_order = PurchaseOrderList().get_purchase_order(purchase_order.purchaseOrderNumber)
-            print(purchase_order)
+        extractor = await provider_registry.get_async("google")
+        extracted_text = await extractor.extract_text_async(data, mime_type=file.content_type)
+        # None when the result came from the cache
+        preprocessing = get_last_preprocessed()
+        near_duplicate = get_last_near_duplicate()
+        extracted_purchase_order, purchase_order, purchase_order_match, candidates = match_purchase_order(extracted_text, "google", file.filename)
+        logger.debug("Purchase order extracted", extra={
+            "upload_filename": file.filename,
+            "purchase_order_number": extracted_purchase_order.purchaseOrderNumber if extracted_purchase_order else None,
+            "matched": purchase_order is not None
+        })
         
         return JSONResponse(
             content={
                 "message": "File uploaded and processed successfully",
                 "filename": file.filename,
                 "content_type": file.content_type,
-                "file_size": os.path.getsize(file_location),
+                "file_size": len(data),
                 "extracted_text": extracted_text,
                 "extractor": "google",
-                "purchase_order": purchase_order.to_dict() if purchase_order else None
+                "preprocessing": preprocessing.to_dict() if preprocessing else None,
+                "near_duplicate": near_duplicate.to_dict() if near_duplicate else None,
+                "extracted_purchase_order": extracted_purchase_order.to_dict() if extracted_purchase_order else None,
+                "purchase_order": purchase_order.to_dict() if purchase_order else None,
+                "purchase_order_match": purchase_order_match.to_dict() if purchase_order_match else None,
+                "purchase_order_candidates": [candidate.to_dict() for candidate in candidates]
             },
             status_code=200
         )
     except Exception as e:
+        logger.exception("Extraction failed", extra={"upload_filename": file.filename})
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/upload/image/auto")
+async def upload_image_auto(file: UploadFile = File(...)):
+    if file.content_type not in ALLOWED_IMAGE_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_IMAGE_TYPES)}"
+        )
+    
+    try:
+        data = await read_upload(file, "auto")
+        persist_upload(data, file.filename)
+        
+        routed = await provider_router.route(data, mime_type=file.content_type)
+        extracted_purchase_order, purchase_order, purchase_order_match, candidates = match_purchase_order(routed.text, routed.provider, file.filename)
+        
+        return JSONResponse(
+            content={
+                "message": "File uploaded and processed successfully",
+                "filename": file.filename,
+                "content_type": file.content_type,
+                "file_size": len(data),
+                "extracted_text": routed.text,
+                "extractor": routed.provider,
+                "hedged": routed.hedged,
+                "attempts": routed.attempts,
+                "extracted_purchase_order": extracted_purchase_order.to_dict() if extracted_purchase_order else None,
+                "purchase_order": purchase_order.to_dict() if purchase_order else None,
+                "purchase_order_match": purchase_order_match.to_dict() if purchase_order_match else None,
+                "purchase_order_candidates": [candidate.to_dict() for candidate in candidates]
+            },
+            status_code=200
+        )
+    except Exception as e:
+        logger.exception("Extraction failed", extra={"upload_filename": file.filename})
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/upload/image/openai")
 async def upload_image_openai(file: UploadFile = File(...)):
+    if "openai" not in provider_registry:
+        raise HTTPException(
+            status_code=500,
+            detail="OpenAI provider not enabled. Please add openai to the ENABLED_PROVIDERS environment variable."
+        )
+    
     if not OPENAI_API_KEY:
         raise HTTPException(
             status_code=500,
@@ -123,56 +568,243 @@ async def upload_image_openai(file: UploadFile = File(...)):
         )
     
     try:
-        file_location = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(file.file, file_object)
+        data = await read_upload(file, "openai")
+        persist_upload(data, file.filename)
         
-        extracted_text = openai_extractor.extract_text(file_location)
+        extractor = await provider_registry.get_async("openai")
+        extracted_text = await extractor.extract_text_async(data, mime_type=file.content_type)
+        # None when the result came from the cache
+        preprocessing = get_last_preprocessed()
         
         return JSONResponse(
             content={
                 "message": "File uploaded and processed successfully",
                 "filename": file.filename,
                 "content_type": file.content_type,
-                "file_size": os.path.getsize(file_location),
+                "file_size": len(data),
                 "extracted_text": extracted_text,
-                "extractor": "openai"
+                "extractor": "openai",
+                "preprocessing": preprocessing.to_dict() if preprocessing else None
             },
             status_code=200
         )
     except Exception as e:
+        logger.exception("Extraction failed", extra={"upload_filename": file.filename})
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/upload/pages")
+async def upload_pages(files: List[UploadFile] = File(...), provider: str = "google"):
+    if provider not in vision_extractors:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Provider not available. Available providers: {', '.join(vision_extractors)}"
+        )
+    
+    for file in files:
+        if file.content_type not in ALLOWED_IMAGE_TYPES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File type not allowed: {file.filename}. Allowed types: {', '.join(ALLOWED_IMAGE_TYPES)}"
+            )
+    
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many pages: {len(files)}. Maximum is {BATCH_MAX_FILES}."
+        )
+    
+    try:
+        pages = []
+        for file in files:
+            data = await read_upload(file, provider)
+            persist_upload(data, file.filename)
+            pages.append((data, normalize_mime_type(file.content_type)))
+        
+        # Pages are packed into as few provider calls as the provider allows
+        extractor = await get_vision_extractor(provider)
+        texts = await extractor.extract_pages_async(pages)
+        with stage("parse"):
+            extracted_purchase_order = merge_purchase_orders([parse_purchase_order(text) for text in texts])
+        with stage("lookup"):
+            purchase_order, purchase_order_match, candidates = lookup_purchase_order(extracted_purchase_order)
+        archive_purchase_order(extracted_purchase_order, purchase_order, provider, files[0].filename)
+        
+        return JSONResponse(
+            content={
+                "message": "Pages uploaded and processed successfully",
+                "count": len(pages),
+                "extractor": provider,
+                "pages": [
+                    {"page": number, "filename": file.filename, "extracted_text": text}
+                    for number, (file, text) in enumerate(zip(files, texts), start=1)
+                ],
+                "extracted_purchase_order": extracted_purchase_order.to_dict() if extracted_purchase_order else None,
+                "purchase_order": purchase_order.to_dict() if purchase_order else None,
+                "purchase_order_match": purchase_order_match.to_dict() if purchase_order_match else None,
+                "purchase_order_candidates": [candidate.to_dict() for candidate in candidates]
+            },
+            status_code=200
+        )
+    except Exception as e:
+        logger.exception("Page extraction failed", extra={"pages": len(files)})
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/upload/pdf")
-async def upload_pdf(file: UploadFile = File(...)):
+async def upload_pdf(file: UploadFile = File(...), provider: Optional[str] = None):
     if file.content_type not in ALLOWED_PDF_TYPES:
         raise HTTPException(
             status_code=400,
             detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_PDF_TYPES)}"
         )
     
+    if provider is not None and provider not in vision_extractors:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Provider not available. Available providers: {', '.join(vision_extractors)}"
+        )
+    
     try:
-        file_location = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(file.file, file_object)
+        data = await read_upload(file, provider or "pymupdf")
+        persist_upload(data, file.filename)
+        
+        if provider is None:
+            extracted_text = await get_pdf_engine().extract_text_async(data)
+            return JSONResponse(
+                content={
+                    "message": "File uploaded and processed successfully",
+                    "filename": file.filename,
+                    "content_type": file.content_type,
+                    "file_size": len(data),
+                    "extracted_text": extracted_text,
+                    "extractor": "pymupdf"
+                },
+                status_code=200
+            )
         
-        # Use any extractor for PDFs since they all use PyMuPDF
-        extracted_text = claude_extractor.extract_text(file_location)
+        # Scanned pages go to the vision provider, pages with a text layer stay local
+        pages = await get_pdf_engine().extract_pages_hybrid(data, await get_vision_extractor(provider))
         
         return JSONResponse(
             content={
                 "message": "File uploaded and processed successfully",
                 "filename": file.filename,
                 "content_type": file.content_type,
-                "file_size": os.path.getsize(file_location),
-                "extracted_text": extracted_text,
-                "extractor": "pymupdf"
+                "file_size": len(data),
+                "extracted_text": "".join(page["text"] for page in pages),
+                "extractor": f"pymupdf+{provider}",
+                "pages": pages
             },
             status_code=200
         )
     except Exception as e:
+        logger.exception("Extraction failed", extra={"upload_filename": file.filename})
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/upload/pdf/stream")
+async def upload_pdf_stream(file: UploadFile = File(...)):
+    if file.content_type not in ALLOWED_PDF_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_PDF_TYPES)}"
+        )
+    
+    data = await read_upload(file, "pymupdf")
+    persist_upload(data, file.filename)
+    
+    async def stream_pages():
+        # One JSON object per line, emitted as soon as each page range is parsed
+        try:
+            async for page_number, text in get_pdf_engine().iter_pages(data):
+                yield json.dumps({"page": page_number, "text": text}) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+    
+    return StreamingResponse(stream_pages(), media_type="application/x-ndjson")
+
+@app.post("/upload/batch")
+async def upload_batch(files: List[UploadFile] = File(...), provider: str = "google", stream: bool = False):
+    if provider not in vision_extractors:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Provider not available. Available providers: {', '.join(vision_extractors)}"
+        )
+    
+    try:
+        items = await _read_batch(files, provider)
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+    
+    extractor = await get_vision_extractor(provider)
+    # Only start as many items as the provider can serve, so pending images are not all decoded at once
+    limit = asyncio.Semaphore(get_max_concurrency(provider))
+    
+    async def run(index: int, item: tuple[str, Optional[str], bytes]) -> dict:
+        async with limit:
+            return await process_batch_item(index, *item, extractor)
+    
+    if stream:
+        async def stream_results():
+            # One JSON object per line, in completion order; "index" gives the input position
+            tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    yield json.dumps(await next_done) + "\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+        
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+    
+    results = await asyncio.gather(*(run(index, item) for index, item in enumerate(items)))
+    
+    return JSONResponse(
+        content={
+            "message": "Batch processed",
+            "count": len(results),
+            "failed": sum(1 for result in results if result["status"] == "error"),
+            "extractor": provider,
+            "results": results
+        },
+        status_code=200
+    )
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...), provider: str = "google", callback_url: Optional[str] = None):
+    if provider not in vision_extractors:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Provider not available. Available providers: {', '.join(vision_extractors)}"
+        )
+    
+    allowed_types = ALLOWED_IMAGE_TYPES + ALLOWED_PDF_TYPES
+    if file.content_type not in allowed_types:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File type not allowed. Allowed types: {', '.join(allowed_types)}"
+        )
+    
+    data = await read_upload(file, provider)
+    try:
+        job = await job_queue.submit(data, file.filename, file.content_type, provider, callback_url)
+    except CallbackNotAllowedError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/jobs/metrics")
+async def job_metrics():
+    return await job_queue.metrics()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_dict()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    from serving import DEFAULT_HOST, DEFAULT_PORT, get_workers
+    # By now this module has built its per-process state, so workers must be started from serving.py
+    if get_workers() > 1:
+        logger.warning("WORKERS is ignored by python main.py; use python serving.py to start several workers")
+    uvicorn.run(app, host=DEFAULT_HOST, port=DEFAULT_PORT)
@@ -1,71 +1,147 @@
+import math
 import os
-from typing import Optional
+from typing import Optional, Union
 import base64
-import io
-import fitz  # PyMuPDF for PDF processing
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from base_text_extractor import PAGES_PROMPT, BaseTextExtractor
+from image_preprocessing import PreprocessedImage
+from purchase_orders import purchase_order_pages_schema, purchase_order_schema
+from transport import get_async_http_client, get_http_client
 
-class OpenAIVisionTextExtractor:
-    def __init__(self, api_key: Optional[str] = None):
+PROMPT = "Extract the packing slip in this image as a purchase order: tracking number, date, customer name and address, purchase order number, and every item with its quantity and price."
+
+class OpenAIVisionTextExtractor(BaseTextExtractor):
+    provider = "openai"
+    model = "gpt-4o"
+    prompt = PROMPT
+    max_pages_per_call = 16
+    max_output_tokens = 16384
+    max_input_tokens = 128_000
+    max_request_bytes = 50 * 2**20
+
+    def __init__(self, api_key: Optional[str] = None, max_concurrency: Optional[int] = None):
         """
         Initialize the OpenAI Vision TextExtractor.
         If api_key is not provided, it will look for OPENAI_API_KEY environment variable.
+        max_concurrency bounds in-flight async calls; defaults to OPENAI_MAX_CONCURRENCY.
         """
+        super().__init__(max_concurrency)
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OpenAI API key is required. Either pass it to the constructor or set OPENAI_API_KEY environment variable.")
-        
-        self.client = 5#OpenAI(api_key=self.api_key)
-    
-    def _extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extract text from PDF using PyMuPDF."""
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        return text
-    
-    def extract_text(self, file_path: str) -> str:
-        """
-        Extract text from an image or PDF file using OpenAI's Vision API.
-        
-        Args:
-            file_path (str): Path to the image or PDF file
-            
-        Returns:
-            str: Extracted text from the file
-        """
-        file_extension = os.path.splitext(file_path)[1].lower()
-        
-        if file_extension in ['.pdf']:
-            # For PDFs, extract text directly using PyMuPDF
-            return self._extract_text_from_pdf(file_path)
-        elif file_extension in ['.jpg', '.jpeg', '.png']:
-            # For images, use OpenAI's Vision API
-            with open(file_path, "rb") as image_file:
-                response = self.client.chat.completions.create(
-                    model="gpt-4-vision-preview",
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": "Please extract all the text content from this image. Format it in a clean, readable way."
-                                },
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{base64.b64encode(image_file.read()).decode('utf-8')}"
-                                    }
-                                }
-                            ]
+
+        # Retries are handled by the shared transport, not the SDK
+        self.client = OpenAI(api_key=self.api_key, http_client=get_http_client(), max_retries=0)
+        self.async_client = AsyncOpenAI(api_key=self.api_key, http_client=get_async_http_client(), max_retries=0)
+        # Structured outputs constrain the reply to the PurchaseOrder schema
+        self.response_format = {
+            "type": "json_schema",
+            "json_schema": {"name": "PurchaseOrder", "schema": purchase_order_schema()}
+        }
+        self.pages_response_format = {
+            "type": "json_schema",
+            "json_schema": {"name": "PurchaseOrderPages", "schema": purchase_order_pages_schema()}
+        }
+
+    def _build_messages(self, image_data: Union[bytes, memoryview], mime_type: str) -> list:
+        """Build the messages payload for an OpenAI Vision request."""
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": PROMPT
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{base64.b64encode(image_data).decode('utf-8')}"
                         }
-                    ],
-                    max_tokens=4096
-                )
-            
-            return response.choices[0].message.content
-        else:
-            raise ValueError(f"Unsupported file type: {file_extension}") 
\ No newline at end of file
+                    }
+                ]
+            }
+        ]
+
+    def _build_pages_messages(self, pages: list[PreprocessedImage]) -> list:
+        """Build an OpenAI request for several pages, each image preceded by its page number."""
+        content = [{"type": "text", "text": PAGES_PROMPT.format(count=len(pages))}]
+        for number, page in enumerate(pages, start=1):
+            content.append({"type": "text", "text": f"Page {number}:"})
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{page.mime_type};base64,{base64.b64encode(page.data).decode('utf-8')}"
+                }
+            })
+        return [{"role": "user", "content": content}]
+
+    def image_tokens(self, width: int, height: int) -> int:
+        # High detail: fit in 2048x2048, scale the short side down to 768, then 170 tokens per 512 pixel tile plus 85
+        scale = min(1.0, 2048 / max(width, height))
+        scale *= min(1.0, 768 / (min(width, height) * scale))
+        tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+        return 85 + 170 * tiles
+
+    @staticmethod
+    def _token_usage(response) -> Optional[tuple[int, int]]:
+        if response.usage is None:
+            return None
+        return response.usage.prompt_tokens, response.usage.completion_tokens
+
+    @staticmethod
+    def _response_text(response) -> str:
+        # content is None when the model refuses; that is an unparseable reply
+        return response.choices[0].message.content or ""
+
+    def _extract_image_text(self, data: Union[bytes, memoryview], mime_type: str, max_tokens: Optional[int] = None) -> str:
+        response = self.transport.call(
+            lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=self._build_messages(data, mime_type),
+                response_format=self.response_format,
+                max_tokens=max_tokens or 4096
+            ),
+            estimated_tokens=self._estimated_tokens(data, mime_type),
+            usage=self._usage
+        )
+        return self._response_text(response)
+
+    async def _extract_image_text_async(self, data: Union[bytes, memoryview], mime_type: str, max_tokens: Optional[int] = None) -> str:
+        response = await self.transport.call_async(
+            lambda: self.async_client.chat.completions.create(
+                model=self.model,
+                messages=self._build_messages(data, mime_type),
+                response_format=self.response_format,
+                max_tokens=max_tokens or 4096
+            ),
+            estimated_tokens=self._estimated_tokens(data, mime_type),
+            usage=self._usage
+        )
+        return self._response_text(response)
+
+    def _extract_pages_text(self, pages: list[PreprocessedImage]) -> str:
+        response = self.transport.call(
+            lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=self._build_pages_messages(pages),
+                response_format=self.pages_response_format,
+                max_tokens=self.max_output_tokens
+            ),
+            estimated_tokens=sum(self._estimated_tokens(page.data, page.mime_type) for page in pages),
+            usage=self._usage
+        )
+        return self._response_text(response)
+
+    async def _extract_pages_text_async(self, pages: list[PreprocessedImage]) -> str:
+        response = await self.transport.call_async(
+            lambda: self.async_client.chat.completions.create(
+                model=self.model,
+                messages=self._build_pages_messages(pages),
+                response_format=self.pages_response_format,
+                max_tokens=self.max_output_tokens
+            ),
+            estimated_tokens=sum(self._estimated_tokens(page.data, page.mime_type) for page in pages),
+            usage=self._usage
+        )
+        return self._response_text(response)
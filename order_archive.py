@@ -0,0 +1,333 @@
+import io
+import itertools
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime, timezone
+from typing import Iterator, Optional
+from purchase_orders import PurchaseOrder
+
+DEFAULT_ARCHIVE_DIR = "order_archive"
+# Rows buffered in memory before they are written out as one Parquet file
+DEFAULT_FLUSH_ROWS = 50_000
+DEFAULT_FLUSH_SECONDS = 300.0
+# Rows read per batch by exports and aggregations
+SCAN_BATCH_SIZE = 65_536
+
+EXPORT_FORMATS = {
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+GROUP_BY_COLUMNS = ("customerName", "day", "provider", "itemId", "itemName")
+
+logger = logging.getLogger(__name__)
+
+
+def _schema():
+    # pyarrow is imported on first use to keep startup fast
+    import pyarrow as pa
+
+    return pa.schema([
+        ("day", pa.string()),
+        ("extractedAt", pa.timestamp("ms", tz="UTC")),
+        ("provider", pa.string()),
+        ("filename", pa.string()),
+        ("purchaseOrderNumber", pa.string()),
+        ("trackingNumber", pa.string()),
+        ("date", pa.string()),
+        ("customerName", pa.string()),
+        ("customerAddress", pa.string()),
+        ("matchedPurchaseOrderNumber", pa.string()),
+        ("itemIndex", pa.int32()),
+        ("itemId", pa.string()),
+        ("itemName", pa.string()),
+        ("itemQuantity", pa.int64()),
+        ("itemPrice", pa.float64()),
+    ])
+
+
+def _sum_by(table, keys: list[str]):
+    """Sum lineItems, quantity and price per distinct keys, keeping the column names."""
+    import pyarrow as pa
+
+    result = table.group_by(keys).aggregate([("lineItems", "sum"), ("quantity", "sum"), ("price", "sum")])
+    return pa.table({
+        **{key: result[key] for key in keys},
+        "lineItems": result["lineItems_sum"],
+        "quantity": result["quantity_sum"],
+        "price": result["price_sum"],
+    })
+
+
+def _partition_day(name: str) -> Optional[str]:
+    return name[len("day="):] if name.startswith("day=") else None
+
+
+class OrderArchive:
+    def __init__(self, root: str, flush_rows: int = DEFAULT_FLUSH_ROWS):
+        """
+        Append-only columnar archive of the purchase orders extracted by the pipeline.
+        Each order is stored as one row per line item, with the order's fields repeated
+        on every row (an order without items gets one row with empty item fields), so
+        line items can be filtered and aggregated without joins. Rows are buffered and
+        written as Parquet files under root/day=YYYY-MM-DD/, partitioned by the UTC day
+        they were extracted on. Files are never rewritten; each flush adds a new one
+        named after the process, so several workers can share root. root is created
+        by the first flush.
+        """
+        self.root = root
+        self.flush_rows = flush_rows
+        self._rows: list[dict] = []
+        self._lock = threading.Lock()
+        # One flush at a time, so periodic and size-triggered flushes do not interleave
+        self._flush_lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> Optional["OrderArchive"]:
+        """
+        Build an archive in ORDER_ARCHIVE_DIR (default order_archive) flushing every
+        ORDER_ARCHIVE_FLUSH_ROWS rows; returns None when ORDER_ARCHIVE is false.
+        """
+        if os.getenv("ORDER_ARCHIVE", "true").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            os.getenv("ORDER_ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR),
+            flush_rows=int(os.getenv("ORDER_ARCHIVE_FLUSH_ROWS", DEFAULT_FLUSH_ROWS)),
+        )
+
+    def append(
+        self,
+        purchaseOrder: PurchaseOrder,
+        provider: Optional[str] = None,
+        filename: Optional[str] = None,
+        matchedPurchaseOrderNumber: Optional[str] = None,
+    ) -> bool:
+        """
+        Buffer the rows of one extracted purchase order.
+
+        Args:
+            purchaseOrder (PurchaseOrder): The order parsed from the extracted text
+            provider (Optional[str]): The extractor that produced it
+            filename (Optional[str]): The uploaded file it was extracted from
+            matchedPurchaseOrderNumber (Optional[str]): Number of the stored order it was matched to, if any
+
+        Returns:
+            bool: True once the buffer holds flush_rows rows and should be flushed
+        """
+        extractedAt = datetime.now(timezone.utc)
+        order = {
+            "day": extractedAt.date().isoformat(),
+            "extractedAt": extractedAt,
+            "provider": provider,
+            "filename": filename,
+            "purchaseOrderNumber": purchaseOrder.purchaseOrderNumber,
+            "trackingNumber": purchaseOrder.trackingNumber,
+            "date": purchaseOrder.date,
+            "customerName": purchaseOrder.customerName,
+            "customerAddress": purchaseOrder.customerAddress,
+            "matchedPurchaseOrderNumber": matchedPurchaseOrderNumber,
+        }
+        rows = [
+            {
+                **order,
+                "itemIndex": index,
+                "itemId": item.itemId,
+                "itemName": item.itemName,
+                "itemQuantity": item.itemQuantity,
+                "itemPrice": item.itemPrice,
+            }
+            for index, item in enumerate(purchaseOrder.items)
+        ] or [order]
+        with self._lock:
+            self._rows.extend(rows)
+            return len(self._rows) >= self.flush_rows
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self) -> list[str]:
+        """Write buffered rows to one new Parquet file per day; returns the paths written."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return []
+            by_day: dict[str, list[dict]] = {}
+            for row in rows:
+                by_day.setdefault(row["day"], []).append(row)
+
+            schema = _schema()
+            paths = []
+            for day, day_rows in by_day.items():
+                directory = os.path.join(self.root, f"day={day}")
+                os.makedirs(directory, exist_ok=True)
+                name = f"part-{int(day_rows[0]['extractedAt'].timestamp() * 1000)}-{os.getpid()}-{next(self._sequence)}.parquet"
+                path = os.path.join(directory, name)
+                # Written under a name readers skip, then renamed into place
+                tmp_path = f"{path}.tmp"
+                pq.write_table(pa.Table.from_pylist(day_rows, schema=schema), tmp_path, compression="zstd")
+                os.replace(tmp_path, path)
+                paths.append(path)
+            logger.debug("Order archive flushed", extra={"rows": len(rows), "files": len(paths)})
+            return paths
+
+    def files(self, start: Optional[date] = None, end: Optional[date] = None) -> list[str]:
+        """Parquet files of the day partitions from start to end, both inclusive; partitions outside are not opened."""
+        if not os.path.isdir(self.root):
+            return []
+        paths = []
+        for name in sorted(os.listdir(self.root)):
+            day = _partition_day(name)
+            if day is None:
+                continue
+            if (start and day < start.isoformat()) or (end and day > end.isoformat()):
+                continue
+            directory = os.path.join(self.root, name)
+            paths.extend(
+                os.path.join(directory, file)
+                for file in sorted(os.listdir(directory))
+                if file.endswith(".parquet")
+            )
+        return paths
+
+    def scan(
+        self,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        customer: Optional[str] = None,
+        columns: Optional[list[str]] = None,
+    ) -> Iterator:
+        """
+        Yield record batches of the archived rows matching the filters, reading one
+        batch at a time, so a scan over millions of rows runs in bounded memory.
+        Rows still buffered in this process follow the files' rows, so reading does
+        not need a flush; other processes' buffered rows appear once they flush.
+
+        Args:
+            start (Optional[date]): First UTC extraction day to include
+            end (Optional[date]): Last UTC extraction day to include
+            customer (Optional[str]): Only rows with this exact customerName
+            columns (Optional[list[str]]): Columns to read; all when None
+        """
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        # A flush moves rows from the buffer to a file; holding its lock while taking
+        # both means every row is read exactly once
+        with self._flush_lock:
+            paths = self.files(start, end)
+            with self._lock:
+                rows = list(self._rows)
+
+        if paths:
+            dataset = ds.dataset(paths, schema=_schema(), format="parquet")
+            row_filter = ds.field("customerName") == customer if customer is not None else None
+            yield from dataset.to_batches(columns=columns, filter=row_filter, batch_size=SCAN_BATCH_SIZE)
+
+        rows = [
+            row for row in rows
+            if not (start and row["day"] < start.isoformat())
+            and not (end and row["day"] > end.isoformat())
+            and (customer is None or row["customerName"] == customer)
+        ]
+        if rows:
+            table = pa.Table.from_pylist(rows, schema=_schema())
+            yield from (table.select(columns) if columns else table).to_batches(max_chunksize=SCAN_BATCH_SIZE)
+
+    def export(
+        self,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        customer: Optional[str] = None,
+        format: str = "jsonl",
+    ) -> Iterator[bytes]:
+        """
+        Stream the rows matching the filters as JSON lines, CSV or an Arrow IPC stream,
+        one chunk per record batch.
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {format}. Formats: {', '.join(EXPORT_FORMATS)}")
+        import pyarrow as pa
+        import pyarrow.csv as csv
+
+        batches = self.scan(start, end, customer)
+        if format == "jsonl":
+            for batch in batches:
+                lines = []
+                for row in batch.to_pylist():
+                    row["extractedAt"] = row["extractedAt"].isoformat()
+                    lines.append(json.dumps(row) + "\n")
+                yield "".join(lines).encode("utf-8")
+            return
+
+        # The CSV and IPC writers append to sink; each chunk is what one batch added
+        sink = io.BytesIO()
+        schema = _schema()
+        writer = csv.CSVWriter(sink, schema) if format == "csv" else pa.ipc.new_stream(sink, schema)
+        for batch in batches:
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+        writer.close()
+        yield sink.getvalue()
+
+    def aggregate(
+        self,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        customer: Optional[str] = None,
+        group_by: str = "customerName",
+    ) -> list[dict]:
+        """
+        Total the line items matching the filters per group_by value.
+        Each batch is grouped by (group_by, purchaseOrderNumber) with Arrow's hash
+        aggregation and the partial sums are merged, so memory grows with the number of
+        orders rather than line items.
+
+        Returns:
+            list[dict]: Per group, the number of orders and line items, the total item
+                quantity and the total of item prices, ordered by the group value
+        """
+        if group_by not in GROUP_BY_COLUMNS:
+            raise ValueError(f"Cannot group by {group_by}. Columns: {', '.join(GROUP_BY_COLUMNS)}")
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        keys = [group_by, "purchaseOrderNumber"]
+        partials = []
+        for batch in self.scan(start, end, customer, columns=keys + ["itemIndex", "itemQuantity", "itemPrice"]):
+            partials.append(_sum_by(pa.table({
+                **{key: batch.column(key) for key in keys},
+                # Rows of orders without items have no itemIndex and are not line items
+                "lineItems": pc.cast(pc.is_valid(batch.column("itemIndex")), pa.int64()),
+                "quantity": batch.column("itemQuantity"),
+                "price": batch.column("itemPrice"),
+            }), keys))
+        if not partials:
+            return []
+
+        orders = _sum_by(pa.concat_tables(partials), keys)
+        totals = orders.group_by(group_by).aggregate([
+            ("purchaseOrderNumber", "count"),
+            ("lineItems", "sum"),
+            ("quantity", "sum"),
+            ("price", "sum"),
+        ]).sort_by([(group_by, "ascending")])
+        return [
+            {
+                group_by: row[group_by],
+                "orders": row["purchaseOrderNumber_count"],
+                "lineItems": row["lineItems_sum"] or 0,
+                "quantity": row["quantity_sum"] or 0,
+                "price": round(row["price_sum"], 2) if row["price_sum"] is not None else None,
+            }
+            for row in totals.to_pylist()
+        ]
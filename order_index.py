@@ -0,0 +1,304 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+from purchase_order_matching import (
+    DEFAULT_MAX_DISTANCE,
+    PurchaseOrderMatch,
+    _deletes,
+    edit_distance,
+    match_sort_key,
+    normalize_order_key,
+    query_variants,
+    resolve_candidates,
+)
+from purchase_orders import PurchaseOrder, default_purchase_orders, read_purchase_orders
+
+MAGIC = b"POINDEX2"
+# magic, order count, records offset, max distance, then (offset, capacity) of each table
+HEADER = struct.Struct("<8s3Q10Q")
+# JSON length, then lengths of the normalized purchase order and tracking numbers stored before it
+RECORD_HEADER = struct.Struct("<IHH")
+SLOT = struct.Struct("<QQ")
+
+NUMBER_TABLE = 0
+TRACKING_TABLE = 1
+CUSTOMER_TABLE = 2
+# Normalized numbers, for exact matches
+KEY_TABLE = 3
+# Deletion variants of the normalized numbers, without the numbers themselves
+VARIANT_TABLE = 4
+TABLES = 5
+
+MATCH_FIELDS = ("purchaseOrderNumber", "trackingNumber")
+
+
+def _hash(key: str) -> int:
+    # 0 marks an empty slot, so no key may hash to it
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+def _capacity(entries: int) -> int:
+    """Smallest power of two keeping the table at most three quarters full."""
+    capacity = 8
+    while capacity * 3 < entries * 4:
+        capacity *= 2
+    return capacity
+
+
+def _build_table(entries: array) -> tuple[array, int]:
+    """Lay out (hash, record offset) pairs as an open-addressing table with linear probing."""
+    capacity = _capacity(len(entries) // 2)
+    mask = capacity - 1
+    table = array("Q", bytes(SLOT.size * capacity))
+    for index in range(0, len(entries), 2):
+        value = entries[index]
+        slot = value & mask
+        while table[2 * slot]:
+            slot = (slot + 1) & mask
+        table[2 * slot] = value
+        table[2 * slot + 1] = entries[index + 1]
+    return table, capacity
+
+
+@contextmanager
+def _exclusive_lock(path: str):
+    """
+    Hold an exclusive lock on the file at path, across processes. fcntl is POSIX only,
+    so it is imported here rather than at module level; Windows locks through msvcrt.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    with open(path, "w") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        else:
+            import msvcrt
+
+            while True:
+                try:
+                    # Gives up after about ten seconds of retrying, so keep waiting
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _is_current(path: str) -> bool:
+    """Whether path holds an index in this module's format."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return False
+
+
+def build_order_index(purchaseOrders: Iterable[PurchaseOrder], path: str, max_distance: int = DEFAULT_MAX_DISTANCE):
+    """
+    Write purchase orders to a read-only index file for MappedPurchaseOrderList.
+    Each order is stored once as JSON, preceded by its normalized numbers so fuzzy
+    matching can check an order without decoding it. Hash tables follow from purchase
+    order number, tracking number, customer name, normalized number and the fuzzy-match
+    deletion variants of both numbers to the order's position. The file is written next
+    to path and renamed into place, so readers never see a partial index.
+    """
+    entries = [array("Q") for _ in range(TABLES)]
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    count = 0
+    with open(tmp_path, "wb") as f:
+        f.write(bytes(HEADER.size))
+        records_offset = f.tell()
+        for purchaseOrder in purchaseOrders:
+            offset = f.tell()
+            record = purchaseOrder.model_dump_json().encode("utf-8")
+            keys = [normalize_order_key(value or "") for value in (purchaseOrder.purchaseOrderNumber, purchaseOrder.trackingNumber)]
+            f.write(RECORD_HEADER.pack(len(record), *(len(key) for key in keys)))
+            # Normalized keys are ASCII, so their lengths in characters and bytes agree
+            f.write("".join(keys).encode("ascii"))
+            f.write(record)
+            count += 1
+
+            entries[NUMBER_TABLE].extend((_hash(purchaseOrder.purchaseOrderNumber), offset))
+            if purchaseOrder.trackingNumber:
+                entries[TRACKING_TABLE].extend((_hash(purchaseOrder.trackingNumber), offset))
+            if purchaseOrder.customerName:
+                entries[CUSTOMER_TABLE].extend((_hash(purchaseOrder.customerName), offset))
+            variants = set()
+            for key in dict.fromkeys(key for key in keys if key):
+                entries[KEY_TABLE].extend((_hash(key), offset))
+                variants |= _deletes(key, max_distance) - {key}
+            for variant in variants:
+                entries[VARIANT_TABLE].extend((_hash(variant), offset))
+
+        tables = []
+        for table_entries in entries:
+            table, capacity = _build_table(table_entries)
+            if sys.byteorder == "big":
+                table.byteswap()
+            tables.extend((f.tell(), capacity))
+            table.tofile(f)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, count, records_offset, max_distance, *tables))
+    os.replace(tmp_path, path)
+
+
+class MappedPurchaseOrderList:
+    def __init__(self, path: str):
+        """
+        Read-only purchase order store over an index file written by build_order_index.
+        The file is memory-mapped, so every worker process shares one copy of it in the
+        page cache instead of holding its own dictionaries of orders. Orders are decoded
+        on lookup. Offers the lookups of PurchaseOrderList and the match and best_match
+        of PurchaseOrderMatcher.
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self._records_offset, self.max_distance, *tables = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a purchase order index: {path}")
+        self._tables = [(tables[2 * index], tables[2 * index + 1]) for index in range(TABLES)]
+
+    @classmethod
+    def open_or_build(cls, index_path: str, source_path: Optional[str] = None) -> "MappedPurchaseOrderList":
+        """
+        Open the index at index_path, first (re)building it from source_path if it is
+        missing or older than the source. Without a source the demo orders are indexed.
+        An index written in an older format is rebuilt as well. Concurrent callers, e.g.
+        workers starting together, wait on a lock file so the index is built only once.
+        """
+        with _exclusive_lock(f"{index_path}.lock"):
+            stale = not _is_current(index_path) or (
+                source_path is not None and os.path.getmtime(index_path) < os.path.getmtime(source_path)
+            )
+            if stale:
+                purchaseOrders = read_purchase_orders(source_path) if source_path else default_purchase_orders()
+                build_order_index(purchaseOrders, index_path)
+        return cls(index_path)
+
+    def close(self):
+        self._map.close()
+
+    def _offsets(self, table: int, key: str) -> list[int]:
+        """Record offsets stored under key's hash; hash collisions are filtered by the caller."""
+        table_offset, capacity = self._tables[table]
+        value = _hash(key)
+        mask = capacity - 1
+        slot = value & mask
+        offsets = []
+        while True:
+            stored, offset = SLOT.unpack_from(self._map, table_offset + SLOT.size * slot)
+            if not stored:
+                return sorted(offsets)
+            if stored == value:
+                offsets.append(offset)
+            slot = (slot + 1) & mask
+
+    def _record(self, offset: int) -> PurchaseOrder:
+        length, number_length, tracking_length = RECORD_HEADER.unpack_from(self._map, offset)
+        start = offset + RECORD_HEADER.size + number_length + tracking_length
+        return PurchaseOrder.model_validate_json(self._map[start:start + length])
+
+    def _record_keys(self, offset: int) -> tuple[str, str]:
+        """The normalized purchase order and tracking numbers of the order at offset."""
+        _, number_length, tracking_length = RECORD_HEADER.unpack_from(self._map, offset)
+        start = offset + RECORD_HEADER.size
+        keys = self._map[start:start + number_length + tracking_length].decode("ascii")
+        return keys[:number_length], keys[number_length:]
+
+    def _find(self, table: int, field: str, value: str) -> list[PurchaseOrder]:
+        purchaseOrders = (self._record(offset) for offset in self._offsets(table, value))
+        return [purchaseOrder for purchaseOrder in purchaseOrders if getattr(purchaseOrder, field) == value]
+
+    def get_purchase_order(self, purchaseOrderNumber: str) -> Optional[PurchaseOrder]:
+        # Like PurchaseOrderList, a later order with the same number wins
+        found = self._find(NUMBER_TABLE, "purchaseOrderNumber", purchaseOrderNumber)
+        return found[-1] if found else None
+
+    def get_purchase_order_by_tracking_number(self, trackingNumber: str) -> Optional[PurchaseOrder]:
+        found = self._find(TRACKING_TABLE, "trackingNumber", trackingNumber)
+        return found[-1] if found else None
+
+    def get_purchase_orders_by_customer_name(self, customerName: str) -> list[PurchaseOrder]:
+        return self._find(CUSTOMER_TABLE, "customerName", customerName)
+
+    def iter_purchase_orders(self) -> Iterator[PurchaseOrder]:
+        offset = self._records_offset
+        for _ in range(self._count):
+            yield self._record(offset)
+            offset += RECORD_HEADER.size + sum(RECORD_HEADER.unpack_from(self._map, offset))
+
+    def get_purchase_orders(self) -> list[PurchaseOrder]:
+        """Decode every order; prefer iter_purchase_orders for large indexes."""
+        return list(self.iter_purchase_orders())
+
+    def __len__(self) -> int:
+        return self._count
+
+    def match(self, value: str, limit: Optional[int] = 5) -> list[PurchaseOrderMatch]:
+        """
+        Find the purchase orders whose number or tracking number is closest to value,
+        as PurchaseOrderMatcher.match does, using the deletion variants in the index.
+        """
+        query = normalize_order_key(value)
+        if not query:
+            return []
+        matches = [match for _, found in self._candidates(query) for match in found]
+        matches.sort(key=match_sort_key)
+        return matches[:limit]
+
+    def _candidates(self, query: str) -> Iterator[tuple[int, list[PurchaseOrderMatch]]]:
+        """
+        Yield (distance, matches) per order within max_distance of query, orders with
+        query as a number first. Each order is checked on its stored normalized numbers
+        and only decoded when one of them is close enough.
+        """
+        seen = set()
+        for offset in self._candidate_offsets(query):
+            if offset in seen:
+                continue
+            seen.add(offset)
+            distances = [
+                (edit_distance(query, key, self.max_distance) if key else self.max_distance + 1, field)
+                for field, key in zip(MATCH_FIELDS, self._record_keys(offset))
+            ]
+            close = sorted((distance, field) for distance, field in distances if distance <= self.max_distance)
+            if not close:
+                continue
+            purchaseOrder = self._record(offset)
+            for distance, field in close:
+                original = getattr(purchaseOrder, field)
+                score = 1.0 - distance / max(len(query), len(normalize_order_key(original)))
+                yield distance, [PurchaseOrderMatch(purchaseOrder, field, original, distance, score)]
+
+    def _candidate_offsets(self, query: str) -> Iterator[int]:
+        """Offsets of orders sharing a deletion variant with query, those with query as a number first."""
+        yield from self._offsets(KEY_TABLE, query)
+        for variant in query_variants(query, self.max_distance):
+            if variant != query:
+                # A deletion variant of the query may itself be a number
+                yield from self._offsets(KEY_TABLE, variant)
+            yield from self._offsets(VARIANT_TABLE, variant)
+
+    def resolve(self, value: str) -> tuple[Optional[PurchaseOrderMatch], list[PurchaseOrderMatch]]:
+        """See PurchaseOrderMatcher.resolve."""
+        query = normalize_order_key(value)
+        if not query:
+            return None, []
+        return resolve_candidates(self._candidates(query))
+
+    def best_match(self, value: str) -> Optional[PurchaseOrderMatch]:
+        return self.resolve(value)[0]
@@ -0,0 +1,262 @@
+import asyncio
+import contextlib
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Iterator, Optional, Union
+
+DEFAULT_PAGES_PER_CHUNK = 16
+DEFAULT_PARALLEL_MIN_PAGES = 8
+DEFAULT_VISION_DPI = 150
+DEFAULT_MIN_TEXT_CHARS = 16
+
+TEXT_LAYER_SOURCE = "text_layer"
+VISION_SOURCE = "vision"
+
+
+# Documents handed to pool workers are the contents (in-process) or the path of a temporary copy
+PdfSource = Union[bytes, str]
+
+
+def _open(source: PdfSource):
+    import fitz  # PyMuPDF is imported on first use to keep startup fast
+    if isinstance(source, str):
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def _write_shared_copy(data: bytes) -> str:
+    """Write data to a temporary file that pool workers open by path; the caller removes it."""
+    fd, path = tempfile.mkstemp(prefix="pdf-engine-", suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _remove_shared_copy(path: str):
+    # Workers that still have the file open keep reading it on POSIX; elsewhere the copy is left to the OS
+    with contextlib.suppress(OSError):
+        os.remove(path)
+
+
+@contextlib.contextmanager
+def _shared_copy(data: bytes) -> Iterator[str]:
+    path = _write_shared_copy(data)
+    try:
+        yield path
+    finally:
+        _remove_shared_copy(path)
+
+
+def _extract_page_range(source: PdfSource, start: int, stop: int) -> list[str]:
+    """Extract the text of pages [start, stop) in the current process."""
+    doc = _open(source)
+    try:
+        return [doc[page_number].get_text() for page_number in range(start, stop)]
+    finally:
+        doc.close()
+
+
+def _analyze_page_range(source: PdfSource, start: int, stop: int, dpi: int, min_text_chars: int) -> list[tuple[str, Optional[bytes]]]:
+    """
+    Extract pages [start, stop) and rasterize the ones without a usable text layer.
+    Returns (text, png) pairs where png is None for pages whose text layer was kept.
+    """
+    doc = _open(source)
+    try:
+        results = []
+        for page_number in range(start, stop):
+            page = doc[page_number]
+            text = page.get_text()
+            if len(text.strip()) < min_text_chars and page.get_images():
+                results.append((text, page.get_pixmap(dpi=dpi).tobytes("png")))
+            else:
+                results.append((text, None))
+        return results
+    finally:
+        doc.close()
+
+
+def page_count(data: Union[bytes, memoryview]) -> int:
+    import fitz
+    doc = fitz.open(stream=bytes(data), filetype="pdf")
+    try:
+        return doc.page_count
+    finally:
+        doc.close()
+
+
+class PdfEngine:
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        pages_per_chunk: int = DEFAULT_PAGES_PER_CHUNK,
+        parallel_min_pages: int = DEFAULT_PARALLEL_MIN_PAGES,
+        vision_dpi: int = DEFAULT_VISION_DPI,
+        min_text_chars: int = DEFAULT_MIN_TEXT_CHARS,
+    ):
+        """
+        Initialize the shared PDF text engine.
+        Documents with at least parallel_min_pages pages are split into ranges of at
+        most pages_per_chunk pages and parsed across a pool of max_workers processes
+        (one per core by default). The document is written once to a temporary file
+        that the workers open, so only page ranges are sent to the pool. Smaller
+        documents are parsed in-process, where the pool start-up overhead would
+        outweigh the gain.
+        In hybrid extraction, image-bearing pages with fewer than min_text_chars characters
+        of text are treated as scanned and rasterized at vision_dpi for a vision provider.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_chunk = pages_per_chunk
+        self.parallel_min_pages = parallel_min_pages
+        self.vision_dpi = vision_dpi
+        self.min_text_chars = min_text_chars
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> "PdfEngine":
+        """
+        Build an engine from PDF_MAX_WORKERS, PDF_PAGES_PER_CHUNK, PDF_PARALLEL_MIN_PAGES,
+        PDF_VISION_DPI and PDF_MIN_TEXT_CHARS.
+        """
+        max_workers = os.getenv("PDF_MAX_WORKERS")
+        return cls(
+            max_workers=int(max_workers) if max_workers else None,
+            pages_per_chunk=int(os.getenv("PDF_PAGES_PER_CHUNK", DEFAULT_PAGES_PER_CHUNK)),
+            parallel_min_pages=int(os.getenv("PDF_PARALLEL_MIN_PAGES", DEFAULT_PARALLEL_MIN_PAGES)),
+            vision_dpi=int(os.getenv("PDF_VISION_DPI", DEFAULT_VISION_DPI)),
+            min_text_chars=int(os.getenv("PDF_MIN_TEXT_CHARS", DEFAULT_MIN_TEXT_CHARS)),
+        )
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def _page_ranges(self, count: int) -> list[tuple[int, int]]:
+        # Spread pages over every worker, but keep chunks small enough to stream early
+        chunk = max(1, min(self.pages_per_chunk, -(-count // self.max_workers)))
+        return [(start, min(start + chunk, count)) for start in range(0, count, chunk)]
+
+    def extract_pages(self, data: Union[bytes, memoryview]) -> list[str]:
+        """
+        Extract the text of every page.
+
+        Args:
+            data (bytes | memoryview): PDF file contents
+
+        Returns:
+            list[str]: Text of each page, in page order
+        """
+        data = bytes(data)
+        count = page_count(data)
+        if count < self.parallel_min_pages:
+            return _extract_page_range(data, 0, count)
+
+        with _shared_copy(data) as path:
+            futures = [self.executor.submit(_extract_page_range, path, start, stop) for start, stop in self._page_ranges(count)]
+            pages = []
+            for future in futures:
+                pages.extend(future.result())
+            return pages
+
+    def extract_text(self, data: Union[bytes, memoryview]) -> str:
+        return "".join(self.extract_pages(data))
+
+    async def _iter_ranges(self, func, data: bytes, *args) -> AsyncIterator[tuple[int, list]]:
+        """Run func over page ranges and yield (start, results) as each range finishes."""
+        count = await asyncio.to_thread(page_count, data)
+        if count < self.parallel_min_pages:
+            yield 0, await asyncio.to_thread(func, data, 0, count, *args)
+            return
+
+        loop = asyncio.get_running_loop()
+        path = await asyncio.to_thread(_write_shared_copy, data)
+
+        async def run_range(start: int, stop: int) -> tuple[int, list]:
+            return start, await loop.run_in_executor(self.executor, func, path, start, stop, *args)
+
+        tasks = [asyncio.ensure_future(run_range(start, stop)) for start, stop in self._page_ranges(count)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            _remove_shared_copy(path)
+
+    async def iter_pages(self, data: Union[bytes, memoryview]) -> AsyncIterator[tuple[int, str]]:
+        """
+        Yield (page_number, text) pairs as page ranges finish, without blocking the event loop.
+        Page numbers start at 1. Pages arrive in completion order, not page order.
+
+        Args:
+            data (bytes | memoryview): PDF file contents
+        """
+        async for start, pages in self._iter_ranges(_extract_page_range, bytes(data)):
+            for offset, text in enumerate(pages):
+                yield start + offset + 1, text
+
+    async def extract_pages_async(self, data: Union[bytes, memoryview]) -> list[str]:
+        """Async variant of extract_pages; returns page texts in page order."""
+        pages: list[Optional[str]] = []
+        async for page_number, text in self.iter_pages(data):
+            if page_number > len(pages):
+                pages.extend([None] * (page_number - len(pages)))
+            pages[page_number - 1] = text
+        return pages
+
+    async def extract_text_async(self, data: Union[bytes, memoryview]) -> str:
+        return "".join(await self.extract_pages_async(data))
+
+    async def extract_pages_hybrid(self, data: Union[bytes, memoryview], extractor) -> list[dict]:
+        """
+        Extract every page, sending only scanned pages to a vision extractor.
+        Pages with a text layer take the local PyMuPDF path; the rest are rasterized
+        in the process pool and sent to the extractor as PNGs, several pages per call.
+
+        Args:
+            data (bytes | memoryview): PDF file contents
+            extractor: Text extractor with an extract_pages_async method
+
+        Returns:
+            list[dict]: {"page", "source", "text"} per page, in page order; source is
+                "text_layer" or "vision"
+        """
+        pages: list[dict] = []
+        scanned: list[tuple[dict, bytes]] = []
+        async for start, results in self._iter_ranges(
+            _analyze_page_range, bytes(data), self.vision_dpi, self.min_text_chars
+        ):
+            for offset, (text, png) in enumerate(results):
+                page = {"page": start + offset + 1, "source": TEXT_LAYER_SOURCE, "text": text}
+                if png is not None:
+                    page["source"] = VISION_SOURCE
+                    scanned.append((page, png))
+                pages.append(page)
+
+        if scanned:
+            # Scanned pages are packed into as few provider calls as the provider allows
+            texts = await extractor.extract_pages_async([(png, "image/png") for _, png in scanned])
+            for (page, _), text in zip(scanned, texts):
+                page["text"] = text
+
+        pages.sort(key=lambda page: page["page"])
+        return pages
+
+
+_pdf_engine: Optional[PdfEngine] = None
+
+
+def get_pdf_engine() -> PdfEngine:
+    """Return the process-wide PDF engine, creating it from the environment on first use."""
+    global _pdf_engine
+    if _pdf_engine is None:
+        _pdf_engine = PdfEngine.from_env()
+    return _pdf_engine
@@ -0,0 +1,337 @@
+import io
+import os
+import threading
+import zlib
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Optional, Union
+from PIL import Image, ImageChops, ImageOps
+
+# Thresholds measured on benchmarks.corpus slips: re-encoded, rescaled, re-exposed and
+# re-framed copies stay within them, while distinct slips from the same template do not
+DEFAULT_THRESHOLD = 15
+DEFAULT_MAX_DIFFERENCE = 0.003
+DEFAULT_MAX_ENTRIES = 100_000
+MODES = ("off", "flag", "reuse")
+
+# A 16x16 difference hash: 256 bits, split into 16 chunks of 16 bits for multi-index hashing
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+CHUNK_BITS = 16
+CHUNKS = HASH_BITS // CHUNK_BITS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# Minimum ink difference between neighbouring cells that sets a hash bit, so blank paper
+# and sensor noise do not flip bits
+HASH_MARGIN = 8
+# Long edge of the ink map kept to verify candidates; fine enough to tell digits apart
+FINGERPRINT_SIZE = 256
+# Ink level (0-255) above which a fingerprint cell counts as ink
+FINGERPRINT_INK = 96
+# Candidates verified per lookup, closest hash first
+MAX_CANDIDATES = 4
+# Stored hashes compared per lookup. Chunk values of blank paper are shared by a large
+# share of slips, and scanning their buckets in full would grow with the index; buckets
+# are read rarest value first and newest entry first until the budget is spent
+MAX_SCAN = 2048
+# Images are decoded at a reduced size of at least this long edge
+DECODE_SIZE = 1024
+
+
+def _percentile(histogram: list[int], fraction: float) -> int:
+    target = sum(histogram) * fraction
+    total = 0
+    for level, count in enumerate(histogram):
+        total += count
+        if total >= target:
+            return level
+    return len(histogram) - 1
+
+
+def ink_map(image: Image.Image) -> Image.Image:
+    """
+    Map an image to ink darkness (0 for paper, 255 for the darkest ink), cropped to the inked area.
+    Levels are taken relative to the paper (the median level) and the darkest ink, so
+    exposure changes cancel out, and cropping to the ink removes framing and borders.
+    """
+    gray = image.convert("L")
+    histogram = gray.histogram()
+    paper = _percentile(histogram, 0.5)
+    ink = _percentile(histogram, 0.001)
+    span = max(paper - ink, 1)
+    darkness = gray.point([min(255, max(0, (paper - level) * 255 // span)) for level in range(256)])
+    bbox = darkness.point(lambda v: 255 if v > 128 else 0).getbbox()
+    return darkness.crop(bbox) if bbox else darkness
+
+
+def _dilate(image: Image.Image) -> Image.Image:
+    """Maximum over each cell's 3x3 neighbourhood, as two separable passes over shifted crops."""
+    width, height = image.size
+    padded = ImageOps.expand(image, 1, fill=0)
+    rows = ImageChops.lighter(
+        ImageChops.lighter(padded.crop((0, 0, width, height + 2)), padded.crop((1, 0, width + 1, height + 2))),
+        padded.crop((2, 0, width + 2, height + 2)),
+    )
+    return ImageChops.lighter(
+        ImageChops.lighter(rows.crop((0, 0, width, height)), rows.crop((0, 1, width, height + 1))),
+        rows.crop((0, 2, width, height + 2)),
+    )
+
+
+def _difference(a: tuple[Image.Image, Image.Image], b: Image.Image) -> float:
+    """difference of a (fingerprint, dilated fingerprint) pair and another fingerprint; see ImageHash.difference."""
+    a_ink, a_near = a
+    b_ink = b if b.size == a_ink.size else b.resize(a_ink.size, Image.Resampling.NEAREST)
+    b_near = _dilate(b_ink)
+    differing = ImageChops.lighter(ImageChops.subtract(a_ink, b_near), ImageChops.subtract(b_ink, a_near))
+    return differing.histogram()[255] / (a_ink.width * a_ink.height)
+
+
+@dataclass(frozen=True)
+class ImageHash:
+    # 256-bit difference hash of the ink map, used to find candidates in the index
+    value: int
+    # zlib-compressed 1-bit ink map of size (width, height), used to verify candidates
+    fingerprint: bytes
+    width: int
+    height: int
+
+    def _fingerprint_image(self) -> Image.Image:
+        return Image.frombytes("1", (self.width, self.height), zlib.decompress(self.fingerprint)).convert("L")
+
+    def _fingerprint_maps(self) -> tuple[Image.Image, Image.Image]:
+        image = self._fingerprint_image()
+        return image, _dilate(image)
+
+    def difference(self, other: "ImageHash") -> float:
+        """
+        Fraction of fingerprint cells inked in one image with no ink at or next to the
+        same cell in the other; the one-cell tolerance absorbs small misalignments.
+        """
+        return _difference(self._fingerprint_maps(), other._fingerprint_image())
+
+
+def image_hash(data: Union[bytes, memoryview]) -> ImageHash:
+    """
+    Compute the perceptual hash of an image.
+    The image is reduced to its ink map (see ink_map). Its 16x16 difference hash records,
+    per cell, whether the cell holds clearly more ink than its right neighbour, so
+    re-encoding, rescaling and exposure changes leave the hash nearly unchanged. Slips
+    printed from one template can still share most of their hash, so the ink map is
+    also kept at FINGERPRINT_SIZE pixels to compare candidates at the level of characters.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # Decode JPEGs at reduced size; the fingerprint only needs a few hundred pixels
+        image.draft("L", (DECODE_SIZE, DECODE_SIZE))
+        image = ImageOps.exif_transpose(image)
+        ink = ink_map(image)
+
+    cells = ink.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX).tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        for column in range(HASH_SIZE):
+            offset = row * (HASH_SIZE + 1) + column
+            value = (value << 1) | (cells[offset] > cells[offset + 1] + HASH_MARGIN)
+
+    scale = FINGERPRINT_SIZE / max(ink.size)
+    size = (max(round(ink.width * scale), 1), max(round(ink.height * scale), 1))
+    fingerprint = ink.resize(size, Image.Resampling.BOX).point(lambda v: 255 if v > FINGERPRINT_INK else 0).convert("1")
+    return ImageHash(value, zlib.compress(fingerprint.tobytes()), *size)
+
+
+# Bit positions of each chunk. Hash bit row * 16 + column is the cell at that row and
+# column, so chunk c takes one cell from every row, five columns further per row. Rows
+# of blank paper then no longer make whole chunks zero, which spreads chunk values out.
+CHUNK_POSITIONS = [
+    [row * HASH_SIZE + (row * 5 + chunk) % HASH_SIZE for row in range(HASH_SIZE)]
+    for chunk in range(CHUNKS)
+]
+
+
+def _chunks(value: int) -> list[int]:
+    bits = [(value >> position) & 1 for position in range(HASH_BITS)]
+    chunks = []
+    for positions in CHUNK_POSITIONS:
+        chunk = 0
+        for position in positions:
+            chunk = (chunk << 1) | bits[position]
+        chunks.append(chunk)
+    return chunks
+
+
+@dataclass
+class NearDuplicate:
+    key: str
+    distance: int
+    difference: float
+    reused: bool = False
+
+    def to_dict(self) -> dict:
+        return {"key": self.key, "distance": self.distance, "difference": round(self.difference, 5), "reused": self.reused}
+
+
+# Near-duplicate found for the last image looked up in the current request context
+_last_near_duplicate: ContextVar[Optional[NearDuplicate]] = ContextVar("last_near_duplicate", default=None)
+
+
+def get_last_near_duplicate() -> Optional[NearDuplicate]:
+    """Return the near-duplicate found for the last image extracted in this context, if any."""
+    return _last_near_duplicate.get()
+
+
+def set_last_near_duplicate(match: Optional[NearDuplicate]):
+    _last_near_duplicate.set(match)
+
+
+class PerceptualHashIndex:
+    def __init__(
+        self,
+        threshold: int = DEFAULT_THRESHOLD,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        reuse: bool = False,
+        max_difference: float = DEFAULT_MAX_DIFFERENCE,
+    ):
+        """
+        Index of recently processed images by perceptual hash.
+        Lookups are two-stage. Candidates within threshold bits of the 256-bit hash are
+        found by multi-index hashing: each hash is stored under its sixteen 16-bit
+        chunks (see CHUNK_POSITIONS), and since two hashes within threshold bits differ
+        in at most threshold // 16 bits of some chunk, a lookup only probes chunk values
+        within that distance, comparing at most MAX_SCAN stored hashes. The closest
+        candidates are then verified by comparing fingerprints, and only one differing
+        in at most max_difference of its cells is a near duplicate. Each entry maps a
+        hash to a key, e.g. the extraction cache key of the image. The oldest entries
+        are evicted beyond max_entries; each entry takes about 3.5 KB, most of it the
+        fingerprint. With reuse, callers may answer a near duplicate from the stored
+        key's result instead of flagging it.
+        """
+        if not 0 <= threshold < HASH_BITS:
+            raise ValueError(f"threshold must be between 0 and {HASH_BITS - 1}, got {threshold}")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.reuse = reuse
+        self.max_difference = max_difference
+        self._chunk_radius = threshold // CHUNKS
+        self._probes = self._probe_masks(self._chunk_radius)
+        # Chunk value -> hash values having it, per chunk position
+        self._tables: list[dict[int, list[int]]] = [{} for _ in range(CHUNKS)]
+        self._entries: dict[int, tuple[str, ImageHash]] = {}
+        self._counts: dict[int, int] = {}
+        self._order: deque[int] = deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["PerceptualHashIndex"]:
+        """
+        Build an index from NEAR_DUPLICATE_MODE (off, flag or reuse; default flag),
+        NEAR_DUPLICATE_THRESHOLD, NEAR_DUPLICATE_MAX_DIFFERENCE and
+        NEAR_DUPLICATE_MAX_ENTRIES. Returns None when off.
+        """
+        mode = os.getenv("NEAR_DUPLICATE_MODE", "flag").lower()
+        if mode not in MODES:
+            raise ValueError(f"NEAR_DUPLICATE_MODE must be one of {', '.join(MODES)}, got {mode}")
+        if mode == "off":
+            return None
+        return cls(
+            threshold=int(os.getenv("NEAR_DUPLICATE_THRESHOLD", DEFAULT_THRESHOLD)),
+            max_entries=int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            reuse=mode == "reuse",
+            max_difference=float(os.getenv("NEAR_DUPLICATE_MAX_DIFFERENCE", DEFAULT_MAX_DIFFERENCE)),
+        )
+
+    @staticmethod
+    def _probe_masks(radius: int) -> list[int]:
+        """XOR masks of every 16-bit value with at most radius bits set."""
+        masks = {0}
+        for _ in range(radius):
+            masks |= {mask | (1 << bit) for mask in masks for bit in range(CHUNK_BITS)}
+        return sorted(masks)
+
+    def add(self, imageHash: ImageHash, key: str):
+        value = imageHash.value
+        with self._lock:
+            # Identical hashes share one slot in the tables and map to the latest image and key
+            self._entries[value] = (key, imageHash)
+            self._counts[value] = self._counts.get(value, 0) + 1
+            self._order.append(value)
+            if self._counts[value] == 1:
+                for table, chunk in zip(self._tables, _chunks(value)):
+                    table.setdefault(chunk, []).append(value)
+            while len(self._order) > self.max_entries:
+                self._evict(self._order.popleft())
+
+    def _evict(self, value: int):
+        self._counts[value] -= 1
+        if self._counts[value]:
+            return
+        del self._counts[value]
+        del self._entries[value]
+        for table, chunk in zip(self._tables, _chunks(value)):
+            bucket = table[chunk]
+            bucket.remove(value)
+            if not bucket:
+                del table[chunk]
+
+    def candidates(self, value: int) -> list[tuple[int, int]]:
+        """
+        Stored hash values within threshold bits of value, as (distance, value) pairs,
+        closest first. At most MAX_SCAN stored hashes are compared, from the probed
+        buckets with the rarest chunk values first, so a lookup does bounded work however
+        skewed the chunk values are. A near duplicate shares most of its chunks with the
+        stored image and is found through its rarest one; an older image that only
+        shares common chunk values can be missed.
+        """
+        chunks = _chunks(value)
+        buckets = []
+        with self._lock:
+            probed = sorted(
+                (table[chunk ^ mask] for table, chunk in zip(self._tables, chunks) for mask in self._probes if chunk ^ mask in table),
+                key=len,
+            )
+            # Only the slices are taken under the lock; distances are computed outside it
+            budget = MAX_SCAN
+            for bucket in probed:
+                if budget <= 0:
+                    break
+                buckets.append(bucket[-budget:])
+                budget -= len(buckets[-1])
+        found: dict[int, int] = {}
+        for bucket in buckets:
+            for stored in bucket:
+                if stored not in found:
+                    found[stored] = (stored ^ value).bit_count()
+        return sorted((distance, stored) for stored, distance in found.items() if distance <= self.threshold)
+
+    def find(self, imageHash: ImageHash, accept: Optional[Callable[[str], bool]] = None) -> Optional[NearDuplicate]:
+        """
+        Return the closest stored image that passes verification, or None.
+        Up to MAX_CANDIDATES candidates are verified, closest hash first. With accept,
+        only stored images whose key it accepts are considered.
+        """
+        maps = None
+        verified = 0
+        for distance, stored in self.candidates(imageHash.value):
+            if verified == MAX_CANDIDATES:
+                break
+            with self._lock:
+                entry = self._entries.get(stored)
+            if entry is None or (accept is not None and not accept(entry[0])):
+                continue
+            verified += 1
+            key, storedHash = entry
+            maps = maps or imageHash._fingerprint_maps()
+            difference = _difference(maps, storedHash._fingerprint_image())
+            if difference <= self.max_difference:
+                return NearDuplicate(key, distance, difference)
+        return None
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self),
+            "threshold": self.threshold,
+            "max_difference": self.max_difference,
+            "reuse": self.reuse,
+        }
@@ -0,0 +1,135 @@
+import asyncio
+import importlib
+import logging
+import os
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+DEFAULT_ENABLED_PROVIDERS = "google"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ProviderSpec:
+    module: str
+    class_name: str
+    api_key_env: str
+
+
+# Extractor modules import their SDKs at module level, so nothing here imports them eagerly
+PROVIDERS = {
+    "google": ProviderSpec("google_text_extractor", "GoogleVisionTextExtractor", "GEMINI_API_KEY"),
+    "claude": ProviderSpec("claude_text_extractor", "TextExtractor", "ANTHROPIC_API_KEY"),
+    "openai": ProviderSpec("openai_text_extractor", "OpenAIVisionTextExtractor", "OPENAI_API_KEY"),
+}
+
+
+class ProviderNotEnabledError(KeyError):
+    pass
+
+
+class ProviderRegistry(Mapping):
+    def __init__(self, enabled: list[str], wrap: Optional[Callable[[object], object]] = None):
+        """
+        Registry of the enabled vision providers, keyed by provider name.
+        A provider's extractor module (and with it the SDK) is imported and its client
+        built on first lookup, or when warm is called, so startup only pays for what is
+        used. wrap, if given, is applied to each extractor once built, e.g. to add the
+        extraction cache. Being a mapping, the registry can stand in for a dict of
+        extractors; iterating it lists provider names without loading anything.
+        """
+        unknown = [name for name in enabled if name not in PROVIDERS]
+        if unknown:
+            raise ValueError(f"Unknown providers: {', '.join(unknown)}. Known providers: {', '.join(PROVIDERS)}")
+        if not enabled:
+            raise ValueError("At least one provider must be enabled.")
+        self.enabled = list(dict.fromkeys(enabled))
+        self.wrap = wrap
+        self._extractors: dict[str, object] = {}
+        self._load_seconds: dict[str, float] = {}
+        self._errors: dict[str, str] = {}
+        self._locks = {name: threading.Lock() for name in self.enabled}
+
+    @classmethod
+    def from_env(cls, wrap: Optional[Callable[[object], object]] = None) -> "ProviderRegistry":
+        """Build a registry of the comma-separated providers in ENABLED_PROVIDERS (default google)."""
+        enabled = os.getenv("ENABLED_PROVIDERS", DEFAULT_ENABLED_PROVIDERS)
+        return cls([name.strip().lower() for name in enabled.split(",") if name.strip()], wrap)
+
+    def __getitem__(self, name: str):
+        extractor = self._extractors.get(name)
+        if extractor is not None:
+            return extractor
+        if name not in self._locks:
+            raise ProviderNotEnabledError(name)
+        with self._locks[name]:
+            if name not in self._extractors:
+                self._extractors[name] = self._load(name)
+            return self._extractors[name]
+
+    async def get_async(self, name: str):
+        """
+        Like registry[name], but a provider that is not loaded yet is imported and built
+        in a worker thread, so a slow SDK import does not hold up the event loop.
+        """
+        extractor = self._extractors.get(name)
+        if extractor is not None:
+            return extractor
+        return await asyncio.to_thread(self.__getitem__, name)
+
+    def __contains__(self, name: object) -> bool:
+        # Membership must not load the provider, which Mapping's default would
+        return name in self._locks
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.enabled)
+
+    def __len__(self) -> int:
+        return len(self.enabled)
+
+    def _load(self, name: str):
+        spec = PROVIDERS[name]
+        started = time.perf_counter()
+        try:
+            extractor_class = getattr(importlib.import_module(spec.module), spec.class_name)
+            extractor = extractor_class(api_key=os.getenv(spec.api_key_env))
+        except Exception as e:
+            self._errors[name] = str(e)
+            raise
+        self._errors.pop(name, None)
+        self._load_seconds[name] = time.perf_counter() - started
+        logger.info("Provider loaded", extra={"provider": name, "seconds": round(self._load_seconds[name], 3)})
+        return self.wrap(extractor) if self.wrap else extractor
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._extractors
+
+    async def warm(self, names: Optional[list[str]] = None):
+        """
+        Load providers in a worker thread so the event loop keeps serving meanwhile.
+        Failures are logged and reported by status rather than raised.
+        """
+        for name in names or self.enabled:
+            try:
+                await asyncio.to_thread(self.__getitem__, name)
+            except Exception:
+                logger.exception("Provider failed to load", extra={"provider": name})
+
+    @property
+    def ready(self) -> bool:
+        """True once at least one enabled provider is loaded and can take requests."""
+        return bool(self._extractors)
+
+    def status(self) -> dict:
+        return {
+            name: {
+                "loaded": self.is_loaded(name),
+                "load_seconds": round(self._load_seconds[name], 3) if name in self._load_seconds else None,
+                "error": self._errors.get(name),
+            }
+            for name in self.enabled
+        }
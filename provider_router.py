@@ -0,0 +1,250 @@
+import asyncio
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+from base_text_extractor import ExtractorInput, PageImage, read_input_async
+from extraction_cache import get_last_served_from_cache, set_last_served_from_cache
+
+DEFAULT_WINDOW = 100
+DEFAULT_MIN_SAMPLES = 5
+DEFAULT_MAX_ERROR_RATE = 0.5
+DEFAULT_COOLDOWN_SECONDS = 30.0
+# Consecutive failures that take a provider out of rotation for the cooldown period
+FAILURES_BEFORE_COOLDOWN = 3
+
+
+class NoProviderAvailableError(RuntimeError):
+    pass
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+class ProviderStats:
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        """Rolling latency and error statistics over the last window calls to a provider."""
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def record(self, latency: float, ok: bool, cooldown_seconds: float = DEFAULT_COOLDOWN_SECONDS):
+        self._outcomes.append(ok)
+        if ok:
+            self._latencies.append(latency)
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= FAILURES_BEFORE_COOLDOWN:
+                self.cooldown_until = time.monotonic() + cooldown_seconds
+
+    def record_cancelled(self, elapsed: float):
+        """Record a request abandoned after elapsed seconds as a lower bound on its latency."""
+        self._latencies.append(elapsed)
+
+    @property
+    def samples(self) -> int:
+        return len(self._outcomes)
+
+    def p50(self) -> Optional[float]:
+        return _percentile(sorted(self._latencies), 0.5) if self._latencies else None
+
+    def p95(self) -> Optional[float]:
+        return _percentile(sorted(self._latencies), 0.95) if self._latencies else None
+
+    def error_rate(self) -> float:
+        return 1.0 - sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "samples": self.samples,
+            "p50_seconds": self.p50(),
+            "p95_seconds": self.p95(),
+            "error_rate": self.error_rate(),
+            "consecutive_failures": self.consecutive_failures,
+            "cooling_down": time.monotonic() < self.cooldown_until,
+        }
+
+
+@dataclass
+class RoutedResult:
+    text: str
+    provider: str
+    hedged: bool
+    attempts: list[str]
+
+
+class ProviderRouter:
+    provider = "auto"
+
+    def __init__(
+        self,
+        extractors: dict,
+        hedge: bool = True,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        max_error_rate: float = DEFAULT_MAX_ERROR_RATE,
+        cooldown_seconds: float = DEFAULT_COOLDOWN_SECONDS,
+        window: int = DEFAULT_WINDOW,
+    ):
+        """
+        Initialize a router over several text extractors, keyed by provider name.
+        Each call goes to the healthy provider with the lowest rolling p50 latency;
+        providers without samples are tried first so every provider gets measured.
+        A provider is unhealthy once its error rate over at least min_samples calls
+        exceeds max_error_rate, or for cooldown_seconds after repeated consecutive
+        failures; unhealthy providers are only used when nothing else is left.
+        With hedge enabled, a second provider is started when the first has not
+        answered within its own p95, and the first answer wins. Failed calls fail over
+        to the next provider in order; a provider that cannot be loaded, e.g. for a
+        missing API key, counts as a failed call. Answers a CachedTextExtractor serves
+        without calling its provider are not counted.
+        """
+        if not extractors:
+            raise ValueError("At least one extractor is required.")
+        self.extractors = extractors
+        self.hedge = hedge
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.cooldown_seconds = cooldown_seconds
+        self.stats = {name: ProviderStats(window) for name in extractors}
+
+    @classmethod
+    def from_env(cls, extractors: dict) -> "ProviderRouter":
+        """Build a router from ROUTER_HEDGE, ROUTER_MAX_ERROR_RATE and ROUTER_COOLDOWN_SECONDS."""
+        return cls(
+            extractors,
+            hedge=os.getenv("ROUTER_HEDGE", "true").lower() in ("1", "true", "yes"),
+            max_error_rate=float(os.getenv("ROUTER_MAX_ERROR_RATE", DEFAULT_MAX_ERROR_RATE)),
+            cooldown_seconds=float(os.getenv("ROUTER_COOLDOWN_SECONDS", DEFAULT_COOLDOWN_SECONDS)),
+        )
+
+    def is_healthy(self, name: str) -> bool:
+        stats = self.stats[name]
+        if time.monotonic() < stats.cooldown_until:
+            return False
+        return stats.samples < self.min_samples or stats.error_rate() <= self.max_error_rate
+
+    def ranked(self) -> list[str]:
+        """
+        Return provider names in the order they should be tried: untried providers
+        first, then by p50 latency, then providers that were tried but never succeeded.
+        """
+        def latency(name: str) -> tuple[int, float]:
+            stats = self.stats[name]
+            p50 = stats.p50()
+            if p50 is None:
+                return (0 if stats.samples == 0 else 2, 0.0)
+            return (1, p50)
+
+        healthy = sorted((name for name in self.extractors if self.is_healthy(name)), key=latency)
+        unhealthy = sorted((name for name in self.extractors if not self.is_healthy(name)), key=latency)
+        return healthy + unhealthy
+
+    async def route(self, data: ExtractorInput, mime_type: Optional[str] = None) -> RoutedResult:
+        """
+        Extract text with the best available provider.
+
+        Args:
+            data (bytes | memoryview | str): File contents, or a path to the file
+            mime_type (Optional[str]): MIME type of the contents; inferred from the extension for paths
+
+        Returns:
+            RoutedResult: Extracted text, the provider that produced it, whether a hedged
+                request was sent, and every provider that was tried
+        """
+        data, mime_type = await read_input_async(data, mime_type)
+        return await self._route(lambda extractor: extractor.extract_text_async(data, mime_type=mime_type))
+
+    async def _extractor(self, name: str):
+        """
+        Return the extractor for name. A registry that has not loaded it yet imports the
+        SDK and builds the client on lookup, so that runs in a worker thread; a lookup
+        that fails, e.g. for a missing API key, fails this call like a provider error.
+        """
+        get_async = getattr(self.extractors, "get_async", None)
+        if get_async is not None:
+            return await get_async(name)
+        return self.extractors[name]
+
+    async def _call(self, name: str, call: Callable[[object], Awaitable]) -> tuple[object, bool]:
+        """Run call against the named extractor; also return whether the cache answered it."""
+        # Extractors without a cache never set the flag, so clear what the caller's context holds
+        set_last_served_from_cache(False)
+        result = await call(await self._extractor(name))
+        # Runs in the call's own task, so this reads the flag that call set
+        return result, get_last_served_from_cache()
+
+    async def _route(self, call: Callable[[object], Awaitable], hedge: bool = True) -> RoutedResult:
+        """Run call against extractors in ranked order, with failover and, if hedge, hedging."""
+        remaining = self.ranked()
+        attempts: list[str] = []
+        errors: dict[str, str] = {}
+        pending: dict[asyncio.Task, tuple[str, float]] = {}
+        hedged = False
+
+        def launch():
+            name = remaining.pop(0)
+            attempts.append(name)
+            task = asyncio.ensure_future(self._call(name, call))
+            pending[task] = (name, time.perf_counter())
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if hedge and self.hedge and not hedged and remaining and len(pending) == 1:
+                    (name, started), = pending.values()
+                    p95 = self.stats[name].p95()
+                    if p95 is not None:
+                        timeout = max(started + p95 - time.perf_counter(), 0.0)
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    launch()
+                    continue
+
+                for task in done:
+                    name, started = pending.pop(task)
+                    elapsed = time.perf_counter() - started
+                    try:
+                        text, cached = task.result()
+                    except Exception as e:
+                        self.stats[name].record(elapsed, ok=False, cooldown_seconds=self.cooldown_seconds)
+                        errors[name] = str(e)
+                        if not pending and remaining:
+                            launch()
+                        continue
+                    # A cache hit says nothing about the provider's latency or health
+                    if not cached:
+                        self.stats[name].record(elapsed, ok=True)
+                    return RoutedResult(text, name, hedged, attempts)
+
+            raise NoProviderAvailableError(
+                "All providers failed: " + "; ".join(f"{name}: {error}" for name, error in errors.items())
+            )
+        finally:
+            for task, (name, started) in pending.items():
+                task.cancel()
+                # The losing request took at least this long; count it so a slow provider's p50 rises
+                self.stats[name].record_cancelled(time.perf_counter() - started)
+
+    async def extract_text_async(self, data: ExtractorInput, mime_type: Optional[str] = None) -> str:
+        """Extract text with the best available provider; see route."""
+        return (await self.route(data, mime_type)).text
+
+    async def extract_pages_async(self, pages: list[PageImage]) -> list[str]:
+        """
+        Extract the page images of one document with the best available provider.
+        Multi-page calls take longer than the single-image p95, so they fail over but are not hedged.
+        """
+        return (await self._route(lambda extractor: extractor.extract_pages_async(pages), hedge=False)).text
+
+    def provider_stats(self) -> dict:
+        return {
+            name: {**self.stats[name].to_dict(), "healthy": self.is_healthy(name)}
+            for name in self.extractors
+        }
@@ -0,0 +1,248 @@
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+from purchase_orders import PurchaseOrder
+
+# Characters OCR commonly confuses are folded onto a single canonical form
+_CONFUSABLES = str.maketrans({
+    "O": "0",
+    "Q": "0",
+    "I": "1",
+    "L": "1",
+    "S": "5",
+    "B": "8",
+    "Z": "2",
+})
+_NON_ALNUM = re.compile(r"[^A-Z0-9]")
+
+DEFAULT_MAX_DISTANCE = 1
+# Distinct orders collected before a value tying with several orders is settled as ambiguous
+MAX_TIED_CANDIDATES = 5
+
+
+def normalize_order_key(value: str) -> str:
+    """
+    Normalize a purchase-order or tracking number for matching.
+    Drops punctuation such as '#', '-' and '_', uppercases, and folds OCR-confusable
+    characters, so "#ORDER_571", "ORDER-571" and "0RDER571" share one key.
+    """
+    return _NON_ALNUM.sub("", value.upper()).translate(_CONFUSABLES)
+
+
+def levenshtein(a: str, b: str, max_distance: Optional[int] = None) -> int:
+    """Return the edit distance between a and b, stopping early past max_distance."""
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is not None and len(a) - len(b) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Return the edit distance between a and b, or max_distance + 1 if it is larger.
+    The usual max_distance of 1 is decided in linear time by comparing what follows
+    the first differing character; larger ones fall back to levenshtein.
+    """
+    if max_distance != 1:
+        return levenshtein(a, b, max_distance)
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if len(a) - len(b) > 1:
+        return 2
+    index = 0
+    while index < len(b) and a[index] == b[index]:
+        index += 1
+    # One substitution, or one extra character in a, at the first difference
+    rest = b[index + 1:] if len(a) == len(b) else b[index:]
+    return 1 if a[index + 1:] == rest else 2
+
+
+def _deletes(key: str, max_distance: int) -> set[str]:
+    """Return key together with every string reachable by up to max_distance deletions."""
+    variants = {key}
+    frontier = {key}
+    for _ in range(max_distance):
+        frontier = {v[:i] + v[i + 1:] for v in frontier for i in range(len(v))}
+        variants |= frontier
+    return variants
+
+
+def query_variants(key: str, max_distance: int) -> list[str]:
+    """The deletion variants of key (see _deletes) in a fixed order, longest first, so lookups visit candidates in the same order in every process."""
+    return sorted(_deletes(key, max_distance), key=lambda variant: (-len(variant), variant))
+
+
+@dataclass
+class PurchaseOrderMatch:
+    purchaseOrder: PurchaseOrder
+    field: str
+    value: str
+    distance: int
+    score: float
+
+    def to_dict(self) -> dict:
+        return {
+            "purchaseOrderNumber": self.purchaseOrder.purchaseOrderNumber,
+            "field": self.field,
+            "value": self.value,
+            "distance": self.distance,
+            "score": self.score,
+        }
+
+
+def match_sort_key(match: PurchaseOrderMatch) -> tuple:
+    """Order matches by distance, purchase order numbers before tracking numbers, then by value, so ties sort the same in every process."""
+    return (match.distance, match.field != "purchaseOrderNumber", match.value, match.purchaseOrder.purchaseOrderNumber)
+
+
+def resolve_best_match(matches: list[PurchaseOrderMatch]) -> tuple[Optional[PurchaseOrderMatch], list[PurchaseOrderMatch]]:
+    """
+    Pick the best of matches sorted by match_sort_key.
+    Returns (match, []) when one order is closest, and (None, candidates) when several
+    distinct orders tie at the closest distance, e.g. "#ORDER_579" against #ORDER_571
+    to #ORDER_575, so that no arbitrary order is reported as the match.
+    """
+    if not matches:
+        return None, []
+    best_distance = matches[0].distance
+    tied = [match for match in matches if match.distance == best_distance]
+    if len({match.purchaseOrder.purchaseOrderNumber for match in tied}) > 1:
+        return None, tied
+    return matches[0], []
+
+
+def resolve_candidates(candidates: Iterator[tuple[int, list[PurchaseOrderMatch]]]) -> tuple[Optional[PurchaseOrderMatch], list[PurchaseOrderMatch]]:
+    """
+    Resolve the best match from (distance, matches) batches whose exact hits, if any,
+    come first, stopping as soon as the outcome is settled: after an exact hit, or once
+    MAX_TIED_CANDIDATES distinct orders are one edit away and nothing closer exists.
+    """
+    matches: list[PurchaseOrderMatch] = []
+    closest: set[str] = set()
+    for distance, found in candidates:
+        matches.extend(found)
+        if distance == 0:
+            break
+        if distance == 1:
+            closest.update(match.purchaseOrder.purchaseOrderNumber for match in found)
+            if len(closest) >= MAX_TIED_CANDIDATES:
+                break
+    matches.sort(key=match_sort_key)
+    return resolve_best_match(matches)
+
+
+class PurchaseOrderMatcher:
+    def __init__(self, purchaseOrders: Iterable[PurchaseOrder] = (), max_distance: int = DEFAULT_MAX_DISTANCE):
+        """
+        Initialize a fuzzy index over purchase-order and tracking numbers.
+        Keys are normalized with normalize_order_key, then indexed with every variant
+        reachable by up to max_distance deletions (symmetric-delete lookup), stored by
+        hash to keep the index compact. A query that is a known key is answered by one
+        dictionary lookup; otherwise it generates its own deletion variants and checks
+        the keys they lead to, so match time does not grow with the number of orders.
+        """
+        self.max_distance = max_distance
+        self._keys: dict[str, list[tuple[str, str, PurchaseOrder]]] = {}
+        # Hash of a deletion variant -> key, or list of keys, having it; hash collisions only add candidates
+        self._variants: dict[int, object] = {}
+        for purchaseOrder in purchaseOrders:
+            self.add(purchaseOrder)
+
+    def add(self, purchaseOrder: PurchaseOrder):
+        self._add_key("purchaseOrderNumber", purchaseOrder.purchaseOrderNumber, purchaseOrder)
+        if purchaseOrder.trackingNumber:
+            self._add_key("trackingNumber", purchaseOrder.trackingNumber, purchaseOrder)
+
+    def _add_key(self, field: str, value: str, purchaseOrder: PurchaseOrder):
+        key = normalize_order_key(value)
+        if not key:
+            return
+        entries = self._keys.get(key)
+        if entries is not None:
+            entries.append((field, value, purchaseOrder))
+            return
+        self._keys[key] = [(field, value, purchaseOrder)]
+        # The key itself is found through _keys
+        for variant in _deletes(key, self.max_distance) - {key}:
+            # Most variants map to a single key; only collisions pay for a list
+            variant_hash = hash(variant)
+            existing = self._variants.get(variant_hash)
+            if existing is None:
+                self._variants[variant_hash] = key
+            elif isinstance(existing, list):
+                existing.append(key)
+            else:
+                self._variants[variant_hash] = [existing, key]
+
+    def _key_matches(self, query: str, key: str, distance: int) -> list[PurchaseOrderMatch]:
+        score = 1.0 - distance / max(len(query), len(key))
+        return [
+            PurchaseOrderMatch(purchaseOrder, field, original, distance, score)
+            for field, original, purchaseOrder in self._keys[key]
+        ]
+
+    def _candidates(self, query: str) -> Iterator[tuple[int, list[PurchaseOrderMatch]]]:
+        """Yield (distance, matches) per key within max_distance of query, the exact key first."""
+        if query in self._keys:
+            yield 0, self._key_matches(query, query, 0)
+        seen = {query}
+        for variant in query_variants(query, self.max_distance):
+            found = self._variants.get(hash(variant), ())
+            keys = found if isinstance(found, list) else [found] if found else []
+            if variant != query and variant in self._keys:
+                keys = [variant, *keys]
+            for key in keys:
+                if key in seen:
+                    continue
+                seen.add(key)
+                distance = edit_distance(query, key, self.max_distance)
+                if distance <= self.max_distance:
+                    yield distance, self._key_matches(query, key, distance)
+
+    def match(self, value: str, limit: Optional[int] = 5) -> list[PurchaseOrderMatch]:
+        """
+        Find the purchase orders whose number or tracking number is closest to value.
+
+        Args:
+            value (str): Purchase-order or tracking number as read by OCR
+            limit (Optional[int]): Maximum number of candidates to return; None for all
+
+        Returns:
+            list[PurchaseOrderMatch]: Candidates ordered by match_sort_key
+        """
+        query = normalize_order_key(value)
+        if not query:
+            return []
+        matches = [match for _, found in self._candidates(query) for match in found]
+        matches.sort(key=match_sort_key)
+        return matches[:limit]
+
+    def resolve(self, value: str) -> tuple[Optional[PurchaseOrderMatch], list[PurchaseOrderMatch]]:
+        """
+        Return the unambiguous best match for value, or the tied candidates; see
+        resolve_best_match. Stops early as described in resolve_candidates, so at least
+        MAX_TIED_CANDIDATES, but not necessarily all, tied orders are returned.
+        """
+        query = normalize_order_key(value)
+        if not query:
+            return None, []
+        return resolve_candidates(self._candidates(query))
+
+    def best_match(self, value: str) -> Optional[PurchaseOrderMatch]:
+        """Return the closest match, or None when there is none or several orders tie for it."""
+        return self.resolve(value)[0]
@@ -1,6 +1,8 @@
+import os
 import re
-from typing import Optional
-from pydantic import BaseModel, ConfigDict
+import sqlite3
+from typing import Iterable, Iterator, Optional
+from pydantic import BaseModel, ConfigDict, TypeAdapter, ValidationError
 
 class Item(BaseModel):
     itemId: Optional[str] = None
@@ -34,98 +36,289 @@ class PurchaseOrder(BaseModel):
     def from_json(cls, json_str: str) -> 'PurchaseOrder':
         return cls.model_validate_json(json_str)
 
-def parse_purchase_order(text: str) -> PurchaseOrder:
-    # Extract purchase order number from text
-    purchase_order_number_match = re.search(r'\"purchaseOrderNumber\": \"([A-Za-z0-9-]+)\"', text)
+_CODE_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_PYTHON_LITERAL = re.compile(r"([:\[,]\s*)(None|True|False)\b")
+_PYTHON_LITERALS = {"None": "null", "True": "true", "False": "false"}
+_PURCHASE_ORDER_NUMBER = re.compile(r'"purchaseOrderNumber"\s*:\s*"([^"]+)"')
+
+
+def _simplify_schema(node: dict, defs: dict, openapi: bool) -> dict:
+    if "$ref" in node:
+        node = defs[node["$ref"].split("/")[-1]]
+    if "anyOf" in node:
+        variants = [variant for variant in node["anyOf"] if variant.get("type") != "null"]
+        simplified = _simplify_schema(variants[0], defs, openapi)
+        if len(variants) < len(node["anyOf"]):
+            if openapi:
+                simplified["nullable"] = True
+            else:
+                simplified["type"] = [simplified["type"], "null"]
+        return simplified
+
+    simplified = {key: value for key, value in node.items() if key not in ("default", "title", "$defs")}
+    if "properties" in simplified:
+        simplified["properties"] = {
+            name: _simplify_schema(prop, defs, openapi) for name, prop in simplified["properties"].items()
+        }
+    if "items" in simplified:
+        simplified["items"] = _simplify_schema(simplified["items"], defs, openapi)
+    return simplified
+
+
+def purchase_order_schema(openapi: bool = False) -> dict:
+    """
+    Build the response schema providers are asked to follow, from the PurchaseOrder model.
+    References are inlined and defaults and titles dropped, since not every provider
+    accepts them. With openapi=True optional fields are marked nullable (the OpenAPI
+    subset Gemini accepts) instead of being unioned with null.
+    """
+    schema = PurchaseOrder.model_json_schema()
+    return _simplify_schema(schema, schema.get("$defs", {}), openapi)
+
+
+def purchase_order_pages_schema(openapi: bool = False) -> dict:
+    """Response schema for several pages in one call: a purchase order per page, tagged with its page number."""
+    page = purchase_order_schema(openapi)
+    page["properties"] = {"page": {"type": "integer"}, **page["properties"]}
+    page["required"] = ["page", *page["required"]]
+    return {
+        "type": "object",
+        "properties": {"pages": {"type": "array", "items": page}},
+        "required": ["pages"],
+    }
+
+
+def _repair_json(text: str) -> Optional[str]:
+    """Pull the JSON object out of model output and fix common near-JSON mistakes."""
+    fenced = _CODE_FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    text = text[start:end + 1]
+    text = _TRAILING_COMMA.sub(r"\1", text)
+    text = _PYTHON_LITERAL.sub(lambda m: m.group(1) + _PYTHON_LITERALS[m.group(2)], text)
+    if '"' not in text:
+        text = text.replace("'", '"')
+    return text
+
+
+def validate_purchase_order(text: str) -> Optional[PurchaseOrder]:
+    """
+    Validate model output as a complete purchase order record.
+    Schema-constrained output is validated in a single pass. Otherwise the JSON is cut
+    out of code fences or surrounding prose, repaired (trailing commas, Python literals,
+    single quotes) and validated again. Returns None if it still does not validate.
+    """
+    try:
+        return PurchaseOrder.model_validate_json(text)
+    except ValidationError:
+        pass
+
+    repaired = _repair_json(text)
+    if repaired is not None:
+        try:
+            return PurchaseOrder.model_validate_json(repaired)
+        except ValidationError:
+            pass
+    return None
+
+
+def parse_purchase_order(text: str) -> Optional[PurchaseOrder]:
+    """
+    Parse a purchase order from model output with validate_purchase_order. If the
+    record does not validate, only the purchase order number is recovered.
+    """
+    purchaseOrder = validate_purchase_order(text)
+    if purchaseOrder is not None:
+        return purchaseOrder
+
+    purchase_order_number_match = _PURCHASE_ORDER_NUMBER.search(text)
     if purchase_order_number_match:
         return PurchaseOrder(purchaseOrderNumber=purchase_order_number_match.group(1), items=[])
-    else:
+    return None
+
+
+def merge_purchase_orders(purchaseOrders: list[Optional[PurchaseOrder]]) -> Optional[PurchaseOrder]:
+    """
+    Combine the purchase orders read from the pages of one document.
+    Each field takes its first value across the pages, and the items of all pages are concatenated.
+    """
+    purchaseOrders = [purchaseOrder for purchaseOrder in purchaseOrders if purchaseOrder is not None]
+    if not purchaseOrders:
         return None
+    merged = {}
+    for purchaseOrder in purchaseOrders:
+        for name, value in purchaseOrder:
+            if name != "items" and value and name not in merged:
+                merged[name] = value
+    merged["items"] = [item for purchaseOrder in purchaseOrders for item in purchaseOrder.items]
+    return PurchaseOrder.model_validate(merged)
+
+
+def default_purchase_orders() -> list[PurchaseOrder]:
+    return [
+        PurchaseOrder(
+            trackingNumber="LZ92738101",
+            date="March 19th, 2025",
+            customerName="John Smith",
+            customerAddress="605 Random Lake Rd, 53075\nRandom Lake, WI, United States",
+            purchaseOrderNumber="#ORDER_571",
+            items=[
+                Item(itemName="Item 1", itemQuantity=1, itemPrice=100),
+                Item(itemName="Item 2", itemQuantity=2, itemPrice=200),
+                Item(itemName="Item 3", itemQuantity=3, itemPrice=300),
+            ]
+        ),
+        PurchaseOrder(
+            trackingNumber="LZ92738102",
+            date="March 20th, 2025",
+            customerName="Jane Doe",
+            customerAddress="123 Main St, Anytown, USA",
+            purchaseOrderNumber="#ORDER_572",
+            items=[
+                Item(itemName="Item 4", itemQuantity=4, itemPrice=400),
+                Item(itemName="Item 5", itemQuantity=5, itemPrice=500),
+                Item(itemName="Item 6", itemQuantity=6, itemPrice=600),
+            ]
+        ),
+        PurchaseOrder(
+            trackingNumber="LZ92738103",
+            date="March 21st, 2025",
+            customerName="Jim Beam",
+            customerAddress="456 Maple Ave, Anytown, USA",
+            purchaseOrderNumber="#ORDER_573",
+            items=[
+                Item(itemName="Item 7", itemQuantity=7, itemPrice=700),
+                Item(itemName="Item 8", itemQuantity=8, itemPrice=800),
+                Item(itemName="Item 9", itemQuantity=9, itemPrice=900),
+            ]
+        ),
+        PurchaseOrder(
+            trackingNumber="LZ92738104",
+            date="March 22nd, 2025",
+            customerName="John Doe",
+            customerAddress="789 Oak St, Anytown, USA",
+            purchaseOrderNumber="#ORDER_574",
+            items=[
+                Item(itemName="Item 10", itemQuantity=10, itemPrice=1000),
+                Item(itemName="Item 11", itemQuantity=11, itemPrice=1100),
+                Item(itemName="Item 12", itemQuantity=12, itemPrice=1200),
+            ]
+        ),
+        PurchaseOrder(
+            trackingNumber="LZ92738105",
+            date="March 23rd, 2025",
+            customerName="Jane Smith",
+            customerAddress="321 Pine St, Anytown, USA",
+            purchaseOrderNumber="#ORDER_575",
+            items=[
+                Item(itemName="Item 13", itemQuantity=13, itemPrice=1300),
+                Item(itemName="Item 14", itemQuantity=14, itemPrice=1400),
+                Item(itemName="Item 15", itemQuantity=15, itemPrice=1500),
+            ]
+        ),
+        PurchaseOrder(
+            trackingNumber="75882988764",
+            date="March 17th, 2025",
+            customerName="Naveen Acharya",
+            customerAddress="789 Oak St, Anytown, USA",
+            purchaseOrderNumber="W1506150551",
+            items=[
+                Item(itemName="Item 16", itemQuantity=16, itemPrice=1600)
+            ]
+        )
+    ]
+
+
+def read_purchase_orders(path: str) -> Iterator[PurchaseOrder]:
+    """
+    Read purchase orders from a file, one at a time where the format allows.
+
+    Args:
+        path (str): A .json file holding a list of orders, a .jsonl file with one
+            order per line, or a SQLite database (.db, .sqlite, .sqlite3) with a
+            purchase_orders table whose data column holds each order as JSON
+
+    Returns:
+        Iterator[PurchaseOrder]: The orders in file order
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        with open(path, 'rb') as f:
+            yield from _purchase_order_list_adapter.validate_json(f.read())
+    elif extension == '.jsonl':
+        with open(path, 'rb') as f:
+            yield from (PurchaseOrder.model_validate_json(line) for line in f if line.strip())
+    elif extension in ['.db', '.sqlite', '.sqlite3']:
+        connection = sqlite3.connect(path)
+        try:
+            for row in connection.execute("SELECT data FROM purchase_orders"):
+                yield PurchaseOrder.model_validate_json(row[0])
+        finally:
+            connection.close()
+    else:
+        raise ValueError(f"Unsupported purchase order file type: {extension}")
+
 
 class PurchaseOrderList:
-    def __init__(self):
-        self.purchaseOrders = [
-            PurchaseOrder(
-                trackingNumber="LZ92738101",
-                date="March 19th, 2025",
-                customerName="John Smith",
-                customerAddress="605 Random Lake Rd, 53075\nRandom Lake, WI, United States",
-                purchaseOrderNumber="#ORDER_571",
-                items=[
-                    Item(itemName="Item 1", itemQuantity=1, itemPrice=100),
-                    Item(itemName="Item 2", itemQuantity=2, itemPrice=200),
-                    Item(itemName="Item 3", itemQuantity=3, itemPrice=300),
-                ]
-            ),
-            PurchaseOrder(
-                trackingNumber="LZ92738102",
-                date="March 20th, 2025",
-                customerName="Jane Doe",
-                customerAddress="123 Main St, Anytown, USA",
-                purchaseOrderNumber="#ORDER_572",
-                items=[
-                    Item(itemName="Item 4", itemQuantity=4, itemPrice=400),
-                    Item(itemName="Item 5", itemQuantity=5, itemPrice=500),
-                    Item(itemName="Item 6", itemQuantity=6, itemPrice=600),
-                ]
-            ),
-            PurchaseOrder(
-                trackingNumber="LZ92738103",
-                date="March 21st, 2025",
-                customerName="Jim Beam",
-                customerAddress="456 Maple Ave, Anytown, USA",
-                purchaseOrderNumber="#ORDER_573",
-                items=[
-                    Item(itemName="Item 7", itemQuantity=7, itemPrice=700),
-                    Item(itemName="Item 8", itemQuantity=8, itemPrice=800),
-                    Item(itemName="Item 9", itemQuantity=9, itemPrice=900),
-                ]
-            ),
-            PurchaseOrder(
-                trackingNumber="LZ92738104",
-                date="March 22nd, 2025",
-                customerName="John Doe",
-                customerAddress="789 Oak St, Anytown, USA",
-                purchaseOrderNumber="#ORDER_574",
-                items=[
-                    Item(itemName="Item 10", itemQuantity=10, itemPrice=1000),
-                    Item(itemName="Item 11", itemQuantity=11, itemPrice=1100),
-                    Item(itemName="Item 12", itemQuantity=12, itemPrice=1200),
-                ]
-            ),
-            PurchaseOrder(
-                trackingNumber="LZ92738105",
-                date="March 23rd, 2025",
-                customerName="Jane Smith",
-                customerAddress="321 Pine St, Anytown, USA",
-                purchaseOrderNumber="#ORDER_575",
-                items=[
-                    Item(itemName="Item 13", itemQuantity=13, itemPrice=1300),
-                    Item(itemName="Item 14", itemQuantity=14, itemPrice=1400),
-                    Item(itemName="Item 15", itemQuantity=15, itemPrice=1500),
-                ]
-            ),
-            PurchaseOrder(
-                trackingNumber="75882988764",
-                date="March 17th, 2025",
-                customerName="Naveen Acharya",
-                customerAddress="789 Oak St, Anytown, USA",
-                purchaseOrderNumber="W1506150551",
-                items=[
-                    Item(itemName="Item 16", itemQuantity=16, itemPrice=1600)
-                ]
-            )
-        ]
+    def __init__(self, purchaseOrders: Optional[Iterable[PurchaseOrder]] = None):
+        """
+        Initialize an indexed purchase order store.
+        Orders are indexed by purchaseOrderNumber, trackingNumber and customerName so
+        lookups are dictionary hits. When no orders are given the demo orders are loaded.
+        """
+        self.purchaseOrders: list[PurchaseOrder] = []
+        self._by_number: dict[str, PurchaseOrder] = {}
+        self._by_tracking_number: dict[str, PurchaseOrder] = {}
+        self._by_customer_name: dict[str, list[PurchaseOrder]] = {}
+        self.add_many(default_purchase_orders() if purchaseOrders is None else purchaseOrders)
+
+    @classmethod
+    def load(cls, path: str) -> 'PurchaseOrderList':
+        """
+        Load purchase orders from a file once, e.g. at startup.
+
+        Args:
+            path (str): A file in one of the formats read_purchase_orders accepts
+
+        Returns:
+            PurchaseOrderList: Store holding every order in the file
+        """
+        return cls(read_purchase_orders(path))
 
     def add(self, purchaseOrder: PurchaseOrder):
         self.purchaseOrders.append(purchaseOrder)
+        self._index(purchaseOrder)
 
-    def get_purchase_order(self, purchaseOrderNumber: str):
-        print(purchaseOrderNumber)
-        for purchaseOrder in self.purchaseOrders:
-            if purchaseOrder.purchaseOrderNumber == purchaseOrderNumber:
-                return purchaseOrder
-        return None
+    def add_many(self, purchaseOrders: Iterable[PurchaseOrder]):
+        for purchaseOrder in purchaseOrders:
+            self.add(purchaseOrder)
+
+    def _index(self, purchaseOrder: PurchaseOrder):
+        self._by_number[purchaseOrder.purchaseOrderNumber] = purchaseOrder
+        if purchaseOrder.trackingNumber:
+            self._by_tracking_number[purchaseOrder.trackingNumber] = purchaseOrder
+        if purchaseOrder.customerName:
+            self._by_customer_name.setdefault(purchaseOrder.customerName, []).append(purchaseOrder)
+
+    def get_purchase_order(self, purchaseOrderNumber: str) -> Optional[PurchaseOrder]:
+        return self._by_number.get(purchaseOrderNumber)
+
+    def get_purchase_order_by_tracking_number(self, trackingNumber: str) -> Optional[PurchaseOrder]:
+        return self._by_tracking_number.get(trackingNumber)
+
+    def get_purchase_orders_by_customer_name(self, customerName: str) -> list[PurchaseOrder]:
+        return self._by_customer_name.get(customerName, [])
 
     def get_purchase_orders(self):
         return self.purchaseOrders
+
+    def __len__(self) -> int:
+        return len(self.purchaseOrders)
+
+
+_purchase_order_list_adapter = TypeAdapter(list[PurchaseOrder])
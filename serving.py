@@ -0,0 +1,73 @@
+"""
+Run the API server, optionally as several worker processes.
+
+    WORKERS=4 python serving.py
+
+With WORKERS above 1, state that would otherwise be duplicated per process is shared
+through files: the purchase orders are served from a memory-mapped index, extraction
+results and jobs are kept in SQLite files, and Prometheus metrics are aggregated from a
+multiprocess directory. Each setting can still be overridden through its own variable.
+"""
+import logging
+import os
+import tempfile
+from typing import Union
+import uvicorn
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8000
+
+# Shared-state defaults for multi-worker mode
+WORKER_DEFAULTS = {
+    "ORDER_INDEX_PATH": "purchase_orders.idx",
+    "EXTRACTION_CACHE_DB": "extraction_cache.db",
+    "JOB_QUEUE_BACKEND": "sqlite",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def get_workers() -> int:
+    return max(int(os.getenv("WORKERS", 1)), 1)
+
+
+def configure_workers(workers: int):
+    """
+    Prepare shared state before worker processes are started; workers inherit the
+    environment set here. The order index is built once up front so that workers only
+    map it, and metrics left over from a previous run are removed.
+    """
+    os.environ["WORKERS"] = str(workers)
+    for name, value in WORKER_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+    if os.environ["JOB_QUEUE_BACKEND"] == "memory":
+        logger.warning("In-memory job queues are per worker; job status requests may reach a worker that does not know the job")
+
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or tempfile.mkdtemp(prefix="ocr-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        if name.endswith(".db"):
+            os.remove(os.path.join(metrics_dir, name))
+
+    from order_index import MappedPurchaseOrderList
+
+    MappedPurchaseOrderList.open_or_build(os.environ["ORDER_INDEX_PATH"], os.getenv("PURCHASE_ORDERS_PATH")).close()
+
+
+def serve(app: Union[str, object] = "main:app", host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+    """
+    Serve app with WORKERS processes (default 1).
+    Worker processes import the app themselves, so multi-worker mode always loads it
+    from main:app; a single worker serves app as given.
+    """
+    workers = get_workers()
+    if workers == 1:
+        uvicorn.run(app, host=host, port=port)
+        return
+    configure_workers(workers)
+    uvicorn.run("main:app", host=host, port=port, workers=workers)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,61 @@
+import asyncio
+import random
+import time
+from typing import Optional, Union
+from base_text_extractor import BaseTextExtractor
+
+DEFAULT_STUB_TEXT = '{"purchaseOrderNumber": "#ORDER_571"}'
+
+
+class StubProviderError(RuntimeError):
+    pass
+
+
+class StubTextExtractor(BaseTextExtractor):
+    model = "stub"
+    prompt = ""
+
+    def __init__(
+        self,
+        provider: str = "stub",
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        text: str = DEFAULT_STUB_TEXT,
+        max_concurrency: Optional[int] = None,
+        seed: Optional[int] = None,
+    ):
+        """
+        Initialize a local stand-in for a vision provider.
+        Each call sleeps for latency seconds plus a uniform random jitter, fails with
+        probability error_rate, and otherwise returns text. Useful for exercising the
+        router, batch and job paths without API keys or spend.
+        """
+        super().__init__(max_concurrency)
+        self.provider = provider
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.text = text
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    def _next_delay(self) -> float:
+        return max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0.0)
+
+    def _should_fail(self) -> bool:
+        return self._random.random() < self.error_rate
+
+    def _extract_image_text(self, data: Union[bytes, memoryview], mime_type: str, max_tokens: Optional[int] = None) -> str:
+        self.calls += 1
+        time.sleep(self._next_delay())
+        if self._should_fail():
+            raise StubProviderError(f"Simulated {self.provider} failure")
+        return self.text
+
+    async def _extract_image_text_async(self, data: Union[bytes, memoryview], mime_type: str, max_tokens: Optional[int] = None) -> str:
+        self.calls += 1
+        await asyncio.sleep(self._next_delay())
+        if self._should_fail():
+            raise StubProviderError(f"Simulated {self.provider} failure")
+        return self.text
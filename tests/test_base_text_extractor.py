@@ -0,0 +1,119 @@
+import asyncio
+import io
+import json
+import pytest
+from PIL import Image
+from base_text_extractor import PAGE_OUTPUT_TOKENS, BaseTextExtractor
+from image_preprocessing import PreprocessedImage
+from stub_text_extractor import DEFAULT_STUB_TEXT, StubTextExtractor
+
+
+class PagedStubTextExtractor(StubTextExtractor):
+    max_pages_per_call = 4
+
+    def __init__(self, reply: str):
+        super().__init__(provider="paged")
+        self.reply = reply
+        self.page_calls = 0
+
+    def _extract_pages_text(self, pages):
+        self.page_calls += 1
+        return self.reply
+
+    async def _extract_pages_text_async(self, pages):
+        return self._extract_pages_text(pages)
+
+
+def _page(width: int = 100, height: int = 100) -> PreprocessedImage:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, "PNG")
+    data = buffer.getvalue()
+    return PreprocessedImage(data, "image/png", len(data), len(data), width, height)
+
+
+def _pages_reply(*numbers: int) -> str:
+    return json.dumps({"pages": [{"page": number, "purchaseOrderNumber": f"#ORDER_{number}"} for number in numbers]})
+
+
+def test_pages_are_packed_up_to_pages_per_call():
+    extractor = PagedStubTextExtractor(_pages_reply())
+    assert extractor._pack_pages([_page() for _ in range(10)]) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+
+def test_packing_keeps_within_output_input_and_size_limits():
+    pages = [_page(1500, 1000) for _ in range(5)]
+    extractor = PagedStubTextExtractor(_pages_reply())
+
+    extractor.max_output_tokens = 2 * PAGE_OUTPUT_TOKENS
+    assert extractor._pack_pages(pages) == [[0, 1], [2, 3], [4]]
+
+    extractor.max_output_tokens = BaseTextExtractor.max_output_tokens
+    page_tokens = extractor._estimated_tokens(pages[0].data, pages[0].mime_type)
+    extractor.max_input_tokens = 3 * page_tokens
+    assert extractor._pack_pages(pages) == [[0, 1, 2], [3, 4]]
+
+    extractor.max_input_tokens = BaseTextExtractor.max_input_tokens
+    # Base64 makes each page a third larger than its bytes
+    extractor.max_request_bytes = 2 * len(pages[0].data) * 4 // 3
+    assert extractor._pack_pages(pages) == [[0, 1], [2, 3], [4]]
+
+    # A page over a limit on its own still gets a call
+    extractor.max_request_bytes = 1
+    assert extractor._pack_pages(pages) == [[0], [1], [2], [3], [4]]
+
+
+def test_split_pages_places_entries_by_page_number():
+    reply = json.dumps({"pages": [
+        {"page": 2, "purchaseOrderNumber": "#ORDER_2"},
+        {"page": 1, "purchaseOrderNumber": "#ORDER_1"},
+        {"page": 2, "purchaseOrderNumber": "#ORDER_2_again"},
+        {"page": 7, "purchaseOrderNumber": "#ORDER_7"},
+        {"page": True, "purchaseOrderNumber": "#ORDER_true"},
+    ]})
+    results = BaseTextExtractor._split_pages(reply, 3)
+    assert [json.loads(text)["purchaseOrderNumber"] for text in results[:2]] == ["#ORDER_1", "#ORDER_2"]
+    # Duplicates, pages out of range and non-numbers are dropped, so page 3 is missing
+    assert results[2] is None
+
+
+def test_split_pages_without_page_numbers_uses_positions():
+    reply = json.dumps({"pages": [{"purchaseOrderNumber": "#ORDER_1"}, {"purchaseOrderNumber": "#ORDER_2"}]})
+    results = BaseTextExtractor._split_pages(reply, 2)
+    assert [json.loads(text) for text in results] == [{"purchaseOrderNumber": "#ORDER_1"}, {"purchaseOrderNumber": "#ORDER_2"}]
+
+
+@pytest.mark.parametrize("reply", [
+    None,
+    "",
+    "not json",
+    "[]",
+    '"pages"',
+    '{"page": 1}',
+    '{"pages": null}',
+    '{"pages": 3}',
+    '{"pages": "#ORDER_1"}',
+    '{"pages": {"1": {"purchaseOrderNumber": "#ORDER_1"}}}',
+    '{"pages": [null, 1, "#ORDER_1", []]}',
+])
+def test_malformed_replies_leave_every_page_missing(reply):
+    assert BaseTextExtractor._split_pages(reply, 3) == [None, None, None]
+
+
+@pytest.mark.parametrize("reply", ['{"pages": null}', '{"pages": {"1": {}}}', "not json"])
+def test_malformed_reply_falls_back_to_one_call_per_page(reply):
+    extractor = PagedStubTextExtractor(reply)
+    pages = [(_page().data, "image/png") for _ in range(3)]
+
+    assert extractor.extract_pages(pages) == [DEFAULT_STUB_TEXT] * 3
+    assert (extractor.page_calls, extractor.calls) == (1, 3)
+    assert asyncio.run(extractor.extract_pages_async(pages)) == [DEFAULT_STUB_TEXT] * 3
+
+
+def test_only_pages_missing_from_the_reply_are_retried():
+    extractor = PagedStubTextExtractor(_pages_reply(1, 3))
+    texts = extractor.extract_pages([(_page().data, "image/png") for _ in range(3)])
+
+    assert json.loads(texts[0]) == {"purchaseOrderNumber": "#ORDER_1"}
+    assert texts[1] == DEFAULT_STUB_TEXT
+    assert json.loads(texts[2]) == {"purchaseOrderNumber": "#ORDER_3"}
+    assert (extractor.page_calls, extractor.calls) == (1, 1)
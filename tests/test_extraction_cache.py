@@ -0,0 +1,45 @@
+import asyncio
+import pytest
+from benchmarks.corpus import slip_image
+from extraction_cache import CachedTextExtractor, ExtractionCache
+from stub_text_extractor import DEFAULT_STUB_TEXT, StubTextExtractor
+
+
+@pytest.mark.parametrize("reply", [None, ""])
+def test_missing_replies_are_not_cached(tmp_path, reply):
+    stub = StubTextExtractor(text=reply)
+    cache = ExtractionCache(db_path=str(tmp_path / "cache.db"))
+    extractor = CachedTextExtractor(stub, cache)
+    data = slip_image("small", seed=1)
+
+    assert not extractor.extract_text(data, mime_type="image/jpeg")
+    assert not asyncio.run(extractor.extract_text_async(data, mime_type="image/jpeg"))
+    assert cache.get(extractor._key(data)) is None
+
+    # Once the provider answers, its reply is cached as usual
+    stub.text = DEFAULT_STUB_TEXT
+    calls = stub.calls
+    assert extractor.extract_text(data, mime_type="image/jpeg") == DEFAULT_STUB_TEXT
+    assert extractor.extract_text(data, mime_type="image/jpeg") == DEFAULT_STUB_TEXT
+    assert stub.calls == calls + 1
+
+
+def test_disk_tier_is_trimmed_by_least_recent_access(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = ExtractionCache(max_entries=1, db_path=db_path, max_disk_entries=20)
+    for index in range(20):
+        cache.set(f"key{index}", f"value{index}")
+    # Read from disk, so it is the most recently used
+    assert cache.get("key0") == "value0"
+
+    for index in range(20, 22):
+        cache.set(f"key{index}", f"value{index}")
+    # Still within the slack, so nothing was trimmed yet
+    assert cache.stats()["disk_entries"] == 22
+
+    cache.set("key22", "value22")
+    assert cache.stats()["disk_entries"] == 20
+    reopened = ExtractionCache(max_entries=1, db_path=db_path)
+    assert reopened.stats()["disk_entries"] == 20
+    assert reopened.get("key0") == "value0"
+    assert [reopened.get(f"key{index}") for index in range(1, 5)] == [None, None, None, "value4"]
@@ -0,0 +1,105 @@
+import time
+import uuid
+import pytest
+from job_queue import (
+    RUNNING,
+    SUCCEEDED,
+    CallbackNotAllowedError,
+    InMemoryJobBackend,
+    Job,
+    SQLiteJobBackend,
+    validate_callback_url,
+)
+
+
+def _job() -> Job:
+    return Job(id=uuid.uuid4().hex, filename="slip.jpg", content_type="image/jpeg", provider="google")
+
+
+def test_new_worker_leaves_live_claims_alone(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    first = SQLiteJobBackend(db_path)
+    job = _job()
+    first.enqueue(job, b"data")
+    assert first.dequeue()[0].id == job.id
+
+    # A worker starting up, or polling, must not take over a job another live worker holds
+    second = SQLiteJobBackend(db_path)
+    assert second.dequeue() is None
+    assert second.get(job.id).status == RUNNING
+
+
+def test_expired_lease_is_queued_again(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    stalled = SQLiteJobBackend(db_path, lease_seconds=-1)
+    job = _job()
+    stalled.enqueue(job, b"data")
+    stalled.dequeue()
+
+    survivor = SQLiteJobBackend(db_path)
+    claimed, data = survivor.dequeue()
+    assert (claimed.id, data) == (job.id, b"data")
+    assert not stalled.heartbeat(job.id)
+
+    # The stalled worker's late outcome does not overwrite the new claim
+    claimed.status = SUCCEEDED
+    stalled.update(claimed)
+    assert survivor.get(job.id).status == RUNNING
+    survivor.update(claimed)
+    assert survivor.get(job.id).status == SUCCEEDED
+
+
+def test_heartbeat_keeps_the_claim(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    backend = SQLiteJobBackend(db_path, lease_seconds=60)
+    job = _job()
+    backend.enqueue(job, b"data")
+    backend.dequeue()
+    assert backend.heartbeat(job.id)
+    assert SQLiteJobBackend(db_path).get(job.id).status == RUNNING
+    assert backend.depth() == 0
+
+
+def test_purge_deletes_only_expired_finished_jobs(tmp_path):
+    backend = SQLiteJobBackend(str(tmp_path / "jobs.db"))
+    finished, running = _job(), _job()
+    for job in (finished, running):
+        backend.enqueue(job, b"data")
+    claimed, _ = backend.dequeue()
+    claimed.status, claimed.finished_at = SUCCEEDED, time.time() - 10
+    backend.update(claimed)
+    backend.dequeue()
+
+    assert backend.purge(time.time() - 60) == 0
+    assert backend.purge(time.time()) == 1
+    assert backend.get(finished.id) is None
+    assert backend.get(running.id).status == RUNNING
+
+
+def test_in_memory_purge():
+    backend = InMemoryJobBackend()
+    job = _job()
+    backend.enqueue(job, b"data")
+    claimed, _ = backend.dequeue()
+    claimed.status, claimed.finished_at = SUCCEEDED, time.time() - 10
+    backend.update(claimed)
+    assert backend.purge(time.time()) == 1
+    assert backend.get(job.id) is None
+
+
+@pytest.mark.parametrize("url", [
+    "file:///etc/passwd",
+    "gopher://hooks.example.com/",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://localhost:8000/jobs",
+    "https://example.com.evil.net/hook",
+    "https://evilexample.com/hook",
+])
+def test_callback_urls_outside_the_allowlist_are_refused(url):
+    with pytest.raises(CallbackNotAllowedError):
+        validate_callback_url(url, ["example.com", "*.example.com"])
+
+
+@pytest.mark.parametrize("url", ["https://example.com/hook", "http://hooks.example.com:8080/done"])
+def test_allowed_callback_urls(url):
+    validate_callback_url(url, ["example.com", "*.example.com"])
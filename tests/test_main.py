@@ -0,0 +1,46 @@
+import asyncio
+import threading
+import time
+import httpx
+import main
+import provider_registry
+from benchmarks.corpus import slip_image
+from provider_registry import ProviderRegistry, ProviderSpec
+from stub_text_extractor import DEFAULT_STUB_TEXT, StubTextExtractor
+
+LOAD_SECONDS = 0.5
+loading = threading.Event()
+
+
+class SlowLoadingStubTextExtractor(StubTextExtractor):
+    def __init__(self, api_key=None):
+        # Stands in for a provider SDK that takes a while to import
+        loading.set()
+        time.sleep(LOAD_SECONDS)
+        super().__init__(provider="google")
+
+
+def test_health_answers_while_a_provider_loads(monkeypatch):
+    monkeypatch.setitem(provider_registry.PROVIDERS, "google", ProviderSpec(__name__, "SlowLoadingStubTextExtractor", "GEMINI_API_KEY"))
+    monkeypatch.setattr(main, "provider_registry", ProviderRegistry(["google"]))
+    monkeypatch.setattr(main, "UPLOAD_PERSIST", False)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            upload = asyncio.create_task(
+                client.post("/upload/image/google", files={"file": ("slip.jpg", slip_image("small", seed=1), "image/jpeg")})
+            )
+            assert await asyncio.to_thread(loading.wait, 5)
+
+            started = time.perf_counter()
+            health = await client.get("/health")
+            assert health.status_code == 200
+            assert time.perf_counter() - started < LOAD_SECONDS / 2
+            assert not main.provider_registry.is_loaded("google")
+
+            response = await upload
+            assert response.status_code == 200
+            assert response.json()["extracted_text"] == DEFAULT_STUB_TEXT
+
+    asyncio.run(run())
@@ -0,0 +1,35 @@
+import json
+import pytest
+from order_archive import OrderArchive
+from purchase_orders import Item, PurchaseOrder
+
+pytest.importorskip("pyarrow")
+
+
+def _order(number: str, customer: str) -> PurchaseOrder:
+    items = [Item(itemId="A1", itemQuantity=2, itemPrice=1.5), Item(itemId="B2", itemQuantity=1, itemPrice=4.0)]
+    return PurchaseOrder(purchaseOrderNumber=number, customerName=customer, items=items)
+
+
+def test_buffered_rows_are_read_without_a_flush_and_counted_once(tmp_path):
+    archive = OrderArchive(str(tmp_path / "archive"))
+    archive.append(_order("#ORDER_1", "Ann"), provider="google")
+    archive.flush()
+    archive.append(_order("#ORDER_2", "Ann"), provider="google")
+    archive.append(_order("#ORDER_3", "Bob"), provider="claude")
+
+    assert archive.aggregate() == [
+        {"customerName": "Ann", "orders": 2, "lineItems": 4, "quantity": 6, "price": 11.0},
+        {"customerName": "Bob", "orders": 1, "lineItems": 2, "quantity": 3, "price": 5.5},
+    ]
+    rows = [json.loads(line) for chunk in archive.export(customer="Ann") for line in chunk.splitlines()]
+    assert sorted({row["purchaseOrderNumber"] for row in rows}) == ["#ORDER_1", "#ORDER_2"]
+    # Reading wrote nothing; the buffered rows are still pending
+    assert len(archive.files()) == 1
+    assert archive.pending() == 4
+
+    archive.flush()
+    assert archive.aggregate(group_by="provider") == [
+        {"provider": "claude", "orders": 1, "lineItems": 2, "quantity": 3, "price": 5.5},
+        {"provider": "google", "orders": 2, "lineItems": 4, "quantity": 6, "price": 11.0},
+    ]
@@ -0,0 +1,36 @@
+import asyncio
+import glob
+import os
+import tempfile
+import pytest
+from pdf_engine import PdfEngine
+
+fitz = pytest.importorskip("fitz")
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = PdfEngine(max_workers=2, pages_per_chunk=4, parallel_min_pages=8)
+    yield engine
+    engine.shutdown()
+
+
+def _pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        doc.new_page().insert_text((72, 72), f"Page {number}")
+    return doc.tobytes()
+
+
+def _shared_copies() -> list[str]:
+    return glob.glob(os.path.join(tempfile.gettempdir(), "pdf-engine-*"))
+
+
+def test_parallel_extraction_keeps_page_order_and_removes_the_shared_copy(engine):
+    before = _shared_copies()
+    data = _pdf(20)
+    expected = [f"Page {number}" for number in range(1, 21)]
+
+    assert [text.strip() for text in engine.extract_pages(data)] == expected
+    assert [text.strip() for text in asyncio.run(engine.extract_pages_async(data))] == expected
+    assert _shared_copies() == before
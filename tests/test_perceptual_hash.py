@@ -0,0 +1,120 @@
+import io
+import random
+import pytest
+from PIL import Image, ImageEnhance, ImageOps
+from benchmarks.corpus import slip_image
+from extraction_cache import CachedTextExtractor, ExtractionCache
+from perceptual_hash import CHUNK_POSITIONS, MAX_SCAN, ImageHash, PerceptualHashIndex, get_last_near_duplicate, image_hash
+from stub_text_extractor import StubTextExtractor
+
+PAPER = (250, 248, 240)
+
+
+def _jpeg(image: Image.Image, quality: int = 90) -> bytes:
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def _recaptures(data: bytes) -> dict[str, bytes]:
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    return {
+        "recompressed": _jpeg(image, quality=50),
+        "brighter": _jpeg(ImageEnhance.Brightness(image).enhance(1.15)),
+        "framed": _jpeg(ImageOps.expand(image, border=width // 25, fill=PAPER)),
+        "rescaled": _jpeg(image.resize((width * 3 // 4, height * 3 // 4))),
+    }
+
+
+@pytest.mark.parametrize("size", ["small", "medium"])
+def test_distinct_corpus_slips_do_not_match(size):
+    index = PerceptualHashIndex()
+    for seed in range(30):
+        imageHash = image_hash(slip_image(size, seed=seed))
+        assert index.find(imageHash) is None, f"slip {seed} matched an earlier, different slip"
+        index.add(imageHash, str(seed))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_recaptured_slip_matches_its_original(seed):
+    original = slip_image("large", seed=seed)
+    index = PerceptualHashIndex()
+    index.add(image_hash(original), "original")
+    for other_seed in range(10, 15):
+        index.add(image_hash(slip_image("large", seed=other_seed)), str(other_seed))
+
+    for name, data in _recaptures(original).items():
+        match = index.find(image_hash(data))
+        assert match is not None, f"{name} copy not found"
+        assert match.key == "original"
+        assert match.difference <= index.max_difference
+
+
+def test_identical_hashes_map_to_latest_key_and_evict_oldest():
+    index = PerceptualHashIndex(max_entries=2)
+    first = image_hash(slip_image("small", seed=1))
+    index.add(first, "a")
+    index.add(first, "b")
+    assert index.find(first).key == "b"
+    index.add(image_hash(slip_image("small", seed=2)), "c")
+    index.add(image_hash(slip_image("small", seed=3)), "d")
+    assert len(index) == 2
+    assert index.find(first) is None
+
+
+def test_old_entry_is_found_behind_many_sharing_common_chunks():
+    original = image_hash(slip_image("small", seed=1))
+    index = PerceptualHashIndex(max_entries=MAX_SCAN * 4)
+    index.add(original, "original")
+    # Newer entries share chunks 8-15 with the original and are random elsewhere, so
+    # those chunk values become far too common to scan in full
+    rng = random.Random(0)
+    random_positions = [position for positions in CHUNK_POSITIONS[:8] for position in positions]
+    for number in range(MAX_SCAN * 3):
+        value = original.value
+        for position in random_positions:
+            value = (value & ~(1 << position)) | (rng.getrandbits(1) << position)
+        index.add(ImageHash(value, original.fingerprint, original.width, original.height), f"filler-{number}")
+
+    query = original.value
+    for position in CHUNK_POSITIONS[8][:3]:
+        query ^= 1 << position
+    # The rare chunk values the query shares with the original lead to it first
+    assert index.candidates(query)[0] == (3, original.value)
+
+
+def test_reuse_mode_calls_provider_for_distinct_slips_only():
+    stub = StubTextExtractor()
+    extractor = CachedTextExtractor(stub, ExtractionCache(), PerceptualHashIndex(reuse=True))
+    slips = [slip_image("medium", seed=seed) for seed in range(8)]
+    for data in slips:
+        extractor.extract_text(data, mime_type="image/jpeg")
+        assert get_last_near_duplicate() is None
+    assert stub.calls == len(slips)
+
+    extractor.extract_text(_recaptures(slips[0])["recompressed"], mime_type="image/jpeg")
+    match = get_last_near_duplicate()
+    assert match is not None and match.reused
+    assert stub.calls == len(slips)
+
+
+def test_reuse_is_scoped_to_the_provider_that_extracted_the_original():
+    cache, index = ExtractionCache(), PerceptualHashIndex(reuse=True)
+    google = CachedTextExtractor(StubTextExtractor("google", text="google text"), cache, index)
+    openai = CachedTextExtractor(StubTextExtractor("openai", text="openai text"), cache, index)
+    original = slip_image("medium", seed=1)
+    recaptured = _recaptures(original)["recompressed"]
+    google.extract_text(original, mime_type="image/jpeg")
+
+    # The shared index holds Google's result, which an OpenAI request must not be answered with
+    assert openai.extract_text(recaptured, mime_type="image/jpeg") == "openai text"
+    assert get_last_near_duplicate() is None
+    assert openai.extractor.calls == 1
+
+    lookups = cache.hits + cache.misses
+    assert google.extract_text(recaptured, mime_type="image/jpeg") == "google text"
+    assert get_last_near_duplicate().reused
+    assert google.extractor.calls == 1
+    # Only the lookup of the recapture's own key counts, not the reuse of the original's
+    assert (cache.hits + cache.misses, cache.misses) == (lookups + 1, 3)
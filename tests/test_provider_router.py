@@ -0,0 +1,127 @@
+import asyncio
+import io
+import time
+import pytest
+from PIL import Image
+import provider_registry
+from benchmarks.corpus import slip_image
+from extraction_cache import CachedTextExtractor, ExtractionCache
+from provider_registry import ProviderRegistry, ProviderSpec
+from provider_router import FAILURES_BEFORE_COOLDOWN, NoProviderAvailableError, ProviderRouter
+from stub_text_extractor import StubTextExtractor
+
+
+def _png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _route(router: ProviderRouter):
+    return asyncio.run(router.route(_png(), "image/png"))
+
+
+def test_hedged_request_wins_when_first_provider_is_slow():
+    slow = StubTextExtractor("slow", latency=1.0, text="slow")
+    fast = StubTextExtractor("fast", latency=0.01, text="fast")
+    router = ProviderRouter({"slow": slow, "fast": fast})
+    # slow has the lower p50 so it is tried first, and a p95 of 20 ms after which the request is hedged
+    router.stats["slow"].record(0.02, ok=True)
+    router.stats["fast"].record(0.05, ok=True)
+
+    started = time.perf_counter()
+    result = _route(router)
+
+    assert (result.text, result.provider, result.hedged) == ("fast", "fast", True)
+    assert result.attempts == ["slow", "fast"]
+    assert time.perf_counter() - started < 0.5
+    # The abandoned request counts as at least as slow as the wait before hedging
+    assert router.stats["slow"].p95() > 0.02
+    assert router.stats["slow"].samples == 1
+
+
+def test_failed_call_fails_over_to_next_provider():
+    broken = StubTextExtractor("broken", error_rate=1.0)
+    working = StubTextExtractor("working", text="working")
+    router = ProviderRouter({"broken": broken, "working": working}, hedge=False)
+
+    result = _route(router)
+
+    assert (result.text, result.provider, result.hedged) == ("working", "working", False)
+    assert result.attempts == ["broken", "working"]
+    assert router.stats["broken"].error_rate() == 1.0
+    assert router.stats["working"].error_rate() == 0.0
+
+
+def test_all_providers_failing_raises():
+    router = ProviderRouter({"a": StubTextExtractor("a", error_rate=1.0), "b": StubTextExtractor("b", error_rate=1.0)})
+    with pytest.raises(NoProviderAvailableError):
+        _route(router)
+
+
+def test_consecutive_failures_put_provider_in_cooldown():
+    flaky = StubTextExtractor("flaky", error_rate=1.0)
+    steady = StubTextExtractor("steady", latency=0.02, text="steady")
+    router = ProviderRouter({"flaky": flaky, "steady": steady}, hedge=False, cooldown_seconds=0.2)
+    # flaky was fast before it started failing, so it keeps ranking first until the cooldown
+    router.stats["flaky"].record(0.001, ok=True)
+    router.stats["steady"].record(0.05, ok=True)
+
+    for _ in range(FAILURES_BEFORE_COOLDOWN):
+        assert _route(router).attempts == ["flaky", "steady"]
+    assert not router.is_healthy("flaky")
+
+    assert _route(router).attempts == ["steady"]
+    assert flaky.calls == FAILURES_BEFORE_COOLDOWN
+
+    # Too few samples for the error rate to count, so flaky is back in rotation once the cooldown ends
+    time.sleep(0.25)
+    assert router.is_healthy("flaky")
+    assert router.ranked()[0] == "flaky"
+
+
+class KeyedStubTextExtractor(StubTextExtractor):
+    def __init__(self, api_key=None):
+        # Fails to load without a key, like the real provider clients
+        if not api_key:
+            raise ValueError("API key is required")
+        super().__init__(provider="keyed")
+
+
+def test_unloadable_provider_fails_over(monkeypatch):
+    for name, api_key_env in [("claude", "ANTHROPIC_API_KEY"), ("google", "GEMINI_API_KEY")]:
+        monkeypatch.setitem(provider_registry.PROVIDERS, name, ProviderSpec(__name__, "KeyedStubTextExtractor", api_key_env))
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    registry = ProviderRegistry(["claude", "google"])
+    router = ProviderRouter(registry, hedge=False)
+
+    result = asyncio.run(router.route(_png(), "image/png"))
+
+    assert result.provider == "google"
+    assert result.attempts == ["claude", "google"]
+    assert router.stats["claude"].samples == 1
+    assert router.stats["claude"].error_rate() == 1.0
+    assert registry.status()["claude"]["error"] == "API key is required"
+    # A provider that has only failed ranks after the measured ones
+    assert router.ranked() == ["google", "claude"]
+
+
+def test_cache_hits_do_not_count_as_provider_latency():
+    cache = ExtractionCache()
+    cached = CachedTextExtractor(StubTextExtractor("cached", latency=0.1), cache)
+    other = CachedTextExtractor(StubTextExtractor("other", text="other"), cache)
+    router = ProviderRouter({"cached": cached, "other": other})
+    router.stats["other"].record(1.0, ok=True)
+    slips = [slip_image("small", seed=seed) for seed in range(3)]
+
+    for data in slips[:2]:
+        assert asyncio.run(router.route(data, "image/jpeg")).provider == "cached"
+    # Many more hits than misses; counted as latencies, they would pull p95 far below a provider call
+    for _ in range(40):
+        assert not asyncio.run(router.route(slips[0], "image/jpeg")).hedged
+    assert router.stats["cached"].samples == 2
+
+    cached.extractor.latency = 0.03
+    result = asyncio.run(router.route(slips[2], "image/jpeg"))
+    assert (result.provider, result.hedged, result.attempts) == ("cached", False, ["cached"])
@@ -0,0 +1,116 @@
+import os
+import subprocess
+import sys
+import pytest
+from order_index import MappedPurchaseOrderList, build_order_index
+from purchase_order_matching import PurchaseOrderMatcher
+from purchase_orders import PurchaseOrder, default_purchase_orders
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(params=["memory", "mapped"])
+def matcher(request, tmp_path):
+    if request.param == "memory":
+        yield PurchaseOrderMatcher(default_purchase_orders())
+        return
+    path = str(tmp_path / "orders.idx")
+    build_order_index(default_purchase_orders(), path)
+    store = MappedPurchaseOrderList(path)
+    yield store
+    store.close()
+
+
+def test_unique_closest_order_is_matched(matcher):
+    match = matcher.best_match("0RDER-571")
+    assert match is not None
+    assert match.purchaseOrder.purchaseOrderNumber == "#ORDER_571"
+    assert match.distance == 0
+
+
+def test_tied_orders_are_not_matched(matcher):
+    # #ORDER_579 does not exist and is one edit away from every demo order
+    match, candidates = matcher.resolve("#ORDER_579")
+    assert match is None
+    assert matcher.best_match("#ORDER_579") is None
+    numbers = [candidate.purchaseOrder.purchaseOrderNumber for candidate in candidates]
+    assert numbers == sorted(numbers)
+    assert len(set(numbers)) > 1
+
+
+def test_same_order_tying_on_both_fields_is_not_ambiguous():
+    purchaseOrder = PurchaseOrder(purchaseOrderNumber="ABC123", trackingNumber="ABC124")
+    match, candidates = PurchaseOrderMatcher([purchaseOrder]).resolve("ABC125")
+    assert candidates == []
+    assert match.field == "purchaseOrderNumber"
+
+
+def test_match_order_does_not_depend_on_hash_seed():
+    script = (
+        "from purchase_order_matching import PurchaseOrderMatcher\n"
+        "from purchase_orders import default_purchase_orders\n"
+        "matcher = PurchaseOrderMatcher(default_purchase_orders())\n"
+        "print([m.purchaseOrder.purchaseOrderNumber for m in matcher.match('#ORDER_579', limit=None)])\n"
+    )
+    outputs = {
+        subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=ROOT,
+            env={**os.environ, "PYTHONHASHSEED": str(seed)},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        for seed in range(5)
+    }
+    assert len(outputs) == 1
+
+
+@pytest.fixture(params=["memory", "mapped"])
+def catalogue(request, tmp_path):
+    purchaseOrders = [
+        PurchaseOrder(purchaseOrderNumber=f"#ORDER-{n}", trackingNumber=f"LZ{n * 7919 % 10**9:09d}")
+        for n in range(1, 2001)
+    ]
+    if request.param == "memory":
+        yield PurchaseOrderMatcher(purchaseOrders)
+        return
+    path = str(tmp_path / "orders.idx")
+    build_order_index(purchaseOrders, path)
+    store = MappedPurchaseOrderList(path)
+    yield store
+    store.close()
+
+
+def test_exact_hit_is_matched_without_candidates(catalogue):
+    match, candidates = catalogue.resolve("0RDER_1234")
+    assert (match.purchaseOrder.purchaseOrderNumber, match.field, match.distance) == ("#ORDER-1234", "purchaseOrderNumber", 0)
+    assert candidates == []
+
+    match, candidates = catalogue.resolve(f"LZ{1234 * 7919 % 10**9:09d}")
+    assert (match.purchaseOrder.purchaseOrderNumber, match.field, match.distance) == ("#ORDER-1234", "trackingNumber", 0)
+    assert candidates == []
+
+
+def test_typo_hit_is_matched_when_unique(catalogue):
+    # One substituted digit in the tracking number, which no other order is close to
+    tracking = f"LZ{1234 * 7919 % 10**9:09d}"
+    typo = tracking[:-1] + str((int(tracking[-1]) + 5) % 10)
+    match, candidates = catalogue.resolve(typo)
+    assert (match.purchaseOrder.purchaseOrderNumber, match.field, match.distance) == ("#ORDER-1234", "trackingNumber", 1)
+    assert candidates == []
+
+
+def test_typo_close_to_several_orders_is_ambiguous(catalogue):
+    # ORDER123X is one edit from ORDER123 and from each of ORDER1230 to ORDER1239
+    match, candidates = catalogue.resolve("#ORDER-123x")
+    assert match is None
+    numbers = {candidate.purchaseOrder.purchaseOrderNumber for candidate in candidates}
+    assert "#ORDER-123" in numbers and len(numbers) > 1
+    assert all(candidate.distance == 1 for candidate in candidates)
+
+
+def test_order_index_imports_without_fcntl():
+    # fcntl does not exist on Windows; only building under the lock needs it
+    script = "import sys\nsys.modules['fcntl'] = None\nimport order_index\n"
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True)
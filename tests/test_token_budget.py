@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+from token_budget import ResolutionStep, TokenBudget
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = (
+    "from token_budget import ResolutionStep, TokenBudget\n"
+    "budget = TokenBudget()\n"
+    "budget.record_attempt('google', 0.001, escalation=False)\n"
+    "budget.record_usage('google', 'gemini-2.0-flash', 1000, 200)\n"
+    "budget.record_attempt('google', 0.002, escalation=True)\n"
+    "budget.record_usage('google', 'gemini-2.0-flash', 2000, 400)\n"
+    "budget.record_result('google', ResolutionStep(1536, 2048))\n"
+)
+REPORT = "import json\nfrom token_budget import TokenBudget\nprint(json.dumps(TokenBudget().spend()))\n"
+
+
+def _run(script: str, env: dict) -> str:
+    return subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+
+
+def test_spend_is_summed_over_workers(tmp_path):
+    # Workers write their counters to the shared directory, as under serving.py
+    env = {key: value for key, value in os.environ.items() if not key.startswith("GOOGLE_PRICE_")}
+    env["PROMETHEUS_MULTIPROC_DIR"] = str(tmp_path)
+    for _ in range(2):
+        _run(WORKER, env)
+
+    spend = json.loads(_run(REPORT, env))
+    assert spend["providers"] == {
+        "google": {
+            "calls": 4,
+            "input_tokens": 6000,
+            "output_tokens": 1200,
+            "cost_usd": 0.00108,
+            "estimated_cost_usd": 0.006,
+            "images": 2,
+            "escalations": 2,
+            "final_steps": {"1536:2048": 2},
+        }
+    }
+    assert spend["total_cost_usd"] == 0.00108
+
+
+def test_unpriced_model_counts_tokens_without_cost(monkeypatch):
+    monkeypatch.delenv("UNPRICED_PRICE_INPUT", raising=False)
+    monkeypatch.delenv("UNPRICED_PRICE_OUTPUT", raising=False)
+    budget = TokenBudget()
+    assert budget.record_usage("unpriced", "unknown-model", 100, 10) is None
+    budget.record_result("unpriced", ResolutionStep(1024, 1024))
+    spend = budget.spend()["providers"]["unpriced"]
+    assert (spend["calls"], spend["input_tokens"], spend["output_tokens"], spend["cost_usd"]) == (1, 100, 10, 0.0)
+    assert spend["final_steps"] == {"1024:1024": 1}
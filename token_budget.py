@@ -0,0 +1,185 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+from instrumentation import (
+    COST_USD,
+    ESCALATIONS,
+    ESTIMATED_COST_USD,
+    FINAL_STEPS,
+    IMAGES_SENT,
+    PRICED_CALLS,
+    PRICED_TOKENS,
+    counter_samples,
+)
+
+# max_long_edge:max_tokens steps, cheapest first
+DEFAULT_LADDER = "1024:1024,1536:2048,2048:4096"
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    # USD per million tokens
+    input: float
+    output: float
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float:
+        return (input_tokens * self.input + output_tokens * self.output) / 1_000_000
+
+
+# List prices in USD per million tokens; override with <PROVIDER>_PRICE_INPUT and <PROVIDER>_PRICE_OUTPUT
+MODEL_PRICES = {
+    "gemini-2.0-flash-exp": ModelPrice(0.10, 0.40),
+    "gemini-2.0-flash": ModelPrice(0.10, 0.40),
+    "claude-3-sonnet-20240229": ModelPrice(3.00, 15.00),
+    "gpt-4o": ModelPrice(2.50, 10.00),
+}
+
+
+def get_price(provider: str, model: str) -> Optional[ModelPrice]:
+    """Return the price of a model, or None when it is neither in MODEL_PRICES nor configured."""
+    prefix = provider.upper()
+    input_price = os.getenv(f"{prefix}_PRICE_INPUT")
+    output_price = os.getenv(f"{prefix}_PRICE_OUTPUT")
+    price = MODEL_PRICES.get(model)
+    if input_price is None and output_price is None:
+        return price
+    return ModelPrice(
+        float(input_price) if input_price is not None else (price.input if price else 0.0),
+        float(output_price) if output_price is not None else (price.output if price else 0.0),
+    )
+
+
+@dataclass(frozen=True)
+class ResolutionStep:
+    # None keeps the pre-processor's default size and the provider's default output limit
+    max_long_edge: Optional[int]
+    max_tokens: Optional[int]
+
+    def to_dict(self) -> dict:
+        return {"max_long_edge": self.max_long_edge, "max_tokens": self.max_tokens}
+
+
+def parse_ladder(value: str) -> list[ResolutionStep]:
+    """Parse "1024:1024,2048:4096" into resolution steps, ordered cheapest first."""
+    steps = []
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        edge, _, max_tokens = entry.partition(":")
+        steps.append(ResolutionStep(int(edge), int(max_tokens)))
+    if not steps:
+        raise ValueError("The resolution ladder needs at least one max_long_edge:max_tokens step.")
+    return sorted(steps, key=lambda step: (step.max_long_edge, step.max_tokens))
+
+
+class TokenBudget:
+    def __init__(self, ladder: Optional[list[ResolutionStep]] = None, adaptive: bool = True):
+        """
+        Choose how much image and output budget each extraction gets, and count spend.
+        With adaptive, images are first sent at the cheapest ladder step, a small long
+        edge and max_tokens, and only re-sent at the next step when the reply does not
+        parse as a purchase order. Token usage reported by the providers is priced with
+        get_price. Spend is counted per provider in Prometheus counters, so with several
+        workers spend reports the sum over all of them, like /metrics.
+        """
+        self.ladder = ladder or parse_ladder(DEFAULT_LADDER)
+        self.adaptive = adaptive
+
+    @classmethod
+    def from_env(cls) -> "TokenBudget":
+        """Build a budget from ADAPTIVE_RESOLUTION (default true) and RESOLUTION_LADDER."""
+        return cls(
+            parse_ladder(os.getenv("RESOLUTION_LADDER", DEFAULT_LADDER)),
+            adaptive=os.getenv("ADAPTIVE_RESOLUTION", "true").lower() in ("1", "true", "yes"),
+        )
+
+    def steps(self, max_long_edge: Optional[int]) -> list[ResolutionStep]:
+        """
+        Steps to try for one image, cheapest first.
+
+        Args:
+            max_long_edge (Optional[int]): The pre-processor's limit, which caps every step;
+                None when images are sent unchanged, so only max_tokens varies
+
+        Returns:
+            list[ResolutionStep]: A single default step when adaptive resolution is off
+        """
+        if not self.adaptive:
+            return [ResolutionStep(None, None)]
+        steps: list[ResolutionStep] = []
+        for step in self.ladder:
+            edge = min(step.max_long_edge, max_long_edge) if max_long_edge else None
+            candidate = ResolutionStep(edge, step.max_tokens)
+            if candidate not in steps:
+                steps.append(candidate)
+        return steps
+
+    def record_usage(self, provider: str, model: str, input_tokens: int, output_tokens: int) -> Optional[float]:
+        """Add the token usage of one provider call; returns its cost, or None if the model has no price."""
+        price = get_price(provider, model)
+        cost = price.cost(input_tokens, output_tokens) if price else None
+        PRICED_CALLS.labels(provider).inc()
+        PRICED_TOKENS.labels(provider, "input").inc(input_tokens)
+        PRICED_TOKENS.labels(provider, "output").inc(output_tokens)
+        if cost is not None:
+            COST_USD.labels(provider).inc(cost)
+        return cost
+
+    def record_attempt(self, provider: str, estimated_cost: Optional[float], escalation: bool):
+        ESTIMATED_COST_USD.labels(provider).inc(estimated_cost or 0.0)
+        if escalation:
+            ESCALATIONS.labels(provider).inc()
+        else:
+            IMAGES_SENT.labels(provider).inc()
+
+    def record_result(self, provider: str, step: ResolutionStep):
+        """Count the ladder step an image was finally extracted at."""
+        FINAL_STEPS.labels(provider, f"{step.max_long_edge}:{step.max_tokens}").inc()
+
+    def spend(self) -> dict:
+        """Return spend counters per provider, summed over all workers, with the ladder in use."""
+        calls, tokens, cost, estimated_cost, images, escalations, final_steps = counter_samples(
+            PRICED_CALLS, PRICED_TOKENS, COST_USD, ESTIMATED_COST_USD, IMAGES_SENT, ESCALATIONS, FINAL_STEPS
+        )
+        providers: dict[str, dict] = {}
+
+        def provider_spend(labels: dict[str, str]) -> dict:
+            return providers.setdefault(labels["provider"], {
+                "calls": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cost_usd": 0.0,
+                "estimated_cost_usd": 0.0,
+                "images": 0,
+                "escalations": 0,
+                "final_steps": {},
+            })
+
+        for field, samples in [("calls", calls), ("images", images), ("escalations", escalations)]:
+            for labels, value in samples:
+                provider_spend(labels)[field] += int(value)
+        for field, samples in [("cost_usd", cost), ("estimated_cost_usd", estimated_cost)]:
+            for labels, value in samples:
+                provider_spend(labels)[field] = round(value, 6)
+        for labels, value in tokens:
+            provider_spend(labels)[f"{labels['direction']}_tokens"] += int(value)
+        for labels, value in final_steps:
+            provider_spend(labels)["final_steps"][labels["step"]] = int(value)
+
+        return {
+            "adaptive": self.adaptive,
+            "ladder": [step.to_dict() for step in self.ladder],
+            "total_cost_usd": round(sum(spend["cost_usd"] for spend in providers.values()), 6),
+            "providers": dict(sorted(providers.items())),
+        }
+
+
+_token_budget: Optional[TokenBudget] = None
+
+
+def get_token_budget() -> TokenBudget:
+    """Return the process-wide token budget, creating it from the environment on first use."""
+    global _token_budget
+    if _token_budget is None:
+        _token_budget = TokenBudget.from_env()
+    return _token_budget
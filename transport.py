@@ -0,0 +1,271 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+import httpx
+from instrumentation import PROVIDER_CALLS, TOKENS, stage
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 20.0
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+T = TypeVar("T")
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        """A bucket holding up to per_minute units that refills continuously over a minute."""
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount units are available; requests larger than the bucket wait for a full one."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        # May go negative when reconciling with reported usage; the deficit is paid back by refills
+        self.level -= amount
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        """
+        Client-side limiter for a provider's requests/minute and tokens/minute quotas.
+        Either quota may be None for no limit. Callers reserve an estimated token count
+        up front and reconcile it with the usage the provider reports afterwards.
+        """
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Take one request and tokens if both are available, else return how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self._requests:
+                wait = max(wait, self._requests.wait_time(1, now))
+            if self._tokens:
+                wait = max(wait, self._tokens.wait_time(tokens, now))
+            if wait == 0.0:
+                if self._requests:
+                    self._requests.take(1)
+                if self._tokens:
+                    self._tokens.take(tokens)
+            return wait
+
+    def acquire(self, tokens: int = 0):
+        while (wait := self._try_acquire(tokens)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0):
+        while (wait := self._try_acquire(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """Correct a reservation once the real token usage is known."""
+        if self._tokens is None or actual_tokens is None:
+            return
+        with self._lock:
+            self._tokens.take(actual_tokens - estimated_tokens)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Return whether an SDK or transport error is worth retrying (rate limits, overload, network)."""
+    if isinstance(error, httpx.TransportError):
+        return True
+    # Anthropic and OpenAI expose status_code, google-genai exposes code
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderTransport:
+    def __init__(
+        self,
+        provider: str,
+        limiter: RateLimiter,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff_base: float = DEFAULT_BACKOFF_BASE,
+        backoff_max: float = DEFAULT_BACKOFF_MAX,
+    ):
+        """
+        Rate limiting and retry policy for one provider.
+        Every attempt waits for the provider's limiter. Retryable errors are retried up
+        to max_retries times with full-jitter exponential backoff (a random delay up to
+        backoff_base * 2**attempt, capped at backoff_max), or the server's Retry-After.
+        """
+        self.provider = provider
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    @classmethod
+    def from_env(cls, provider: str) -> "ProviderTransport":
+        """
+        Build a transport from <PROVIDER>_RPM and <PROVIDER>_TPM quotas, split across
+        WORKERS processes, and
+        HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE and HTTP_BACKOFF_MAX.
+        """
+        prefix = provider.upper()
+        rpm = os.getenv(f"{prefix}_RPM")
+        tpm = os.getenv(f"{prefix}_TPM")
+        # Quotas are per API key; with WORKERS processes each one gets an equal share
+        workers = max(int(os.getenv("WORKERS", 1)), 1)
+        return cls(
+            provider,
+            RateLimiter(float(rpm) / workers if rpm else None, float(tpm) / workers if tpm else None),
+            max_retries=int(os.getenv("HTTP_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+            backoff_base=_env_float("HTTP_BACKOFF_BASE", DEFAULT_BACKOFF_BASE),
+            backoff_max=_env_float("HTTP_BACKOFF_MAX", DEFAULT_BACKOFF_MAX),
+        )
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        self.limiter.reconcile(estimated_tokens, actual_tokens)
+        if actual_tokens is not None:
+            TOKENS.labels(self.provider).inc(actual_tokens)
+
+    def call(self, request: Callable[[], T], estimated_tokens: int = 0, usage: Optional[Callable[[T], Optional[int]]] = None) -> T:
+        """
+        Run a blocking provider request under the rate limiter and retry policy.
+
+        Args:
+            request (Callable): Performs one attempt and returns the SDK response
+            estimated_tokens (int): Tokens reserved against the tokens/minute quota per attempt
+            usage (Optional[Callable]): Reads the actual token count from the response
+
+        Returns:
+            The SDK response of the first successful attempt
+        """
+        for attempt in range(self.max_retries + 1):
+            with stage("rate_limit_wait", self.provider):
+                self.limiter.acquire(estimated_tokens)
+            try:
+                response = request()
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    PROVIDER_CALLS.labels(self.provider, "error").inc()
+                    raise
+                PROVIDER_CALLS.labels(self.provider, "retry").inc()
+                time.sleep(self._backoff(attempt, e))
+                continue
+            PROVIDER_CALLS.labels(self.provider, "ok").inc()
+            self._record_usage(estimated_tokens, usage(response) if usage else None)
+            return response
+
+    async def call_async(
+        self,
+        request: Callable[[], Awaitable[T]],
+        estimated_tokens: int = 0,
+        usage: Optional[Callable[[T], Optional[int]]] = None,
+    ) -> T:
+        """Async variant of call; request returns an awaitable."""
+        for attempt in range(self.max_retries + 1):
+            with stage("rate_limit_wait", self.provider):
+                await self.limiter.acquire_async(estimated_tokens)
+            try:
+                response = await request()
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    PROVIDER_CALLS.labels(self.provider, "error").inc()
+                    raise
+                PROVIDER_CALLS.labels(self.provider, "retry").inc()
+                await asyncio.sleep(self._backoff(attempt, e))
+                continue
+            PROVIDER_CALLS.labels(self.provider, "ok").inc()
+            self._record_usage(estimated_tokens, usage(response) if usage else None)
+            return response
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", DEFAULT_MAX_KEEPALIVE_CONNECTIONS)),
+        keepalive_expiry=_env_float("HTTP_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY),
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        _env_float("HTTP_TIMEOUT", DEFAULT_TIMEOUT),
+        connect=_env_float("HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+    )
+
+
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_transports: dict[str, ProviderTransport] = {}
+
+
+def get_http_client() -> httpx.Client:
+    """Return the process-wide pooled HTTP client shared by all provider SDKs."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(limits=_limits(), timeout=_timeout(), follow_redirects=True)
+    return _http_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled async HTTP client shared by all provider SDKs."""
+    global _async_http_client
+    if _async_http_client is None:
+        _async_http_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout(), follow_redirects=True)
+    return _async_http_client
+
+
+def get_transport(provider: str) -> ProviderTransport:
+    """Return the shared transport for a provider, so all its extractors share one quota."""
+    if provider not in _transports:
+        _transports[provider] = ProviderTransport.from_env(provider)
+    return _transports[provider]
+
+
+async def close_http_clients():
+    global _http_client, _async_http_client
+    if _http_client is not None:
+        _http_client.close()
+        _http_client = None
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+        _async_http_client = None